@@ -102,6 +102,41 @@ DATABASES = {
         'OPTIONS': {
             'uri': True,
         },
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    },
+    # Reporting copy written by "manage.py snapshot".
+    'snapshot': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': 'file:' + \
+            os.path.join(BASE_DIR, 'data/snapshot.db') + '?mode=ro',
+        'OPTIONS': {
+            'uri': True,
+        },
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    },
+}
+
+# Applied to each SQLite connection by armgmt.sqlite.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'busy_timeout': 5000,
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    # Negative sizes are in KiB.
+    'cache_size': -64 * 1024,
+}
+
+# Send reads of views decorated with use_readonly to the readonly alias.
+DATABASE_ROUTERS = ['armgmt.routers.ReadonlyRouter']
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'data/cache'),
     },
 }
 
@@ -124,7 +159,21 @@ FILE_UPLOAD_HANDLERS = [
 
 PHONENUMBER_DEFAULT_REGION = 'US'
 
-EXPLORER_CONNECTIONS = {'Default': 'readonly'}
-EXPLORER_DEFAULT_CONNECTION = 'readonly'
+PDF_CACHE_DIR = os.path.join(BASE_DIR, 'data/pdfcache')
+PDF_CACHE_SIZE = 256 * 1024 * 1024
+LATEX_FORMAT_DIR = os.path.join(BASE_DIR, 'data/texfmt')
+LATEX_LOCK_DIR = os.path.join(BASE_DIR, 'data/texlock')
+LATEX_WORKERS = os.cpu_count() or 1
+LATEX_QUEUE = 8
+LATEX_QUEUE_TIMEOUT = 30
+LATEX_TIMEOUT = 60
+
+# Point USPS_URL at "manage.py usps_stub" to validate addresses offline.
+USPS_URL = SECRETS.get('USPS_URL',
+                       'https://secure.shippingapis.com/ShippingAPI.dll')
+USPS_CACHE_TTL = 90 * 24 * 60 * 60
+
+EXPLORER_CONNECTIONS = {'Snapshot': 'snapshot'}
+EXPLORER_DEFAULT_CONNECTION = 'snapshot'
 EXPLORER_DEFAULT_ROWS = 100
 EXPLORER_RECENT_QUERY_COUNT = 0
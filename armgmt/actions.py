@@ -0,0 +1,155 @@
+"""Normalize the names of invoice line actions and merge duplicates.
+
+A rule set is a JSON object of transforms applied in order to each
+action name, and of names mapped to a replacement name, or to null to
+clear the action of its line items. For example::
+
+    {
+        "transforms": ["strip", "lower", "singular"],
+        "names": {"1": null, "n/a": null, "hr": "hour"}
+    }
+
+Names are looked up after the transforms. Actions with the same
+normalized name are merged into one, preferring the action already of
+that name, so their line items keep their action under one row. The
+whole plan is computed in memory from one query, and line items are
+repointed with one UPDATE per batch of actions.
+
+Action ids by name are also cached for tools which resolve action names
+of many line items, and the cache is discarded whenever actions change.
+
+"""
+from collections import defaultdict
+import json
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, Count, IntegerField, Value, When
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from armgmt import reports
+from armgmt.models import InvoiceLineAction, InvoiceLineItem, bulk_update
+
+
+def singular(name):
+    if name.endswith('s') and not name.endswith('ss'):
+        return name[:-1]
+    return name
+
+
+transforms = {
+    'strip': lambda name: ' '.join(name.split()),
+    'lower': lambda name: name.lower(),
+    'title': lambda name: name.title(),
+    'singular': singular,
+}
+max_length = InvoiceLineAction._meta.get_field('name').max_length
+ids_key = 'actions:ids'
+
+
+def action_ids():
+    """Return action ids by name, cached until actions change."""
+    ids = cache.get(ids_key)
+    if ids is None:
+        ids = dict(InvoiceLineAction.objects.values_list('name', 'pk'))
+        cache.set(ids_key, ids, None)
+    return ids
+
+
+def invalidate():
+    """Discard cached action ids."""
+    cache.delete(ids_key)
+
+
+def load_rules(f):
+    """Read and validate a rule set from a JSON file."""
+    rules = json.load(f)
+    unknown = set(rules.get('transforms', [])) - set(transforms)
+    if unknown:
+        raise ValueError("Unknown transforms: %s." % ', '.join(
+            sorted(unknown)))
+    for name in rules.get('names', {}).values():
+        if name is not None and not 0 < len(name) <= max_length:
+            raise ValueError("Invalid action name: '%s'." % name)
+    return rules
+
+
+def normalize(name, rules):
+    """Return the name of an action under rules, or None to clear it."""
+    for transform in rules.get('transforms', []):
+        name = transforms[transform](name)
+    name = rules.get('names', {}).get(name, name)
+    if not name or len(name) > max_length:
+        return None
+    return name
+
+
+def plan(names, rules):
+    """Return the renames and merges of actions under rules.
+
+    Given names by action id, returns new names by id of the actions
+    renamed, and by id of the actions merged away, the id of the action
+    their line items move to, or None to clear them.
+
+    """
+    targets = {pk: normalize(name, rules) for (pk, name) in names.items()}
+    pks = defaultdict(list)
+    for (pk, target) in targets.items():
+        if target is not None:
+            pks[target].append(pk)
+    survivors = {
+        target: min(target_pks, key=lambda pk: (names[pk] != target, pk))
+        for (target, target_pks) in pks.items()
+    }
+    renames = {pk: target for (target, pk) in survivors.items()
+               if names[pk] != target}
+    merges = {pk: target and survivors[target]
+              for (pk, target) in targets.items()
+              if target is None or survivors[target] != pk}
+    return (renames, merges)
+
+
+def line_item_counts():
+    """Return the number of line items by action id."""
+    return dict(InvoiceLineItem.objects.order_by().exclude(action=None)
+                .values('action').annotate(count=Count('pk'))
+                .values_list('action', 'count'))
+
+
+def merge(renames, merges, batch_size=200):
+    """Repoint line items and rename and delete actions.
+
+    Returns the number of line items repointed.
+
+    """
+    moved = 0
+    merges = list(merges.items())
+    with transaction.atomic():
+        for i in range(0, len(merges), batch_size):
+            batch = merges[i:i + batch_size]
+            pks = [pk for (pk, _) in batch]
+            moved += InvoiceLineItem.objects.filter(action__in=pks).update(
+                action=Case(*[When(action=pk, then=Value(target))
+                              for (pk, target) in batch],
+                            output_field=IntegerField()),
+            )
+            InvoiceLineAction.objects.filter(pk__in=pks).delete()
+        # Rename through temporary names, since renamed actions may
+        # take each other's names.
+        actions = [InvoiceLineAction(pk=pk, name='\0%d' % pk)
+                   for pk in renames]
+        bulk_update(InvoiceLineAction, actions, ['name'])
+        for action in actions:
+            action.name = renames[action.pk]
+        bulk_update(InvoiceLineAction, actions, ['name'])
+        transaction.on_commit(invalidate)
+        transaction.on_commit(reports.invalidate)
+    return moved
+
+
+@receiver(post_save, sender=InvoiceLineAction)
+@receiver(post_delete, sender=InvoiceLineAction)
+def invalidate_ids(sender, **kwargs):
+    # Invalidate after commit so that no uncommitted action is cached.
+    transaction.on_commit(invalidate)
@@ -1,12 +1,17 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.contrib.admin.views.main import ORDER_VAR
 from django.contrib.auth.models import Group
 from django.db.models.fields import CharField
 
 from armgmt.models import (Biller, Client, Project,
                            Invoice, InvoiceLineItem, InvoiceLineAction,
                            Payment, Task)
+from armgmt import search
+from armgmt.documents import invoice_filename, invoice_latex
 from armgmt.forms import (DocumentForm, ProjectForm, InvoiceForm,
                           InvoiceLineItemForm, PaymentForm, TaskForm)
+from armgmt.render import merge_pdfs, render_cached
+from armgmt.views import pdf_response, zip_response
 
 
 # Customize admin site appearance.
@@ -18,6 +23,25 @@ admin.AdminSite.index_title = "Applemon DB"
 admin.site.unregister(Group)
 
 
+class IndexSearchMixin(object):
+    """Search the full-text index of ``armgmt.search``.
+
+    ``search_fields`` only enables the search box and lists the text
+    covered by ``search_index``. Results are ranked unless the user
+    sorts by a column.
+
+    """
+    search_index = []
+    search_lookups = []
+
+    def get_search_results(self, request, queryset, search_term):
+        if search_term:
+            queryset = search.search(queryset, self.search_index,
+                                     search_term, self.search_lookups,
+                                     rank=ORDER_VAR not in request.GET)
+        return (queryset, False)
+
+
 class ProjectInline(admin.TabularInline):
     model = Project
     form = ProjectForm
@@ -28,6 +52,10 @@ class ProjectInline(admin.TabularInline):
     extra = 0
     max_num = 0
 
+    def get_queryset(self, request):
+        qs = super(ProjectInline, self).get_queryset(request)
+        return qs.select_related('biller').with_totals()
+
 
 class InvoiceInline(admin.TabularInline):
     model = Invoice
@@ -39,6 +67,10 @@ class InvoiceInline(admin.TabularInline):
     extra = 0
     max_num = 0
 
+    def get_queryset(self, request):
+        qs = super(InvoiceInline, self).get_queryset(request)
+        return qs.select_related('biller').with_totals()
+
 
 class InvoiceLineItemInline(admin.TabularInline):
     model = InvoiceLineItem
@@ -71,7 +103,7 @@ class BillerAdmin(admin.ModelAdmin):
 
 
 @admin.register(Client)
-class ClientAdmin(admin.ModelAdmin):
+class ClientAdmin(IndexSearchMixin, admin.ModelAdmin):
     inlines = [TaskInline, ProjectInline, InvoiceInline]
     list_display = ['name', 'firm_name', 'contact_name', 'city', 'state',
                     'phone_number', 'owed']
@@ -80,8 +112,13 @@ class ClientAdmin(admin.ModelAdmin):
                        'billed', 'paid', 'owed']
     search_fields = [f.name for f in Client._meta.get_fields()
                      if isinstance(f, CharField)] + ['notes']
+    search_index = [(['client'], 'client_id', 'pk')]
     save_on_top = True
 
+    def get_queryset(self, request):
+        qs = super(ClientAdmin, self).get_queryset(request)
+        return qs.select_related('ledger')
+
     def changelist_view(self, request, extra_context=None):
         """Filter only active clients by default."""
         if 'active__exact' not in request.GET:
@@ -94,22 +131,18 @@ class ClientAdmin(admin.ModelAdmin):
             extra_context=extra_context)
 
 
-class DocumentAdmin(admin.ModelAdmin):
+class DocumentAdmin(IndexSearchMixin, admin.ModelAdmin):
     form = DocumentForm
     list_display_links = ['code']
     list_filter = ['biller', 'client']
     list_per_page = 100
-    search_fields = ['no', 'name', 'content', 'client__name', 'client__notes']
+    search_fields = ['^no', 'name', 'content', 'client__name',
+                     'client__notes']
+    # Document no are searched by prefix as integer ranges.
+    search_lookups = ['no__startswith']
     save_as = True
     save_on_top = True
 
-    def get_search_results(self, request, queryset, search_term):
-        # TODO: hack to treat DocumentNo as an integer by removing hyphen.
-        search_term = search_term.replace('-', '')
-        return super(
-            DocumentAdmin, self
-        ).get_search_results(request, queryset, search_term)
-
 
 @admin.register(Project)
 class ProjectAdmin(DocumentAdmin):
@@ -121,6 +154,14 @@ class ProjectAdmin(DocumentAdmin):
     date_hierarchy = 'start_date'
     search_fields = DocumentAdmin.search_fields + \
         ['task__name', 'task__content', 'invoice__name', 'invoice__content']
+    search_index = [
+        (['project', 'task', 'invoice'], 'project_id', 'pk'),
+        (['client'], 'client_id', 'client'),
+    ]
+
+    def get_queryset(self, request):
+        qs = super(ProjectAdmin, self).get_queryset(request)
+        return qs.select_related('biller', 'client').with_totals()
 
 
 @admin.register(Invoice)
@@ -134,6 +175,44 @@ class InvoiceAdmin(DocumentAdmin):
     search_fields = DocumentAdmin.search_fields + \
         ['project__name', 'project__content', 'task__name', 'task__content',
          'invoicelineitem__content', 'payment__notes']
+    search_index = [
+        (['invoice', 'task', 'lineitem', 'payment'], 'invoice_id', 'pk'),
+        (['project'], 'project_id', 'project'),
+        (['client'], 'client_id', 'client'),
+    ]
+    actions = ['download_zip', 'download_pdf']
+
+    def get_queryset(self, request):
+        qs = super(InvoiceAdmin, self).get_queryset(request)
+        return qs.select_related('biller', 'client').with_totals()
+
+    @staticmethod
+    def invoice_sources(queryset):
+        """Return (filename, LaTeX source) of each selected invoice."""
+        return [(invoice_filename(invoice), invoice_latex(invoice))
+                for invoice in queryset.order_by('no').for_rendering()]
+
+    def download_zip(self, request, queryset):
+        """Stream selected invoices in a ZIP file as they are rendered."""
+        del request  # unused
+        results = render_cached(self.invoice_sources(queryset))
+        return zip_response(results, 'invoices.zip')
+    download_zip.short_description = "Download selected invoices as ZIP"
+
+    def download_pdf(self, request, queryset):
+        """Render selected invoices concurrently into a single PDF."""
+        sources = self.invoice_sources(queryset)
+        results = dict(render_cached(sources))
+        errors = ["%s: %s" % (filename, result)
+                  for (filename, result) in results.items()
+                  if isinstance(result, Exception)]
+        if errors:
+            self.message_user(request, "Could not render " +
+                              "; ".join(errors), messages.ERROR)
+            return None
+        pdf = merge_pdfs(results[filename] for (filename, _) in sources)
+        return pdf_response(pdf, 'invoices.pdf')
+    download_pdf.short_description = "Download selected invoices as PDF"
 
 
 @admin.register(InvoiceLineAction)
@@ -151,7 +230,7 @@ class PaymentAdmin(admin.ModelAdmin):
 
 
 @admin.register(Task)
-class TaskAdmin(admin.ModelAdmin):
+class TaskAdmin(IndexSearchMixin, admin.ModelAdmin):
     form = TaskForm
     list_display = ['assignee', 'name', 'status',
                     'client', 'project', 'invoice', 'date_due', 'date_opened']
@@ -162,6 +241,12 @@ class TaskAdmin(admin.ModelAdmin):
                      'client__name', 'client__notes',
                      'project__name', 'project__content',
                      'invoice__name', 'invoice__content']
+    search_index = [
+        (['task'], 'object_id', 'pk'),
+        (['client'], 'client_id', 'client'),
+        (['project'], 'project_id', 'project'),
+        (['invoice'], 'invoice_id', 'invoice'),
+    ]
     date_hierarchy = 'date_opened'
     save_on_top = True
 
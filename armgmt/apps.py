@@ -4,3 +4,15 @@ from django.apps import AppConfig
 class ArmgmtConfig(AppConfig):
     name = 'armgmt'
     verbose_name = "Applemon Record Management"
+
+    def ready(self):
+        # Connect signal receivers maintaining the ledger, sequences,
+        # search index, line item phrases and cached actions and reports.
+        import armgmt.actions  # noqa: F401
+        import armgmt.ledger  # noqa: F401
+        import armgmt.phrases  # noqa: F401
+        import armgmt.reports  # noqa: F401
+        import armgmt.search  # noqa: F401
+        import armgmt.sequences  # noqa: F401
+        # Configure SQLite connections.
+        import armgmt.sqlite  # noqa: F401
@@ -0,0 +1,139 @@
+"""Close settled invoices before a date.
+
+A year close records the totals of each invoice dated before its date in
+an ``InvoiceClose`` row, and the totals of each client's invoices dated
+before its date in a ``ClientClose`` row. Balance queries start from the
+latest closing totals and only sum line items and payments of invoices
+dated on or after it, and closed invoices can no longer be changed.
+
+Invoices before 2012-09-01, which are considered paid in full, are closed
+by ``close_legacy``, which migration 0008 runs. Any payments recorded for
+them count on top of their amount, as they always have in client totals,
+so that a client's paid total is the sum of its invoices' paid totals.
+
+"""
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+
+from django.apps import apps as global_apps
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+
+from armgmt.models import (ClientClose, Invoice, InvoiceClose, YearClose,
+                           latest_close)
+
+
+legacy_date = date(2012, 9, 1)
+
+
+def unsettled_invoices(day):
+    """Return open invoices dated before day with a balance."""
+    return (Invoice.objects.open().filter(date__lt=day).with_totals()
+            .exclude(total_balance=0).select_related('biller')
+            .order_by('date', 'no'))
+
+
+def close_year(day, notes=''):
+    """Close invoices dated before day, which must all be settled."""
+    with transaction.atomic():
+        last = latest_close()
+        if last and day <= last.date:
+            raise ValidationError(
+                "Invoices before %s are already closed." % last.date)
+        invoices = list(Invoice.objects.open().filter(date__lt=day)
+                        .with_totals().select_related('biller'))
+        unsettled = [invoice for invoice in invoices if invoice.balance]
+        if unsettled:
+            raise ValidationError(
+                "Invoices with balances: %s." %
+                ', '.join(str(invoice.code) for invoice in unsettled))
+        year_close = YearClose.objects.create(date=day, notes=notes)
+        totals = defaultdict(lambda: [Decimal(0), Decimal(0)])
+        if last:
+            for row in ClientClose.objects.filter(year_close=last):
+                totals[row.client_id] = [row.billed, row.paid]
+        rows = []
+        for invoice in invoices:
+            rows.append(InvoiceClose(invoice=invoice, year_close=year_close,
+                                     amount=invoice.amount,
+                                     paid=invoice.paid))
+            totals[invoice.client_id][0] += invoice.amount
+            totals[invoice.client_id][1] += invoice.paid
+        InvoiceClose.objects.bulk_create(rows, batch_size=500)
+        ClientClose.objects.bulk_create(
+            (ClientClose(year_close=year_close, client_id=client_id,
+                         billed=billed, paid=paid)
+             for (client_id, (billed, paid)) in totals.items()),
+            batch_size=500,
+        )
+    return year_close
+
+
+def close_legacy(apps=global_apps):
+    """Close invoices before 2012-09-01 as paid in full, if there are any."""
+    YearClose = apps.get_model('armgmt', 'YearClose')
+    ClientClose = apps.get_model('armgmt', 'ClientClose')
+    Invoice = apps.get_model('armgmt', 'Invoice')
+    InvoiceClose = apps.get_model('armgmt', 'InvoiceClose')
+    InvoiceLineItem = apps.get_model('armgmt', 'InvoiceLineItem')
+    Payment = apps.get_model('armgmt', 'Payment')
+    cents = Decimal('.01')
+    if not Invoice.objects.filter(date__lt=legacy_date).exists():
+        return
+    year_close = YearClose.objects.create(
+        date=legacy_date,
+        notes="Invoices before 2012-09-01 are considered paid in full.",
+    )
+    amounts = dict(
+        InvoiceLineItem.objects.filter(invoice__date__lt=legacy_date)
+        .order_by().values('invoice')
+        .annotate(total=models.Sum(models.F('qty') * models.F('unit_price')))
+        .values_list('invoice', 'total')
+    )
+    payments = dict(
+        Payment.objects.filter(invoice__date__lt=legacy_date)
+        .order_by().values('invoice')
+        .annotate(total=models.Sum('amount'))
+        .values_list('invoice', 'total')
+    )
+    clients = defaultdict(lambda: [Decimal(0), Decimal(0)])
+    rows = []
+    for (pk, client_id) in Invoice.objects.filter(
+            date__lt=legacy_date).values_list('pk', 'client_id'):
+        amount = Decimal(amounts.get(pk) or 0).quantize(cents)
+        # Paid in full, and payments of these invoices, if any, on top.
+        paid = amount + Decimal(payments.get(pk) or 0).quantize(cents)
+        rows.append(InvoiceClose(invoice_id=pk, year_close=year_close,
+                                 amount=amount, paid=paid))
+        clients[client_id][0] += amount
+        clients[client_id][1] += paid
+    InvoiceClose.objects.bulk_create(rows, batch_size=500)
+    ClientClose.objects.bulk_create(
+        (ClientClose(year_close=year_close, client_id=client_id,
+                     billed=billed, paid=paid)
+         for (client_id, (billed, paid)) in clients.items()),
+        batch_size=500,
+    )
+
+
+def rebuild():
+    """Recompute the totals of year closes whose totals were deleted.
+
+    Closing totals are frozen, so this refuses while any remain. Loads
+    which replace closed invoices delete them and call this afterwards.
+
+    """
+    with transaction.atomic():
+        if (InvoiceClose.objects.exists() or
+                ClientClose.objects.exists()):
+            raise ValidationError("Closing totals are frozen and can only "
+                                  "be recomputed once deleted.")
+        closes = list(YearClose.objects.order_by('date')
+                      .values_list('date', 'notes'))
+        YearClose.objects.all().delete()
+        for (day, notes) in closes:
+            if day == legacy_date:
+                close_legacy()
+            else:
+                close_year(day, notes)
@@ -0,0 +1,42 @@
+"""Build LaTeX sources and filenames of invoices and statements."""
+import os
+
+from django.template.loader import render_to_string
+
+from armgmt.statement import build_statement
+
+
+logo_path = os.path.join(os.getcwd(), 'armgmt/templates/armgmt/logo')
+
+
+def invoice_latex(invoice):
+    """Render invoice LaTeX source.
+
+    Line items are taken from ``invoice.line_items`` if prefetched.
+
+    """
+    if hasattr(invoice, 'line_items'):
+        line_items = invoice.line_items
+    else:
+        line_items = (invoice.invoicelineitem_set.select_related('action')
+                      .order_by('position', 'date')
+                      .all())
+    dictionary = {'invoice': invoice,
+                  'line_items': line_items,
+                  'logo_path': logo_path}
+    return render_to_string('armgmt/invoice.tex', dictionary)
+
+
+def invoice_filename(invoice):
+    return '%s.pdf' % str(invoice.code)
+
+
+def statement_latex(client, today=None):
+    """Render statement LaTeX source of a client's open invoices."""
+    context = build_statement(client, today)
+    context['logo_path'] = logo_path
+    return render_to_string('armgmt/statement.tex', context)
+
+
+def statement_filename(client):
+    return 'statement-%s.pdf' % client.name.lower()
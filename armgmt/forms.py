@@ -1,9 +1,13 @@
+from datetime import date, timedelta
+
 from dal.autocomplete import ListSelect2, ModelSelect2
 from django import forms
 from django.contrib.admin.widgets import AdminDateWidget
+from django.urls import reverse
 
 from armgmt.models import (Biller, Client, Document, Project, Invoice,
                            Payment, Task, get_document_no)
+from armgmt.reports import groups
 
 
 def select(url, forward=None):
@@ -43,13 +47,42 @@ class DateWidget(AdminDateWidget):
         return forms.Media(js=['admin/js/%s' % path for path in js])
 
 
+class SuggestTextarea(forms.Textarea):
+    """Textarea listing suggestions of an autocomplete view as you type.
+
+    Picking a suggestion replaces the text, which otherwise stays free
+    to edit over multiple lines. Forwarded fields are sent as they are
+    by django-autocomplete-light widgets.
+
+    """
+
+    def __init__(self, url, forward=None, attrs=None):
+        super(SuggestTextarea, self).__init__(attrs)
+        self.url = url
+        self.forward = forward or []
+
+    def get_context(self, name, value, attrs):
+        context = super(SuggestTextarea, self).get_context(name, value,
+                                                           attrs)
+        context['widget']['attrs'].update({
+            'data-suggest-url': reverse(self.url),
+            'data-forward': ','.join(self.forward),
+        })
+        return context
+
+    class Media:
+        css = {'all': ['armgmt/suggest.css']}
+        js = ['armgmt/suggest.js']
+
+
 class DocumentForm(forms.ModelForm):
     """Base form for Projects and Invoices.
 
     Modifications of this model form:
 
-     - Auto-increment document no field to maximum no + 1.
-     - Includes initial/saved document no in autocomplete widget choices.
+     - Shows the next document no as placeholder of a blank no field,
+       which is allocated on save.
+     - Includes saved document no in autocomplete widget choices.
      - Limits client drop-down options to active clients.
 
     """
@@ -57,18 +90,18 @@ class DocumentForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         super(DocumentForm, self).__init__(*args, **kwargs)
 
-        # Auto-increment document no field.
-        # Add initial/saved document no to autocomplete widget choices.
+        # Leave a new document no blank, so that it is only allocated
+        # once the document is saved, and show the next no as a hint.
+        # Add saved document no to autocomplete widget choices.
         if 'no' in self.fields:
-            self.fields['no'].initial = str(get_document_no(self.Meta.model))
             if self.instance.no:
                 self.fields['no'].widget.choices = [
                     [self.instance.no, self.instance.no]
                 ]
             else:
-                self.fields['no'].widget.choices = [
-                    [self.fields['no'].initial, self.fields['no'].initial]
-                ]
+                self.fields['no'].widget.attrs['data-placeholder'] = str(
+                    get_document_no(self.Meta.model))
+                self.fields['no'].widget.choices = [['', '']]
 
         # Limit client drop-down options to active clients.
         if 'client' in self.fields:
@@ -111,10 +144,13 @@ class InvoiceForm(DocumentForm):
 class InvoiceLineItemForm(forms.ModelForm):
     """Form for invoice line items.
 
-    This form makes the content text box smaller.
+    Contents are suggested from previous line items of the invoice's
+    project and client.
 
     """
-    content = forms.CharField(widget=forms.Textarea)
+    content = forms.CharField(widget=SuggestTextarea(
+        'autocomplete-lineitem', forward=['client', 'project'],
+    ))
 
 
 class PaymentForm(forms.ModelForm):
@@ -178,3 +214,70 @@ class ToolForm(forms.Form):
     files = forms.FileField(widget=forms.ClearableFileInput(
         attrs={'multiple': True}
     ))
+
+
+class PaymentImportForm(ToolForm):
+    """Form for importing payments from CSV file upload."""
+
+    dry_run = forms.BooleanField(
+        required=False,
+        help_text="Only check payments without saving them.",
+    )
+
+
+class TimesheetForm(ToolForm):
+    """Form for adding invoice line items from timesheet CSV file upload."""
+
+    invoice = forms.ModelChoiceField(
+        queryset=Invoice.objects.all(),
+        widget=select('autocomplete-invoice'),
+        required=False,
+        help_text="Invoice to add line items to.",
+    )
+    project = forms.ModelChoiceField(
+        queryset=Project.objects.all(),
+        widget=select('autocomplete-project'),
+        required=False,
+        help_text="Project of a new invoice, unless an invoice is chosen.",
+    )
+    date = forms.DateField(initial=date.today,
+                           help_text="Date of a new invoice.")
+
+    def clean(self):
+        cleaned_data = super(TimesheetForm, self).clean()
+        invoice = cleaned_data.get('invoice')
+        project = cleaned_data.get('project')
+        if not invoice and not project:
+            raise forms.ValidationError("Choose an invoice or a project.")
+        if invoice and project and invoice.project_id != project.pk:
+            raise forms.ValidationError("Invoice must be of the project.")
+        return cleaned_data
+
+
+class ReportForm(forms.Form):
+    """Form for choosing the months, grouping and format of a report."""
+
+    start = forms.DateField(help_text="Month of the first row.")
+    end = forms.DateField(help_text="Month of the last row.")
+    group = forms.ChoiceField(choices=[(name, label)
+                                       for (name, label, _) in groups])
+    biller = forms.ModelChoiceField(Biller.objects.all(), required=False)
+    client = forms.ModelChoiceField(Client.objects.all(), required=False)
+    format = forms.ChoiceField(choices=[
+        ('html', "HTML"),
+        ('csv', "CSV"),
+        ('pdf', "PDF"),
+    ])
+
+    def clean(self):
+        cleaned_data = super(ReportForm, self).clean()
+        start = cleaned_data.get('start')
+        end = cleaned_data.get('end')
+        if start and end:
+            if start > end:
+                raise forms.ValidationError("Start must precede end.")
+            # Cover whole months.
+            cleaned_data['start'] = start.replace(day=1)
+            cleaned_data['end'] = (end.replace(day=1) +
+                                   timedelta(days=31)).replace(day=1)
+        return cleaned_data
@@ -0,0 +1,469 @@
+"""Read clients, projects, invoices and payments from a GnuCash book.
+
+The book is parsed once with gcinvoice. Each reader yields dicts of
+model field values in which related objects are given by their natural
+keys: client name, project no, invoice no and action name. Records which
+cannot be read are skipped and described in the ``errors`` list.
+
+Payments are not recorded in the book. They are read from a CSV file of
+rows of an invoice no followed by pairs of payment date and amount.
+
+The hash of each record loaded is stored in a ``GnuCashHash`` row, so
+that ``sync`` can compare a book with what was last loaded from it and
+only insert, update or delete the rows of records which changed. Rows
+are saved one at a time, so model signals keep derived tables current.
+
+"""
+from collections import OrderedDict, defaultdict
+import csv
+from datetime import datetime
+from decimal import Decimal
+import hashlib
+import re
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import ProtectedError
+
+from armgmt.models import (Client, DocumentNo, GnuCashHash, Invoice,
+                           InvoiceLineAction, InvoiceLineItem, Payment,
+                           Project, bulk_update)
+
+
+deleted = "DELETEME"
+
+# Models of each kind of record, in order of loading.
+kinds = OrderedDict([
+    ('client', Client),
+    ('project', Project),
+    ('invoice', Invoice),
+    ('lineitem', InvoiceLineItem),
+    ('payment', Payment),
+])
+
+# Lookups of record fields from stored rows by kind.
+lookups = {
+    'client': {name: name for name in [
+        'name', 'contact_name', 'firm_name', 'address2', 'city', 'state',
+        'zip_code']},
+    'project': {'no': 'no', 'client': 'client__name',
+                'start_date': 'start_date', 'name': 'name',
+                'content': 'content'},
+    'invoice': {'no': 'no', 'client': 'client__name',
+                'project': 'project__no', 'date': 'date',
+                'content': 'content'},
+    'lineitem': {'invoice': 'invoice__no', 'position': 'position',
+                 'date': 'date', 'content': 'content', 'qty': 'qty',
+                 'action': 'action__name', 'unit_price': 'unit_price'},
+    'payment': {'invoice': 'invoice__no', 'date': 'date',
+                'amount': 'amount', 'notes': 'notes'},
+}
+
+
+def read_book(path):
+    from gcinvoice import Gcinvoice
+    gc = Gcinvoice()
+    gc.parse(path)
+    return gc
+
+
+def str2date(text):
+    year = int(text.split('/')[2])
+    if year > 99:
+        return datetime.strptime(text.strip(), '%m/%d/%Y').date()
+    else:
+        return datetime.strptime(text.strip(), '%m/%d/%y').date()
+
+
+def to_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+def notes(text):
+    """Join GnuCash notes lines separated by double backslashes."""
+    if not text:
+        return ''
+    return "\n".join(n.strip() for n in text.split('\\\\'))
+
+
+def clients(gc, errors):
+    names = set()
+    for customer in gc.customers.values():
+        if customer['full_name'] == deleted:
+            continue
+        name = customer['name'].strip()
+        if name in names:
+            errors.append("Error adding client: duplicate client name: %s" %
+                          name)
+            continue
+        names.add(name)
+        address = list(customer['address'])
+        if len(address) == 2:
+            errors.append("Error adding client: no firm name for %s" % name)
+            address.insert(0, '')
+        elif len(address) == 4:
+            errors.append(
+                "Error adding client: dropping address line %s (%s)" %
+                (address[0], name))
+            del address[0]
+        if len(address) != 3:
+            errors.append("Error adding client: unreadable address for %s" %
+                          name)
+            continue
+        if ',' in address[2]:
+            (city, notcity) = address[2].split(',')
+            (state, zip_code) = notcity.strip().split()
+        else:
+            last_line = address[2].split()
+            city = ' '.join(last_line[:-2])
+            state = last_line[-2]
+            zip_code = last_line[-1]
+        yield {
+            'name': name,
+            'contact_name': customer['full_name'],
+            'firm_name': address[0],
+            'address2': address[1],
+            'city': city.strip(),
+            'state': state,
+            'zip_code': zip_code,
+        }
+
+
+def projects(gc, errors):
+    nos = set()
+    for job in gc.jobs.values():
+        if job['name'] == deleted:
+            continue
+        try:
+            no = DocumentNo(job['id'])
+        except Exception as e:
+            errors.append(
+                "Error adding project: unable to parse project no. %s: %s" %
+                (job['id'], e))
+            continue
+        if no in nos:
+            errors.append("Error adding project: duplicate project no. %s" %
+                          str(no))
+            continue
+        nos.add(no)
+        name = re.match(r'([ -]{0,1}\w+){0,12}',
+                        " ".join(job['name'].split()).strip()).group()
+        yield {
+            'no': no,
+            'client': job['owner']['name'].strip(),
+            'start_date': datetime(2000 + no[0], 1, 1).date(),
+            'name': name,
+            'content': notes(job['name']),
+        }
+
+
+def invoices(gc, errors):
+    """Yield posted invoices, each with a list of its line items."""
+    nos = set()
+    for invc in gc.invoices.values():
+        if invc['notes'] == deleted or not invc['date_posted']:
+            continue
+        try:
+            no = DocumentNo(invc['id'])
+        except Exception as e:
+            errors.append(
+                "Error adding invoice: unable to parse invoice no. %s: %s" %
+                (invc['id'], e))
+            continue
+        if no in nos:
+            errors.append("Error adding invoice: duplicate invoice no. %s" %
+                          str(no))
+            continue
+        try:
+            project_no = DocumentNo(invc['job']['id'])
+        except Exception as e:
+            errors.append(
+                "Error adding invoice: unable to parse project no. %s on "
+                "invoice no. %s: %s" % (invc['job']['id'], invc['id'], e))
+            continue
+        nos.add(no)
+        line_items = []
+        for (position, e) in enumerate(invc['entries']):
+            line_items.append({
+                'position': position,
+                'date': to_date(e['date']),
+                'content': e['description'] or '',
+                'qty': Decimal(str(e['qty'])),
+                'action': (e['action'] or '').strip() or None,
+                'unit_price': Decimal(str(e['price'])),
+            })
+        yield {
+            'no': no,
+            'client': invc['owner']['name'].strip(),
+            'project': project_no,
+            'date': to_date(invc['date_posted']),
+            'content': notes(invc['notes']),
+            'line_items': line_items,
+        }
+
+
+def payments(path, errors):
+    with open(path, 'r') as f:
+        for row in csv.reader(f):
+            number = row[0].strip().lower()
+            if number.startswith('invoice') or number.startswith('no'):
+                continue
+            try:
+                no = DocumentNo(number)
+            except Exception as e:
+                errors.append(
+                    "Error adding payment: unable to parse invoice no. %s: "
+                    "%s" % (number, e))
+                continue
+            for n in range(1, len(row) - 1, 2):
+                if not row[n]:
+                    break
+                yield {
+                    'invoice': no,
+                    'date': str2date(row[n]),
+                    'amount': Decimal(
+                        row[n + 1].replace(',', '').strip().strip('$')),
+                    'notes': '',
+                }
+
+
+def line_items(invoices):
+    """Yield the line items of invoices, each with its invoice no."""
+    for invoice in invoices:
+        for line_item in invoice['line_items']:
+            yield dict(line_item, invoice=invoice['no'])
+
+
+def read(book, payments_path, errors):
+    """Return lists of records read from a book and payments by kind."""
+    gc = read_book(book)
+    records = OrderedDict()
+    records['client'] = list(clients(gc, errors))
+    records['project'] = list(projects(gc, errors))
+    records['invoice'] = list(invoices(gc, errors))
+    records['lineitem'] = list(line_items(records['invoice']))
+    records['payment'] = list(payments(payments_path, errors))
+    return records
+
+
+def digest(fields):
+    """Return a hash of the field values of a record."""
+    values = []
+    for name in sorted(fields):
+        if name == 'line_items':
+            continue
+        value = fields[name]
+        if isinstance(value, Decimal):
+            value = format(value.normalize(), 'f')
+        values.append((name, str(value)))
+    return hashlib.sha1(repr(values).encode('utf-8')).hexdigest()
+
+
+def payment_order(fields):
+    return (str(fields['invoice']), fields['date'], fields['amount'])
+
+
+def keyed(kind, records):
+    """Yield (key, fields) of records of a kind.
+
+    Line items are keyed by invoice no and position, and payments by
+    invoice no and their order on the invoice by date and amount.
+    Payments are yielded in that order, and other records in the order
+    given.
+
+    """
+    if kind == 'payment':
+        records = sorted(records, key=payment_order)
+    counts = defaultdict(int)
+    for fields in records:
+        if kind == 'client':
+            key = fields['name']
+        elif kind in ('project', 'invoice'):
+            key = str(fields['no'])
+        elif kind == 'lineitem':
+            key = '%s/%s' % (str(fields['invoice']), fields['position'])
+        else:
+            invoice_no = str(fields['invoice'])
+            key = '%s/%s' % (invoice_no, counts[invoice_no])
+            counts[invoice_no] += 1
+        yield (key, fields)
+
+
+def digests(kind, records):
+    """Return hashes of records of a kind by key."""
+    return {key: digest(fields) for (key, fields) in keyed(kind, records)}
+
+
+def stored(kind):
+    """Return (pk, fields) of the stored rows of a kind by key."""
+    names = list(lookups[kind])
+    rows = [(row[0], dict(zip(names, row[1:]))) for row in
+            kinds[kind].objects.order_by('pk').values_list(
+                'pk', *[lookups[kind][name] for name in names])]
+    if kind == 'payment':
+        # Pair rows with keys in the order keyed() yields payments, with
+        # identical payments in pk order.
+        rows.sort(key=lambda row: payment_order(row[1]))
+    records = [fields for (_, fields) in rows]
+    return {key: (pk, fields)
+            for ((pk, _), (key, fields)) in zip(rows, keyed(kind, records))}
+
+
+def record_hashes(kind, record_digests):
+    """Store hashes by key of records of a kind loaded in bulk."""
+    pks = {key: pk for (key, (pk, _)) in stored(kind).items()}
+    GnuCashHash.objects.bulk_create(
+        (GnuCashHash(kind=kind, key=key, digest=record_digest,
+                     object_id=pks[key])
+         for (key, record_digest) in record_digests.items() if key in pks),
+        batch_size=500,
+    )
+
+
+def resolve(kind, fields, ids):
+    """Return model field values of a record with related objects by id."""
+    values = dict(fields)
+    values.pop('line_items', None)
+    if kind == 'client':
+        return values
+    for related in ['client', 'project', 'invoice']:
+        if related in values:
+            key = str(values.pop(related))
+            if key not in ids[related]:
+                raise ValidationError("Unknown %s %s." % (related, key))
+            values[related + '_id'] = ids[related][key]
+    if kind == 'invoice':
+        values['name'] = Project.objects.values_list(
+            'name', flat=True).get(pk=values['project_id'])
+    if kind == 'lineitem':
+        action = values.pop('action')
+        if action and action not in ids['action']:
+            ids['action'][action] = InvoiceLineAction.objects.create(
+                name=action).pk
+        values['action_id'] = ids['action'].get(action)
+    return values
+
+
+def error_message(e):
+    if isinstance(e, ValidationError):
+        return ' '.join(e.messages)
+    return e.args[0]
+
+
+def save_changed(kind, records, ids, counts, errors):
+    """Save records of a kind which changed since they were last loaded.
+
+    Records without a hash are matched to stored rows by key. The ids
+    of all rows are added to ids by key, and the hashes of records no
+    longer in the book are returned.
+
+    """
+    model = kinds[kind]
+    hashes = {h.key: h for h in GnuCashHash.objects.filter(kind=kind)}
+    rows = None
+    new_hashes = []
+    changed_hashes = []
+    ids[kind] = {}
+    for (key, fields) in keyed(kind, records):
+        record_digest = digest(fields)
+        h = hashes.pop(key, None)
+        if h and h.digest == record_digest:
+            ids[kind][key] = h.object_id
+            counts[kind]['unchanged'] += 1
+            continue
+        if h:
+            pk = h.object_id
+        else:
+            if rows is None:
+                rows = stored(kind)
+            (pk, row_fields) = rows.get(key, (None, None))
+            if pk and digest(row_fields) == record_digest:
+                new_hashes.append(GnuCashHash(kind=kind, key=key,
+                                              digest=record_digest,
+                                              object_id=pk))
+                ids[kind][key] = pk
+                counts[kind]['unchanged'] += 1
+                continue
+        obj = model.objects.filter(pk=pk).first() if pk else None
+        try:
+            values = resolve(kind, fields, ids)
+            if not obj:
+                obj = model()
+            for (name, value) in values.items():
+                setattr(obj, name, value)
+            if kind != 'client':
+                # Clients are not revalidated with USPS on load.
+                obj.clean()
+        except ValidationError as e:
+            errors.append("Error syncing %s %s: %s" % (
+                model._meta.verbose_name, key, error_message(e)))
+            if obj and obj.pk:
+                # Keep the row as it is, and retry on the next sync.
+                ids[kind][key] = obj.pk
+            continue
+        counts[kind]['updated' if obj.pk else 'inserted'] += 1
+        obj.save()
+        ids[kind][key] = obj.pk
+        if h:
+            h.digest = record_digest
+            h.object_id = obj.pk
+            changed_hashes.append(h)
+        else:
+            new_hashes.append(GnuCashHash(kind=kind, key=key,
+                                          digest=record_digest,
+                                          object_id=obj.pk))
+    GnuCashHash.objects.bulk_create(new_hashes, batch_size=500)
+    bulk_update(GnuCashHash, changed_hashes, ['digest', 'object_id'])
+    # Rows deleted in the web app stay deleted while unchanged.
+    pks = set(model.objects.values_list('pk', flat=True))
+    ids[kind] = {key: pk for (key, pk) in ids[kind].items() if pk in pks}
+    return hashes
+
+
+def delete_stale(kind, hashes, counts, errors):
+    """Delete the rows of records of a kind no longer in the book."""
+    model = kinds[kind]
+    objs = model.objects.in_bulk([h.object_id for h in hashes.values()])
+    deleted = []
+    for h in hashes.values():
+        obj = objs.get(h.object_id)
+        if obj:
+            try:
+                if kind in ('lineitem', 'payment'):
+                    obj.clean()
+                obj.delete()
+            except (ProtectedError, ValidationError) as e:
+                errors.append("Error deleting %s %s: %s" % (
+                    model._meta.verbose_name, h.key, error_message(e)))
+                continue
+            counts[kind]['deleted'] += 1
+        deleted.append(h.pk)
+    for i in range(0, len(deleted), 500):
+        GnuCashHash.objects.filter(pk__in=deleted[i:i + 500]).delete()
+
+
+def sync(records, errors):
+    """Write the changes of records by kind since they were last loaded.
+
+    Returns counts of inserted, updated, deleted and unchanged rows by
+    kind. Records which fail validation are skipped and described in
+    errors.
+
+    """
+    counts = {kind: defaultdict(int) for kind in kinds}
+    ids = {'action': dict(InvoiceLineAction.objects.values_list('name',
+                                                                'pk'))}
+    stale = {}
+    with transaction.atomic():
+        for (kind, kind_records) in records.items():
+            if kind in ('project', 'invoice'):
+                # Keep new document nos sequential.
+                kind_records = sorted(kind_records,
+                                      key=lambda fields: fields['no'])
+            stale[kind] = save_changed(kind, kind_records, ids, counts,
+                                       errors)
+        for kind in reversed(list(kinds)):
+            delete_stale(kind, stale[kind], counts, errors)
+    return counts
@@ -0,0 +1,167 @@
+"""Maintain denormalized invoice and client balances.
+
+Each invoice has an ``InvoiceBalance`` row and each client has a
+``ClientBalance`` row, so that balance lookups read a single row instead
+of aggregating every line item and payment on record.  Rows are updated
+in the same transaction as any save or delete of an ``Invoice``,
+``InvoiceLineItem`` or ``Payment`` through the signal receivers below.
+
+Client totals are always the sums of their invoices' totals, each
+rounded to cents. Since legacy invoices are closed with their payments
+counted on top of their amount, they count what ``Client.paid()`` does.
+
+Bulk operations which bypass model signals, such as ``QuerySet.update``
+and ``bulk_create``, must call ``refresh_invoices`` afterwards.
+
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from armgmt.models import (Client, ClientBalance, Invoice, InvoiceBalance,
+                           InvoiceLineItem, Payment, round_total)
+
+
+def refresh_invoices(invoice_ids):
+    """Recompute ledger rows of invoices and carry changes to clients.
+
+    Invoices which no longer exist have their rows deleted.
+
+    """
+    invoice_ids = set(i for i in invoice_ids if i is not None)
+    if not invoice_ids:
+        return
+    with transaction.atomic():
+        old_rows = {
+            b.invoice_id: b for b in
+            InvoiceBalance.objects.select_for_update()
+            .filter(invoice_id__in=invoice_ids)
+        }
+        new_rows = (Invoice.objects.with_totals()
+                    .filter(pk__in=invoice_ids)
+                    .values_list('pk', 'client_id',
+                                 'total_amount', 'total_paid'))
+        # Changes in (billed, paid) by client.
+        deltas = defaultdict(lambda: [Decimal(0), Decimal(0)])
+        for (invoice_id, client_id, amount, paid) in new_rows:
+            amount = round_total(amount)
+            paid = round_total(paid)
+            row = old_rows.pop(invoice_id, None)
+            if row:
+                deltas[row.client_id][0] -= row.amount
+                deltas[row.client_id][1] -= row.paid
+            else:
+                row = InvoiceBalance(invoice_id=invoice_id)
+            row.client_id = client_id
+            row.amount = amount
+            row.paid = paid
+            row.balance = amount - paid
+            row.save()
+            deltas[client_id][0] += amount
+            deltas[client_id][1] += paid
+        for row in old_rows.values():
+            # Invoice was deleted.
+            deltas[row.client_id][0] -= row.amount
+            deltas[row.client_id][1] -= row.paid
+            row.delete()
+        for (client_id, (billed, paid)) in deltas.items():
+            if billed or paid:
+                update_client(client_id, billed, paid)
+
+
+def update_client(client_id, billed, paid):
+    """Add billed and paid amounts to the ledger row of a client."""
+    try:
+        row = ClientBalance.objects.select_for_update().get(
+            client_id=client_id,
+        )
+    except ClientBalance.DoesNotExist:
+        refresh_client(client_id)
+        return
+    row.billed += billed
+    row.paid += paid
+    row.owed = row.billed - row.paid
+    row.save()
+
+
+def refresh_client(client_id):
+    """Recompute the ledger row of a client from its invoice rows."""
+    if not Client.objects.filter(pk=client_id).exists():
+        ClientBalance.objects.filter(client_id=client_id).delete()
+        return
+    totals = InvoiceBalance.objects.filter(client_id=client_id).aggregate(
+        billed=Sum('amount'), paid=Sum('paid'),
+    )
+    billed = totals['billed'] or Decimal(0)
+    paid = totals['paid'] or Decimal(0)
+    ClientBalance.objects.update_or_create(client_id=client_id, defaults={
+        'billed': billed,
+        'paid': paid,
+        'owed': billed - paid,
+    })
+
+
+def rebuild():
+    """Replace all ledger rows with totals recomputed from history."""
+    with transaction.atomic():
+        InvoiceBalance.objects.all().delete()
+        ClientBalance.objects.all().delete()
+        rows = [InvoiceBalance(invoice_id=invoice.pk,
+                               client_id=invoice.client_id,
+                               amount=invoice.amount, paid=invoice.paid,
+                               balance=invoice.balance)
+                for invoice in Invoice.objects.with_totals().order_by()]
+        InvoiceBalance.objects.bulk_create(rows, batch_size=500)
+        totals = defaultdict(lambda: [Decimal(0), Decimal(0)])
+        for row in rows:
+            totals[row.client_id][0] += row.amount
+            totals[row.client_id][1] += row.paid
+        ClientBalance.objects.bulk_create(
+            (ClientBalance(client_id=pk, billed=totals[pk][0],
+                           paid=totals[pk][1],
+                           owed=totals[pk][0] - totals[pk][1])
+             for pk in Client.objects.values_list('pk', flat=True)),
+            batch_size=500,
+        )
+
+
+@receiver(pre_save, sender=InvoiceLineItem)
+@receiver(pre_save, sender=Payment)
+def remember_invoice(sender, instance, **kwargs):
+    """Remember the saved invoice of a line item or payment being moved."""
+    if instance.pk:
+        instance._ledger_invoice_id = (
+            sender.objects.filter(pk=instance.pk)
+            .values_list('invoice_id', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=InvoiceLineItem)
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=InvoiceLineItem)
+@receiver(post_delete, sender=Payment)
+def update_invoice(sender, instance, **kwargs):
+    invoice_ids = [instance.invoice_id,
+                   getattr(instance, '_ledger_invoice_id', None)]
+    refresh_invoices(invoice_ids)
+
+
+@receiver(post_save, sender=Invoice)
+@receiver(post_delete, sender=Invoice)
+def update_invoice_client(sender, instance, **kwargs):
+    refresh_invoices([instance.pk])
+
+
+@receiver(post_save, sender=Client)
+def create_client(sender, instance, created, **kwargs):
+    if created:
+        ClientBalance.objects.get_or_create(client_id=instance.pk)
+
+
+@receiver(post_delete, sender=Client)
+def delete_client(sender, instance, **kwargs):
+    ClientBalance.objects.filter(client_id=instance.pk).delete()
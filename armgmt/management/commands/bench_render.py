@@ -0,0 +1,42 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from armgmt.documents import invoice_latex
+from armgmt.models import Invoice
+from armgmt.render import render_many
+
+
+class Command(BaseCommand):
+    help = "Benchmark invoice rendering throughput by number of workers."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, nargs='+', default=[1, 4, 8],
+            help="Numbers of concurrent workers to benchmark.",
+        )
+        parser.add_argument(
+            '--jobs', type=int, default=32,
+            help="Number of recent invoices to render per run.",
+        )
+
+    def handle(self, *args, **options):
+        invoices = Invoice.objects.select_related()[:options['jobs']]
+        sources = [(invoice.code, invoice_latex(invoice))
+                   for invoice in invoices]
+        if not sources:
+            raise CommandError("No invoices to render.")
+        for workers in options['workers']:
+            start = perf_counter()
+            errors = 0
+            for (code, result) in render_many(sources, workers=workers,
+                                              limit=False):
+                if isinstance(result, Exception):
+                    self.stderr.write("%s: %s" % (code, result))
+                    errors += 1
+            elapsed = perf_counter() - start
+            self.stdout.write(
+                "%d workers: %d documents in %.2fs (%.2f documents/s), "
+                "%d errors" % (workers, len(sources), elapsed,
+                               len(sources) / elapsed, errors)
+            )
@@ -0,0 +1,99 @@
+import os
+import sqlite3
+from tempfile import TemporaryDirectory
+from threading import Event, Thread
+from time import perf_counter, sleep
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from armgmt.sqlite import pragma_statements
+
+
+# Pragmas of a connection without armgmt.sqlite.
+default_pragmas = {'journal_mode': 'DELETE', 'synchronous': 'FULL'}
+
+read_sql = '''
+    SELECT invoice_id, SUM(qty * unit_price)
+    FROM armgmt_invoicelineitem
+    GROUP BY invoice_id
+'''
+
+
+class Command(BaseCommand):
+    help = ("Benchmark concurrent reads and writes on a copy of the database "
+            "with default and configured SQLite pragmas.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=4,
+                            help="Number of concurrent reading threads.")
+        parser.add_argument('--writers', type=int, default=2,
+                            help="Number of concurrent writing threads.")
+        parser.add_argument('--seconds', type=float, default=5,
+                            help="Duration of each run.")
+
+    def handle(self, *args, **options):
+        connection = connections[DEFAULT_DB_ALIAS]
+        connection.ensure_connection()
+        profiles = [
+            ('default', default_pragmas),
+            ('configured', getattr(settings, 'SQLITE_PRAGMAS', {})),
+        ]
+        with TemporaryDirectory() as tmp:
+            for (name, pragmas) in profiles:
+                path = os.path.join(tmp, '%s.db' % name)
+                copy = sqlite3.connect(path)
+                connection.connection.backup(copy)
+                copy.execute('CREATE TABLE bench (id INTEGER PRIMARY KEY, '
+                             'thread INTEGER, at REAL)')
+                copy.commit()
+                copy.close()
+                (reads, writes, errors, elapsed) = self.run(
+                    path, pragmas, options)
+                self.stdout.write(
+                    "%s: %.1f reads/s, %.1f writes/s, %d errors" % (
+                        name, reads / elapsed, writes / elapsed, errors)
+                )
+
+    def run(self, path, pragmas, options):
+        stop = Event()
+        counts = []
+
+        def work(n, write):
+            db = sqlite3.connect(path, isolation_level=None,
+                                 check_same_thread=False)
+            for statement in pragma_statements(pragmas):
+                db.execute(statement)
+            (done, errors) = (0, 0)
+            while not stop.is_set():
+                try:
+                    if write:
+                        db.execute('BEGIN IMMEDIATE')
+                        db.execute('INSERT INTO bench (thread, at) '
+                                   'VALUES (?, ?)', (n, perf_counter()))
+                        db.execute('COMMIT')
+                    else:
+                        db.execute(read_sql).fetchall()
+                    done += 1
+                except sqlite3.OperationalError:
+                    if db.in_transaction:
+                        db.execute('ROLLBACK')
+                    errors += 1
+            db.close()
+            counts.append((write, done, errors))
+
+        threads = [Thread(target=work, args=(n, n < options['writers']))
+                   for n in range(options['writers'] + options['readers'])]
+        start = perf_counter()
+        for thread in threads:
+            thread.start()
+        sleep(options['seconds'])
+        stop.set()
+        for thread in threads:
+            thread.join()
+        elapsed = perf_counter() - start
+        reads = sum(done for (write, done, _) in counts if not write)
+        writes = sum(done for (write, done, _) in counts if write)
+        errors = sum(errors for (_, _, errors) in counts)
+        return (reads, writes, errors, elapsed)
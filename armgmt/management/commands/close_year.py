@@ -0,0 +1,49 @@
+from datetime import datetime
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from armgmt.closing import close_year, unsettled_invoices
+from armgmt.models import latest_close
+
+
+class Command(BaseCommand):
+    help = ("Close settled invoices dated before a date, recording their "
+            "closing totals and those of their clients.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'date', nargs='?',
+            type=lambda s: datetime.strptime(s, '%Y-%m-%d').date(),
+            help="First day after the closed period, as YYYY-MM-DD.",
+        )
+        parser.add_argument('--notes', default='',
+                            help="Notes recorded with the close.")
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="Only list invoices with balances preventing the close.",
+        )
+
+    def handle(self, *args, **options):
+        if not options['date']:
+            close = latest_close()
+            if close:
+                self.stdout.write("Invoices before %s are closed." %
+                                  close.date)
+            else:
+                self.stdout.write("No invoices are closed.")
+            return
+        if options['dry_run']:
+            for invoice in unsettled_invoices(options['date']):
+                self.stdout.write("%s %s: balance %s" % (
+                    invoice.code, invoice.date, invoice.balance))
+            return
+        try:
+            year_close = close_year(options['date'], options['notes'])
+        except ValidationError as e:
+            raise CommandError('; '.join(e.messages))
+        self.stdout.write("Closed %d invoices of %d clients before %s." % (
+            year_close.invoiceclose_set.count(),
+            year_close.clientclose_set.count(),
+            year_close.date,
+        ))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from armgmt.tools.payments import import_payments
+
+
+class Command(BaseCommand):
+    help = ("Import payments from CSV files of invoice nos followed by pairs "
+            "of payment date and amount.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+', help="Payments CSV files.")
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="Only check payments without saving them.",
+        )
+
+    def handle(self, *args, **options):
+        for path in options['files']:
+            with open(path, newline='') as f:
+                (count, errors) = import_payments(f, options['dry_run'])
+            for (line, invoice, day, amount, message) in errors:
+                self.stderr.write("%s:%s: %s %s %s: %s" % (
+                    path, line, invoice, day, amount, message))
+            self.stdout.write("%s %d payments from %s with %d errors." % (
+                "Checked" if options['dry_run'] else "Imported",
+                count, path, len(errors),
+            ))
@@ -0,0 +1,213 @@
+from contextlib import contextmanager
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from armgmt import (actions, closing, gnucash, ledger, phrases, reports,
+                    search, sequences)
+from armgmt.models import (Client, ClientClose, GnuCashHash, Invoice,
+                           InvoiceClose, InvoiceLineAction, InvoiceLineItem,
+                           Payment, Project, YearClose,
+                           get_default_biller_id)
+
+
+# Tables replaced by a load, with those referencing others first.
+loaded_models = [InvoiceClose, ClientClose, Payment, InvoiceLineItem,
+                 InvoiceLineAction, Invoice, Project, Client, GnuCashHash]
+
+
+class Command(BaseCommand):
+    help = ("Replace all clients, projects, invoices and payments with those "
+            "of a GnuCash book and payments CSV file in one transaction, or "
+            "with --sync, only write the records changed since last loaded.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('book', nargs='?', default='accounting.gnucash',
+                            help="GnuCash book file.")
+        parser.add_argument('payments', nargs='?', default='payments.csv',
+                            help="Payments CSV file.")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Rows per INSERT statement.")
+        parser.add_argument(
+            '--sync', action='store_true',
+            help="Insert, update or delete only the rows of records which "
+                 "changed since they were last loaded, keeping all others.",
+        )
+        parser.add_argument(
+            '--force', action='store_true',
+            help="Replace all records even though closed years then have "
+                 "their frozen totals recomputed.",
+        )
+
+    @contextmanager
+    def phase(self, name):
+        start = perf_counter()
+        yield
+        self.stdout.write("%s: %.2fs" % (name, perf_counter() - start))
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        errors = []
+        if (not options['sync'] and not options['force'] and
+                YearClose.objects.exists()):
+            raise CommandError(
+                "Replacing all records recomputes the frozen totals of "
+                "closed years. Use --sync, or --force to replace them.")
+        start = perf_counter()
+        with self.phase("Parse"):
+            records = gnucash.read(options['book'], options['payments'],
+                                   errors)
+        if options['sync']:
+            self.sync(records, errors)
+            return
+        with self.phase("Hash"):
+            digests = {kind: gnucash.digests(kind, kind_records)
+                       for (kind, kind_records) in records.items()}
+        with transaction.atomic():
+            with self.phase("Delete"):
+                self.delete_all()
+            with self.phase("Clients"):
+                client_ids = self.create_clients(records['client'])
+            with self.phase("Projects"):
+                project_ids = self.create_projects(records['project'],
+                                                   client_ids, errors)
+            with self.phase("Invoices"):
+                invoice_ids = self.create_invoices(
+                    records['invoice'], client_ids, project_ids, errors)
+            with self.phase("Payments"):
+                self.create_payments(records['payment'], invoice_ids, errors)
+            with self.phase("Hashes"):
+                for (kind, kind_digests) in digests.items():
+                    gnucash.record_hashes(kind, kind_digests)
+            with self.phase("Closes and ledger"):
+                closing.rebuild()
+                ledger.rebuild()
+            with self.phase("Sequences, search and phrases"):
+                sequences.rebuild()
+                search.rebuild()
+                phrases.rebuild()
+            transaction.on_commit(actions.invalidate)
+            transaction.on_commit(reports.invalidate)
+        for error in errors:
+            self.stderr.write(error)
+        self.stdout.write(
+            "Loaded %d clients, %d projects, %d invoices, %d line items and "
+            "%d payments in %.2fs with %d errors." % (
+                Client.objects.count(), Project.objects.count(),
+                Invoice.objects.count(), InvoiceLineItem.objects.count(),
+                Payment.objects.count(), perf_counter() - start, len(errors),
+            )
+        )
+
+    def sync(self, records, errors):
+        with self.phase("Sync"):
+            counts = gnucash.sync(records, errors)
+        for error in errors:
+            self.stderr.write(error)
+        for (kind, model) in gnucash.kinds.items():
+            self.stdout.write(
+                "%s: %d inserted, %d updated, %d deleted, %d unchanged." % (
+                    model._meta.verbose_name_plural.capitalize(),
+                    counts[kind]['inserted'], counts[kind]['updated'],
+                    counts[kind]['deleted'], counts[kind]['unchanged'],
+                )
+            )
+
+    def delete_all(self):
+        with connection.cursor() as cursor:
+            for model in loaded_models:
+                table = model._meta.db_table
+                cursor.execute("DELETE FROM '{}'".format(table))
+                cursor.execute(
+                    "DELETE FROM sqlite_sequence where name = %s",
+                    [table],
+                )
+
+    def create(self, model, rows):
+        model.objects.bulk_create(rows, batch_size=self.batch_size)
+
+    def create_clients(self, clients):
+        """Create clients, returning their ids by name."""
+        biller_id = get_default_biller_id()
+        client_ids = {}
+        rows = []
+        for (pk, fields) in enumerate(clients, 1):
+            rows.append(Client(pk=pk, biller_id=biller_id, **fields))
+            client_ids[fields['name']] = pk
+        self.create(Client, rows)
+        return client_ids
+
+    def create_projects(self, projects, client_ids, errors):
+        """Create projects, returning (id, client id, name) by no."""
+        biller_id = get_default_biller_id()
+        project_ids = {}
+        rows = []
+        for fields in projects:
+            client_id = client_ids.get(fields.pop('client'))
+            if not client_id:
+                errors.append("Error adding project: unknown client of "
+                              "project no. %s" % str(fields['no']))
+                continue
+            pk = len(rows) + 1
+            rows.append(Project(pk=pk, biller_id=biller_id,
+                                client_id=client_id, **fields))
+            project_ids[fields['no']] = (pk, client_id, fields['name'])
+        self.create(Project, rows)
+        return project_ids
+
+    def create_invoices(self, invoices, client_ids, project_ids, errors):
+        """Create invoices and line items, returning invoice ids by no."""
+        biller_id = get_default_biller_id()
+        action_ids = dict(InvoiceLineAction.objects.values_list('name', 'pk'))
+        new_actions = []
+        invoice_ids = {}
+        rows = []
+        line_items = []
+        for fields in invoices:
+            no = fields['no']
+            client = fields.pop('client')
+            client_id = client_ids.get(client)
+            project_no = fields.pop('project')
+            if not client_id or project_no not in project_ids:
+                errors.append("Error adding invoice: unknown client %s or "
+                              "project no. %s of invoice no. %s" %
+                              (client, str(project_no), str(no)))
+                continue
+            (project_id, project_client_id, name) = project_ids[project_no]
+            if client_id != project_client_id:
+                errors.append(
+                    "Error adding invoice: error validating invoice no. %s "
+                    "with project %s and client %s: Project must have the "
+                    "same client." % (str(no), str(project_no), client))
+            pk = len(rows) + 1
+            for line_item in fields.pop('line_items'):
+                action = line_item.pop('action')
+                if action and action not in action_ids:
+                    action_ids[action] = len(action_ids) + 1
+                    new_actions.append(InvoiceLineAction(
+                        pk=action_ids[action], name=action))
+                line_items.append(InvoiceLineItem(
+                    invoice_id=pk, action_id=action_ids.get(action),
+                    **line_item))
+            rows.append(Invoice(pk=pk, biller_id=biller_id,
+                                client_id=client_id, project_id=project_id,
+                                name=name, **fields))
+            invoice_ids[no] = pk
+        self.create(InvoiceLineAction, new_actions)
+        self.create(Invoice, rows)
+        self.create(InvoiceLineItem, line_items)
+        return invoice_ids
+
+    def create_payments(self, payments, invoice_ids, errors):
+        rows = []
+        for fields in payments:
+            invoice_id = invoice_ids.get(fields['invoice'])
+            if not invoice_id:
+                errors.append("Error adding payment: unable to find invoice "
+                              "no. %s" % str(fields['invoice']))
+                continue
+            fields['invoice_id'] = invoice_id
+            del fields['invoice']
+            rows.append(Payment(**fields))
+        self.create(Payment, rows)
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from armgmt import actions
+from armgmt.models import InvoiceLineAction
+
+
+class Command(BaseCommand):
+    help = ("Normalize invoice line action names by a JSON rule set and "
+            "merge actions of the same name.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('rules', help="JSON rule set file.")
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="Only list the changes without making them.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['rules']) as f:
+                rules = actions.load_rules(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(e)
+        names = dict(InvoiceLineAction.objects.values_list('pk', 'name'))
+        (renames, merges) = actions.plan(names, rules)
+        if not renames and not merges:
+            self.stdout.write("No changes.")
+            return
+        counts = actions.line_item_counts()
+        for (pk, name) in sorted(renames.items(), key=lambda r: names[r[0]]):
+            self.stdout.write("Rename '%s' to '%s' (%d line items)." % (
+                names[pk], name, counts.get(pk, 0)))
+        for (pk, target) in sorted(merges.items(), key=lambda m: names[m[0]]):
+            if target is None:
+                self.stdout.write("Clear '%s' (%d line items)." % (
+                    names[pk], counts.get(pk, 0)))
+            else:
+                self.stdout.write("Merge '%s' into '%s' (%d line items)." % (
+                    names[pk], renames.get(target, names[target]),
+                    counts.get(pk, 0)))
+        if options['dry_run']:
+            return
+        moved = actions.merge(renames, merges)
+        self.stdout.write(
+            "Renamed %d and merged %d actions, repointing %d line items." % (
+                len(renames), len(merges), moved))
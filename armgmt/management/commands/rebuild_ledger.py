@@ -0,0 +1,93 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from armgmt import ledger
+from armgmt.models import (Client, ClientBalance, Invoice, InvoiceBalance,
+                           agg_total, get_close, get_ledger)
+
+
+class Command(BaseCommand):
+    help = "Rebuild invoice and client ledger balances and check them."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help="Only check ledger balances without rebuilding them.",
+        )
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            ledger.rebuild()
+            self.stdout.write("Rebuilt %d invoice and %d client balances." % (
+                InvoiceBalance.objects.count(), ClientBalance.objects.count(),
+            ))
+        client_totals = defaultdict(lambda: [Decimal(0), Decimal(0)])
+        errors = (self.check_invoices(client_totals) +
+                  self.check_clients(client_totals))
+        if errors:
+            raise CommandError("%d ledger balances do not match." % errors)
+        self.stdout.write("Ledger balances match.")
+
+    def report(self, obj, name, expected, actual):
+        self.stderr.write("%s %s: expected %s, ledger has %s." % (
+            obj, name, expected, actual,
+        ))
+
+    def check_invoices(self, client_totals):
+        """Compare ledger with agg_total of each invoice.
+
+        The expected totals are added to client_totals by client id.
+
+        """
+        errors = 0
+        for invoice in Invoice.objects.select_related('ledger', 'biller',
+                                                      'close'):
+            row = get_ledger(invoice)
+            if not row:
+                self.stderr.write("%s: missing ledger balance." % invoice)
+                errors += 1
+                continue
+            amount = agg_total(invoice.invoicelineitem_set)
+            close = get_close(invoice)
+            if close:
+                if close.amount != amount:
+                    self.report(invoice, 'closed amount', amount,
+                                close.amount)
+                    errors += 1
+                paid = close.paid
+            else:
+                paid = agg_total(invoice.payment_set)
+            client_totals[invoice.client_id][0] += amount
+            client_totals[invoice.client_id][1] += paid
+            for (name, expected, actual) in [
+                    ('amount', amount, row.amount),
+                    ('paid', paid, row.paid),
+                    ('balance', amount - paid, row.balance)]:
+                if expected != actual:
+                    self.report(invoice, name, expected, actual)
+                    errors += 1
+            if row.client_id != invoice.client_id:
+                self.report(invoice, 'client', invoice.client, row.client)
+                errors += 1
+        return errors
+
+    def check_clients(self, client_totals):
+        """Compare ledger with the expected totals of each client."""
+        errors = 0
+        for client in Client.objects.select_related('ledger'):
+            row = get_ledger(client)
+            if not row:
+                self.stderr.write("%s: missing ledger balance." % client)
+                errors += 1
+                continue
+            (billed, paid) = client_totals[client.pk]
+            for (name, expected, actual) in [
+                    ('billed', billed, row.billed),
+                    ('paid', paid, row.paid),
+                    ('owed', billed - paid, row.owed)]:
+                if expected != actual:
+                    self.report(client, name, expected, actual)
+                    errors += 1
+        return errors
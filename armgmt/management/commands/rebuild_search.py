@@ -0,0 +1,16 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+
+from armgmt import search
+
+
+class Command(BaseCommand):
+    help = ("Rebuild the full-text search index, e.g. after bulk changes "
+            "which bypass model signals.")
+
+    def handle(self, *args, **options):
+        start = perf_counter()
+        search.rebuild()
+        self.stdout.write("Rebuilt search index in %.2fs." % (
+            perf_counter() - start))
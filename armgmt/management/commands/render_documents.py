@@ -0,0 +1,204 @@
+from datetime import datetime
+import json
+import os
+from time import perf_counter
+import zipfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.text import get_valid_filename
+
+from armgmt import pdfcache
+from armgmt.documents import (invoice_filename, invoice_latex,
+                              statement_filename, statement_latex)
+from armgmt.models import Client, Invoice
+from armgmt.render import render_many
+
+
+manifest_name = '.manifest.json'
+
+
+def path_name(name, default=None):
+    """Return name with characters unsafe in file names removed.
+
+    A name left empty or naming a parent directory is replaced with
+    default.
+
+    """
+    name = get_valid_filename(name)
+    if not name.strip('.'):
+        return default
+    return name
+
+
+def parse_date(s):
+    return datetime.strptime(s, '%Y-%m-%d').date()
+
+
+class Command(BaseCommand):
+    help = ("Render invoices and client statements in parallel into a "
+            "directory tree or ZIP file, skipping up to date PDFs.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'output',
+            help="Output directory, or ZIP file if ending in .zip.",
+        )
+        parser.add_argument(
+            '--documents', choices=['all', 'invoices', 'statements'],
+            default='all', help="Documents to render.",
+        )
+        parser.add_argument('--biller', help="Biller code.")
+        parser.add_argument('--client', action='append',
+                            help="Client name (may be repeated).")
+        parser.add_argument('--since', type=parse_date,
+                            help="First invoice date (YYYY-MM-DD).")
+        parser.add_argument('--until', type=parse_date,
+                            help="Last invoice date (YYYY-MM-DD).")
+        parser.add_argument('--unpaid', action='store_true',
+                            help="Only unpaid invoices and clients owing.")
+        parser.add_argument(
+            '--workers', type=int, default=settings.LATEX_WORKERS,
+            help="Number of documents to render at once.",
+        )
+
+    def handle(self, *args, **options):
+        start = perf_counter()
+        jobs = []
+        if options['documents'] in ['all', 'invoices']:
+            jobs += self.invoice_jobs(options)
+        if options['documents'] in ['all', 'statements']:
+            jobs += self.statement_jobs(options)
+        self.stdout.write("Prepared %d documents in %.2fs." % (
+            len(jobs), perf_counter() - start))
+
+        if options['output'].endswith('.zip'):
+            output = ZipOutput(options['output'])
+        else:
+            output = DirectoryOutput(options['output'])
+        pending = {}
+        skipped = 0
+        errors = 0
+        try:
+            for (path, latex) in jobs:
+                key = pdfcache.cache_key(latex)
+                if output.is_current(path, key):
+                    skipped += 1
+                    continue
+                pdf = pdfcache.get(key)
+                if pdf is None:
+                    pending[path] = (key, latex)
+                else:
+                    output.write(path, key, pdf)
+
+            start = perf_counter()
+            sources = ((path, latex)
+                       for (path, (_key, latex)) in pending.items())
+            for (path, result) in render_many(sources, options['workers'],
+                                              limit=False):
+                if isinstance(result, Exception):
+                    self.stderr.write("Error rendering %s: %s" % (path,
+                                                                  result))
+                    errors += 1
+                    continue
+                key = pending[path][0]
+                pdfcache.put(key, result)
+                output.write(path, key, result)
+        finally:
+            # Keep the manifest of the PDFs written or finish the ZIP
+            # file even if rendering is interrupted.
+            output.close()
+        self.stdout.write(
+            "Rendered %d documents in %.2fs, %d cached, %d up to date." % (
+                len(pending) - errors, perf_counter() - start,
+                len(jobs) - len(pending) - skipped, skipped,
+            )
+        )
+        if errors:
+            raise CommandError("%d documents could not be rendered." % errors)
+
+    def invoice_jobs(self, options):
+        invoices = Invoice.objects.for_rendering()
+        if options['biller']:
+            invoices = invoices.filter(biller__code=options['biller'])
+        if options['client']:
+            invoices = invoices.filter(client__name__in=options['client'])
+        if options['since']:
+            invoices = invoices.filter(date__gte=options['since'])
+        if options['until']:
+            invoices = invoices.filter(date__lte=options['until'])
+        if options['unpaid']:
+            invoices = invoices.with_totals().filter(total_balance__gt=0)
+        for invoice in invoices:
+            path = os.path.join(
+                'invoices',
+                path_name(invoice.client.name,
+                          'client-%d' % invoice.client_id),
+                invoice_filename(invoice),
+            )
+            yield (path, invoice_latex(invoice))
+
+    def statement_jobs(self, options):
+        clients = Client.objects.select_related('biller', 'ledger')
+        if options['biller']:
+            clients = clients.filter(biller__code=options['biller'])
+        if options['client']:
+            clients = clients.filter(name__in=options['client'])
+        else:
+            clients = clients.filter(active=True)
+        if options['unpaid']:
+            clients = clients.filter(ledger__owed__gt=0)
+        for client in clients:
+            path = os.path.join('statements',
+                                path_name(statement_filename(client)))
+            yield (path, statement_latex(client))
+
+
+class DirectoryOutput(object):
+    """Write PDFs into a directory tree.
+
+    A manifest of the cache key of each PDF written is kept, so that
+    PDFs are not written again until their LaTeX source changes.
+
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, manifest_name)
+        try:
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+        except (IOError, ValueError):
+            self.manifest = {}
+
+    def is_current(self, path, key):
+        return (self.manifest.get(path) == key and
+                os.path.exists(os.path.join(self.directory, path)))
+
+    def write(self, path, key, pdf):
+        filename = os.path.join(self.directory, path)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, 'wb') as f:
+            f.write(pdf)
+        self.manifest[path] = key
+
+    def close(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.manifest_path, 'w') as f:
+            json.dump(self.manifest, f, indent=1, sort_keys=True)
+
+
+class ZipOutput(object):
+    """Write PDFs into a new ZIP file."""
+
+    def __init__(self, filename):
+        self.zip_file = zipfile.ZipFile(filename, 'w', zipfile.ZIP_STORED)
+
+    def is_current(self, path, key):
+        return False
+
+    def write(self, path, key, pdf):
+        self.zip_file.writestr(path, pdf)
+
+    def close(self):
+        self.zip_file.close()
@@ -0,0 +1,135 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import Lock
+from time import monotonic, perf_counter, sleep
+
+from django.core.management.base import BaseCommand, CommandError
+
+from armgmt.models import (Client, address_fields, bulk_update,
+                           cache_address_response, cached_address_response,
+                           usps_verify)
+
+
+# USPS accepts up to five addresses per request.
+max_batch_size = 5
+
+
+class RateLimit(object):
+    """Space calls from all threads at least 1 / rate seconds apart."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.lock = Lock()
+        self.next_time = monotonic()
+
+    def wait(self):
+        with self.lock:
+            now = monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            sleep(delay)
+
+
+class Command(BaseCommand):
+    help = ("Revalidate client addresses with USPS in concurrent batched "
+            "requests and save changed addresses in bulk.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help="Include inactive clients.")
+        parser.add_argument('--cached', action='store_true',
+                            help="Reuse unexpired cached USPS responses.")
+        parser.add_argument(
+            '--batch-size', type=int, default=max_batch_size,
+            help="Addresses per USPS request (at most %d)." % max_batch_size,
+        )
+        parser.add_argument('--workers', type=int, default=4,
+                            help="Number of concurrent USPS requests.")
+        parser.add_argument('--rate', type=float, default=5,
+                            help="Maximum USPS requests per second.")
+        parser.add_argument('--retries', type=int, default=3,
+                            help="Retries of failed USPS requests.")
+
+    def handle(self, *args, **options):
+        if not 1 <= options['batch_size'] <= max_batch_size:
+            raise CommandError("Batch size must be from 1 to %d." %
+                               max_batch_size)
+        start = perf_counter()
+        clients = Client.objects.only('pk', 'address_validation',
+                                      *address_fields)
+        if not options['all']:
+            clients = clients.filter(active=True)
+        responses = {}
+        pending = []
+        for client in clients:
+            address = self.get_address(client)
+            response = None
+            if options['cached']:
+                response = cached_address_response(address)
+            if response is None:
+                pending.append(client)
+            else:
+                responses[client] = response
+
+        batches = [pending[i:i + options['batch_size']]
+                   for i in range(0, len(pending), options['batch_size'])]
+        rate_limit = RateLimit(options['rate'])
+        errors = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            futures = {
+                executor.submit(self.verify, batch, rate_limit,
+                                options['retries']): batch
+                for batch in batches
+            }
+            for future in as_completed(futures):
+                batch = futures[future]
+                try:
+                    results = future.result()
+                except Exception as e:
+                    self.stderr.write("Error validating %s: %s" % (
+                        ', '.join(str(client) for client in batch), e))
+                    errors += len(batch)
+                    continue
+                for (client, response) in zip(batch, results):
+                    cache_address_response(self.get_address(client),
+                                           response)
+                    responses[client] = response
+
+        changed = []
+        rejected = 0
+        for (client, response) in responses.items():
+            if 'Error' in response:
+                self.stderr.write("%s: %s" % (client, response['Error']))
+                rejected += 1
+                continue
+            old = self.get_address(client) + (client.address_validation,)
+            client.update_address(response)
+            if self.get_address(client) + (client.address_validation,) != old:
+                changed.append(client)
+        bulk_update(Client, changed, address_fields + ['address_validation'])
+        elapsed = perf_counter() - start
+        self.stdout.write(
+            "Validated %d addresses with %d requests in %.2fs "
+            "(%.1f addresses/s): %d updated, %d rejected, %d failed." % (
+                len(responses), len(batches), elapsed,
+                len(responses) / elapsed, len(changed), rejected, errors,
+            )
+        )
+        if errors:
+            raise CommandError("%d addresses could not be validated." % errors)
+
+    @staticmethod
+    def get_address(client):
+        return tuple(getattr(client, field) for field in address_fields)
+
+    def verify(self, batch, rate_limit, retries):
+        """Validate a batch of clients, retrying with backoff on errors."""
+        addresses = [self.get_address(client) for client in batch]
+        for attempt in range(retries + 1):
+            rate_limit.wait()
+            try:
+                return usps_verify(addresses)
+            except OSError:
+                if attempt == retries:
+                    raise
+                sleep(2 ** attempt)
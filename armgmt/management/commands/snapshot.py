@@ -0,0 +1,128 @@
+import os
+import sqlite3
+from time import perf_counter, sleep
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+views_sql = os.path.join(settings.BASE_DIR, 'db_views.sql')
+
+# Indexed columns of the views materialized from views_sql.
+view_indexes = {
+    'invoices': [('year', 'month'), ('client_name',), ('no',)],
+    'payments': [('year', 'month'), ('client_name',), ('invoice_no',)],
+}
+
+
+def snapshot_path():
+    name = settings.DATABASES['snapshot']['NAME']
+    return name.split('?')[0].replace('file:', '', 1)
+
+
+def source_version(path):
+    """Return the modification times and sizes of a database's files."""
+    version = []
+    for suffix in ['', '-wal']:
+        try:
+            stat = os.stat(path + suffix)
+        except FileNotFoundError:
+            continue
+        # Opening the database creates an empty WAL file.
+        if suffix and not stat.st_size:
+            continue
+        version.append('%d:%d' % (stat.st_mtime_ns, stat.st_size))
+    return ' '.join(version)
+
+
+def snapshot_version(path):
+    try:
+        db = sqlite3.connect('file:%s?mode=ro' % path, uri=True)
+    except sqlite3.OperationalError:
+        return None
+    try:
+        return db.execute('SELECT version FROM snapshot').fetchone()[0]
+    except sqlite3.Error:
+        return None
+    finally:
+        db.close()
+
+
+def materialize(db, view, indexes):
+    """Replace a view with a table of its rows."""
+    db.execute('CREATE TABLE "_%s" AS SELECT * FROM "%s"' % (view, view))
+    db.execute('DROP VIEW "%s"' % view)
+    db.execute('ALTER TABLE "_%s" RENAME TO "%s"' % (view, view))
+    for columns in indexes:
+        db.execute('CREATE INDEX "%s_%s" ON "%s" (%s)' % (
+            view, '_'.join(columns), view,
+            ', '.join('"%s"' % c for c in columns),
+        ))
+
+
+class Command(BaseCommand):
+    help = ("Copy the database to the reporting snapshot used by SQL "
+            "Explorer, with the views of db_views.sql materialized into "
+            "indexed tables. Each refresh rebuilds the whole snapshot, "
+            "and is skipped while the database files are unchanged.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float,
+            help="Check for changes every interval seconds and refresh "
+                 "the snapshot if there are any.",
+        )
+        parser.add_argument(
+            '--force', action='store_true',
+            help="Refresh even if the database is unchanged.",
+        )
+        parser.add_argument(
+            '--pages', type=int, default=1024,
+            help="Pages copied at a time, between which writers may run.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            self.refresh(options['force'], options['pages'])
+            if not options['interval']:
+                break
+            sleep(options['interval'])
+
+    def refresh(self, force, pages):
+        """Rebuild the snapshot unless the database files are unchanged.
+
+        A single changed row rebuilds the whole snapshot, as rows
+        carry no modification times to copy only what changed.
+
+        """
+        connection = connections[DEFAULT_DB_ALIAS]
+        connection.ensure_connection()
+        path = snapshot_path()
+        version = source_version(connection.settings_dict['NAME'])
+        if not force and version == snapshot_version(path):
+            self.stdout.write("Snapshot is up to date.")
+            return
+        start = perf_counter()
+        tmp = path + '.tmp'
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        db = sqlite3.connect(tmp, isolation_level=None)
+        try:
+            connection.connection.backup(db, pages=pages)
+            db.execute('PRAGMA journal_mode = DELETE')
+            with open(views_sql) as f:
+                db.executescript(f.read())
+            db.execute('BEGIN')
+            for (view, indexes) in view_indexes.items():
+                materialize(db, view, indexes)
+            db.execute('CREATE TABLE snapshot (version TEXT, taken TEXT)')
+            db.execute("INSERT INTO snapshot VALUES (?, datetime('now'))",
+                       [version])
+            db.execute('COMMIT')
+            db.execute('ANALYZE')
+        finally:
+            db.close()
+        os.replace(tmp, path)
+        self.stdout.write("Wrote snapshot %s in %.2fs." % (
+            path, perf_counter() - start))
@@ -0,0 +1,102 @@
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from time import sleep
+from urllib.parse import parse_qs
+from xml.etree import ElementTree as ET
+
+from django.core.management.base import BaseCommand
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def verify(request):
+    """Build AddressValidateResponse by upper-casing request addresses.
+
+    Addresses without a street or without a city and state or ZIP Code
+    are rejected like USPS does.
+
+    """
+    response = ET.Element('AddressValidateResponse')
+    for address in request.findall('Address'):
+        fields = {child.tag: ' '.join((child.text or '').split())
+                  for child in address}
+        element = ET.SubElement(response, 'Address', ID=address.get('ID'))
+        if not fields.get('Address2') or not (
+                fields.get('Zip5') or
+                (fields.get('City') and fields.get('State'))):
+            error = ET.SubElement(element, 'Error')
+            ET.SubElement(error, 'Number').text = '-2147219401'
+            ET.SubElement(error, 'Source').text = 'usps_stub'
+            ET.SubElement(error, 'Description').text = 'Address Not Found.  '
+            continue
+        if fields.get('Address1'):
+            ET.SubElement(element, 'Address1').text = \
+                fields['Address1'].upper()
+        ET.SubElement(element, 'Address2').text = fields['Address2'].upper()
+        ET.SubElement(element, 'City').text = fields.get('City', '').upper()
+        ET.SubElement(element, 'State').text = fields.get('State', '').upper()
+        ET.SubElement(element, 'Zip5').text = fields.get('Zip5') or '00000'
+        ET.SubElement(element, 'Zip4').text = fields.get('Zip4') or '0000'
+    return response
+
+
+class Handler(BaseHTTPRequestHandler):
+    latency = 0
+
+    def do_GET(self):
+        self.respond(self.path.partition('?')[2])
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.respond(self.rfile.read(length).decode('utf-8'))
+
+    def respond(self, query):
+        params = parse_qs(query)
+        try:
+            request = ET.fromstring(params['XML'][0])
+            assert params['API'][0] == 'Verify'
+        except (KeyError, AssertionError, ET.ParseError):
+            response = ET.Element('Error')
+            ET.SubElement(response, 'Number').text = '80040B19'
+            ET.SubElement(response, 'Source').text = 'usps_stub'
+            ET.SubElement(response, 'Description').text = 'Bad request.'
+        else:
+            response = verify(request)
+        sleep(self.latency)
+        body = ET.tostring(response, encoding='UTF-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = ("Serve a local stub of the USPS address validation API for "
+            "offline testing. Set USPS_URL to http://HOST:PORT/.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8025)
+        parser.add_argument(
+            '--latency', type=float, default=0,
+            help="Seconds to delay each response to simulate USPS.",
+        )
+
+    def handle(self, *args, **options):
+        Handler.latency = options['latency']
+        server = ThreadingHTTPServer((options['host'], options['port']),
+                                     Handler)
+        self.stdout.write("Serving USPS stub at http://%s:%d/" % (
+            options['host'], options['port']))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
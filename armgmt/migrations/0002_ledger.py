@@ -0,0 +1,79 @@
+# Generated by Django 2.0.13 on 2026-10-18 09:54
+
+from datetime import date
+from decimal import Decimal
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_ledger(apps, schema_editor):
+    """Populate ledger rows with totals of existing invoices."""
+    Client = apps.get_model('armgmt', 'Client')
+    ClientBalance = apps.get_model('armgmt', 'ClientBalance')
+    Invoice = apps.get_model('armgmt', 'Invoice')
+    InvoiceBalance = apps.get_model('armgmt', 'InvoiceBalance')
+    InvoiceLineItem = apps.get_model('armgmt', 'InvoiceLineItem')
+    Payment = apps.get_model('armgmt', 'Payment')
+    cents = Decimal('.01')
+    amounts = dict(
+        InvoiceLineItem.objects.order_by().values('invoice')
+        .annotate(total=models.Sum(models.F('qty') * models.F('unit_price')))
+        .values_list('invoice', 'total')
+    )
+    payments = dict(
+        Payment.objects.order_by().values('invoice')
+        .annotate(total=models.Sum('amount'))
+        .values_list('invoice', 'total')
+    )
+    clients = {pk: [Decimal(0), Decimal(0)]
+               for pk in Client.objects.values_list('pk', flat=True)}
+    rows = []
+    for (pk, client_id, invoice_date) in Invoice.objects.values_list(
+            'pk', 'client_id', 'date'):
+        amount = Decimal(amounts.get(pk) or 0).quantize(cents)
+        if invoice_date < date(2012, 9, 1):
+            paid = amount
+        else:
+            paid = Decimal(payments.get(pk) or 0).quantize(cents)
+        rows.append(InvoiceBalance(invoice_id=pk, client_id=client_id,
+                                   amount=amount, paid=paid,
+                                   balance=amount - paid))
+        clients[client_id][0] += amount
+        clients[client_id][1] += paid
+    InvoiceBalance.objects.bulk_create(rows)
+    ClientBalance.objects.bulk_create(
+        ClientBalance(client_id=pk, billed=billed, paid=paid,
+                      owed=billed - paid)
+        for (pk, (billed, paid)) in clients.items()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('armgmt', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClientBalance',
+            fields=[
+                ('client', models.OneToOneField(on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='ledger', serialize=False, to='armgmt.Client')),
+                ('billed', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('paid', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('owed', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='InvoiceBalance',
+            fields=[
+                ('invoice', models.OneToOneField(on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='ledger', serialize=False, to='armgmt.Invoice')),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('paid', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('balance', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='armgmt.Client')),
+            ],
+        ),
+        migrations.RunPython(build_ledger, migrations.RunPython.noop),
+    ]
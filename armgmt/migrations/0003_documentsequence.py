@@ -0,0 +1,46 @@
+# Generated by Django 2.0.13 on 2026-10-18 10:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_sequences(apps, schema_editor):
+    """Start each sequence at the maximum existing document no."""
+    DocumentSequence = apps.get_model('armgmt', 'DocumentSequence')
+    sequences = {}
+    for document in ['project', 'invoice']:
+        model = apps.get_model('armgmt', document)
+        for (biller_id, no) in model.objects.values_list('biller', 'no'):
+            (yy, num) = divmod(int(no.replace('-', '')), 1000)
+            key = (biller_id, document, yy)
+            sequences[key] = max(sequences.get(key, 0), num)
+    DocumentSequence.objects.bulk_create(
+        DocumentSequence(biller_id=biller_id, document=document, year=yy,
+                         last=last)
+        for ((biller_id, document, yy), last) in sequences.items()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('armgmt', '0002_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentSequence',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('document', models.CharField(choices=[('project', 'Project'), ('invoice', 'Invoice')], max_length=15)),
+                ('year', models.PositiveSmallIntegerField()),
+                ('last', models.PositiveSmallIntegerField()),
+                ('biller', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='armgmt.Biller')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='documentsequence',
+            unique_together={('biller', 'document', 'year')},
+        ),
+        migrations.RunPython(build_sequences, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.0.13 on 2026-10-18 10:06
+
+import armgmt.models
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('armgmt', '0003_documentsequence'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='invoice',
+            name='no',
+            field=armgmt.models.DocumentNoField(db_index=True, validators=[armgmt.models.validate_DocumentNo]),
+        ),
+        migrations.AlterField(
+            model_name='project',
+            name='no',
+            field=armgmt.models.DocumentNoField(db_index=True, validators=[armgmt.models.validate_DocumentNo]),
+        ),
+    ]
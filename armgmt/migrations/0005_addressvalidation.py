@@ -0,0 +1,22 @@
+# Generated by Django 2.0.13 on 2026-10-18 10:07
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('armgmt', '0004_documentno_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AddressValidation',
+            fields=[
+                ('key', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('response', models.TextField()),
+                ('validated', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
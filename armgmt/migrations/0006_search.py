@@ -0,0 +1,82 @@
+# Generated by Django 2.0.13 on 2026-10-18 10:09
+
+from django.db import migrations, models
+
+
+kinds = ['client', 'project', 'invoice', 'lineitem', 'payment', 'task']
+
+
+def index_row(kind, obj):
+    """Return (body, client id, project id, invoice id) of an object."""
+    if kind == 'client':
+        fields = [f.name for f in obj._meta.get_fields()
+                  if isinstance(f, models.CharField)] + ['notes']
+        body = [getattr(obj, f) for f in fields]
+        return (body, obj.pk, None, None)
+    elif kind == 'project':
+        return ([obj.name, obj.content], obj.client_id, obj.pk, None)
+    elif kind == 'invoice':
+        return ([obj.name, obj.content],
+                obj.client_id, obj.project_id, obj.pk)
+    elif kind == 'lineitem':
+        return ([obj.content], None, None, obj.invoice_id)
+    elif kind == 'payment':
+        return ([obj.notes], None, None, obj.invoice_id)
+    elif kind == 'task':
+        return ([obj.name, obj.content, obj.status,
+                 obj.assignee.username, obj.author.username],
+                obj.client_id, obj.project_id, obj.invoice_id)
+
+
+def build_search(apps, schema_editor):
+    """Index existing clients, documents, line items, payments and tasks."""
+    model_names = {
+        'client': 'Client',
+        'project': 'Project',
+        'invoice': 'Invoice',
+        'lineitem': 'InvoiceLineItem',
+        'payment': 'Payment',
+        'task': 'Task',
+    }
+    with schema_editor.connection.cursor() as cursor:
+        for (index, kind) in enumerate(kinds):
+            model = apps.get_model('armgmt', model_names[kind])
+            objs = model.objects.all()
+            if kind == 'task':
+                objs = objs.select_related('assignee', 'author')
+            rows = []
+            for obj in objs.iterator():
+                (body, client_id, project_id, invoice_id) = index_row(
+                    kind, obj)
+                body = '\n'.join(str(s) for s in body if s)
+                # The rowid encodes the kind and object id.
+                rows.append((obj.pk * len(kinds) + index, body,
+                             client_id, project_id, invoice_id))
+            cursor.executemany(
+                'INSERT INTO armgmt_search (rowid, body, client_id, '
+                'project_id, invoice_id) VALUES (%s, %s, %s, %s, %s)',
+                rows,
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('armgmt', '0005_addressvalidation'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            '''
+            CREATE VIRTUAL TABLE armgmt_search USING fts5(
+                body,
+                client_id UNINDEXED,
+                project_id UNINDEXED,
+                invoice_id UNINDEXED,
+                tokenize = 'unicode61 remove_diacritics 2'
+            )
+            ''',
+            'DROP TABLE armgmt_search',
+        ),
+        migrations.RunPython(build_search, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 2.0.13 on 2026-10-18 10:15
+
+from collections import defaultdict
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_phrases(apps, schema_editor):
+    """Count contents of existing line items."""
+    LineItemPhrase = apps.get_model('armgmt', 'LineItemPhrase')
+    InvoiceLineItem = apps.get_model('armgmt', 'InvoiceLineItem')
+    # Last content, count and latest date of each (client, project, key).
+    phrases = defaultdict(lambda: [None, 0, None])
+    line_items = InvoiceLineItem.objects.order_by('date').values_list(
+        'content', 'date', 'invoice__client', 'invoice__project',
+    )
+    for (content, day, client_id, project_id) in line_items.iterator():
+        key = ' '.join(content.split()).lower()[:255]
+        if not key:
+            continue
+        for scope in [(None, None), (client_id, None),
+                      (client_id, project_id)]:
+            phrase = phrases[scope + (key,)]
+            phrase[0] = content
+            phrase[1] += 1
+            phrase[2] = day
+    LineItemPhrase.objects.bulk_create(
+        (LineItemPhrase(client_id=client_id, project_id=project_id,
+                        key=key, content=content, count=n, last_used=day)
+         for ((client_id, project_id, key), (content, n, day))
+         in phrases.items()),
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('armgmt', '0006_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LineItemPhrase',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255)),
+                ('content', models.TextField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('last_used', models.DateField()),
+                ('client', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='armgmt.Client')),
+                ('project', models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='armgmt.Project')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='lineitemphrase',
+            index=models.Index(fields=['project', 'client', 'key', 'count', 'last_used'], name='armgmt_line_project_08f7e8_idx'),
+        ),
+        migrations.RunPython(build_phrases, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,106 @@
+# Generated by Django 2.0.13 on 2026-10-18 10:23
+
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def close_legacy(apps, schema_editor):
+    """Close invoices before 2012-09-01 as paid in full."""
+    YearClose = apps.get_model('armgmt', 'YearClose')
+    ClientClose = apps.get_model('armgmt', 'ClientClose')
+    Invoice = apps.get_model('armgmt', 'Invoice')
+    InvoiceClose = apps.get_model('armgmt', 'InvoiceClose')
+    InvoiceLineItem = apps.get_model('armgmt', 'InvoiceLineItem')
+    Payment = apps.get_model('armgmt', 'Payment')
+    cents = Decimal('.01')
+    legacy = date(2012, 9, 1)
+    year_close = YearClose.objects.create(
+        date=legacy,
+        notes="Invoices before 2012-09-01 are considered paid in full.",
+    )
+    amounts = dict(
+        InvoiceLineItem.objects.filter(invoice__date__lt=legacy)
+        .order_by().values('invoice')
+        .annotate(total=models.Sum(models.F('qty') * models.F('unit_price')))
+        .values_list('invoice', 'total')
+    )
+    payments = (Payment.objects.filter(invoice__date__lt=legacy)
+                .order_by().values('invoice__client')
+                .annotate(total=models.Sum('amount'))
+                .values_list('invoice__client', 'total'))
+    # Client totals include payments of these invoices, if any.
+    clients = defaultdict(lambda: [Decimal(0), Decimal(0)])
+    for (client_id, total) in payments:
+        clients[client_id][1] += Decimal(total or 0).quantize(cents)
+    rows = []
+    for (pk, client_id) in Invoice.objects.filter(
+            date__lt=legacy).values_list('pk', 'client_id'):
+        amount = Decimal(amounts.get(pk) or 0).quantize(cents)
+        rows.append(InvoiceClose(invoice_id=pk, year_close=year_close,
+                                 amount=amount, paid=amount))
+        clients[client_id][0] += amount
+        clients[client_id][1] += amount
+    InvoiceClose.objects.bulk_create(rows, batch_size=500)
+    ClientClose.objects.bulk_create(
+        (ClientClose(year_close=year_close, client_id=client_id,
+                     billed=billed, paid=paid)
+         for (client_id, (billed, paid)) in clients.items()),
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('armgmt', '0007_lineitemphrase'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClientClose',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('billed', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('paid', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='armgmt.Client')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='InvoiceClose',
+            fields=[
+                ('invoice', models.OneToOneField(on_delete=django.db.models.deletion.PROTECT, primary_key=True, related_name='close', serialize=False, to='armgmt.Invoice')),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('paid', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='YearClose',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('notes', models.TextField(blank=True)),
+            ],
+            options={
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.AddField(
+            model_name='invoiceclose',
+            name='year_close',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='armgmt.YearClose'),
+        ),
+        migrations.AddField(
+            model_name='clientclose',
+            name='year_close',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='armgmt.YearClose'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='clientclose',
+            unique_together={('year_close', 'client')},
+        ),
+        migrations.RunPython(close_legacy, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 2.0.13 on 2026-10-18 10:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('armgmt', '0008_yearclose'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GnuCashHash',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('client', 'Client'), ('project', 'Project'), ('invoice', 'Invoice'), ('lineitem', 'Line item'), ('payment', 'Payment')], max_length=15)),
+                ('key', models.CharField(max_length=127)),
+                ('digest', models.CharField(max_length=40)),
+                ('object_id', models.PositiveIntegerField()),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='gnucashhash',
+            unique_together={('kind', 'key')},
+        ),
+    ]
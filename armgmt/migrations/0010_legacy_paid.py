@@ -0,0 +1,61 @@
+from datetime import date
+from decimal import Decimal
+
+from django.db import migrations, models
+
+
+def count_legacy_payments(apps, schema_editor):
+    """Count payments of legacy invoices in their paid totals.
+
+    Client ledger rows already counted them, as ``Client.paid()`` does,
+    while invoice ledger and closing rows counted legacy invoices as
+    paid by their amount only. Client rows are then recomputed as the
+    sums of their invoice rows.
+
+    """
+    ClientBalance = apps.get_model('armgmt', 'ClientBalance')
+    InvoiceBalance = apps.get_model('armgmt', 'InvoiceBalance')
+    InvoiceClose = apps.get_model('armgmt', 'InvoiceClose')
+    Payment = apps.get_model('armgmt', 'Payment')
+    cents = Decimal('.01')
+    legacy = date(2012, 9, 1)
+    payments = (
+        Payment.objects
+        .filter(invoice__close__year_close__date=legacy)
+        .order_by().values('invoice')
+        .annotate(total=models.Sum('amount'))
+        .values_list('invoice', 'total')
+    )
+    for (invoice_id, total) in payments:
+        total = Decimal(total or 0).quantize(cents)
+        close = InvoiceClose.objects.get(invoice_id=invoice_id)
+        close.paid = close.amount + total
+        close.save()
+        InvoiceBalance.objects.filter(invoice_id=invoice_id).update(
+            paid=close.paid, balance=close.amount - close.paid,
+        )
+    totals = {
+        client_id: (billed, paid)
+        for (client_id, billed, paid) in
+        InvoiceBalance.objects.order_by().values('client')
+        .annotate(billed=models.Sum('amount'), paid=models.Sum('paid'))
+        .values_list('client', 'billed', 'paid')
+    }
+    for row in ClientBalance.objects.all():
+        (billed, paid) = totals.get(row.client_id, (0, 0))
+        row.billed = billed
+        row.paid = paid
+        row.owed = billed - paid
+        row.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('armgmt', '0009_gnucashhash'),
+    ]
+
+    operations = [
+        migrations.RunPython(count_legacy_payments,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+from datetime import date
+
+from django.db import migrations
+
+
+def delete_empty_legacy_close(apps, schema_editor):
+    """Delete the legacy close of a database without legacy invoices."""
+    YearClose = apps.get_model('armgmt', 'YearClose')
+    YearClose.objects.filter(date=date(2012, 9, 1),
+                             invoiceclose__isnull=True).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('armgmt', '0010_legacy_paid'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_empty_legacy_close,
+                             migrations.RunPython.noop),
+    ]
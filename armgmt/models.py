@@ -1,38 +1,223 @@
-from datetime import date
+from datetime import date, timedelta
 from decimal import Decimal
+import hashlib
+import json
 from numbers import Number
 import re
 
 from django import forms
 from django.conf import settings
-from django.db import models
-from django.db.models import Max
-from django.core.exceptions import ValidationError
+from django.core.cache import cache
+from django.db import (IntegrityError, connections, models, router,
+                       transaction)
+from django.db.models import (Case, F, Max, OuterRef, Subquery, Value,
+                              When)
+from django.db.models.functions import Coalesce, Greatest
+from django.core.exceptions import (EmptyResultSet, ObjectDoesNotExist,
+                                    ValidationError)
 from django.urls import reverse
+from django.utils import timezone
 from localflavor.us.models import USStateField, USZipCodeField
 from phonenumber_field.modelfields import PhoneNumberField
 from usps.addressinformation import Address, USPSXMLError
 
 
-def agg_total(qset):
-    """Sum amounts in a QuerySet of invoice line items or payments."""
-    if qset.model is InvoiceLineItem:
-        agg = models.Sum(models.F('qty') * models.F('unit_price'))
-    elif qset.model is Payment:
-        agg = models.Sum('amount')
-    total = qset.aggregate(total=agg)['total']
+# Output field of summed amounts annotated by subquery.
+total_field = models.DecimalField(max_digits=12, decimal_places=2)
+
+
+def agg_amount(model):
+    """Return aggregate summing amounts of invoice line items or payments."""
+    if model is InvoiceLineItem:
+        return models.Sum(models.F('qty') * models.F('unit_price'))
+    elif model is Payment:
+        return models.Sum('amount')
+
+
+def round_total(total):
+    """Round a summed amount to cents, treating an empty sum as zero."""
     if total:
         return total.quantize(Decimal('.01'))
     else:
         return 0
 
 
+def agg_total(qset):
+    """Sum amounts in a QuerySet of invoice line items or payments."""
+    total = qset.aggregate(total=agg_amount(qset.model))['total']
+    return round_total(total)
+
+
+def subquery_total(qset, group_by):
+    """Sum amounts in a QuerySet of invoice line items or payments.
+
+    Unlike ``agg_total``, the sum is returned as a subquery expression
+    grouped by ``group_by``, so that ``qset`` may be filtered by an
+    ``OuterRef`` and used to annotate each row of another QuerySet.
+
+    """
+    qset = (qset.order_by().values(group_by)
+            .annotate(total=agg_amount(qset.model)).values('total'))
+    return Coalesce(Subquery(qset), 0, output_field=total_field)
+
+
+def get_ledger(obj):
+    """Return the maintained ledger balance of a client or invoice if any."""
+    try:
+        return obj.ledger
+    except ObjectDoesNotExist:
+        return None
+
+
+def get_close(invoice):
+    """Return the closing totals of an invoice if it is closed."""
+    try:
+        return invoice.close
+    except ObjectDoesNotExist:
+        return None
+
+
+def latest_close():
+    """Return the latest year close, before whose date invoices are closed."""
+    return YearClose.objects.order_by('-date').first()
+
+
+def closed_total(qset, field):
+    """Return subquery of a closing total, zero if there is none."""
+    return Coalesce(Subquery(qset.values(field)[:1]), 0,
+                    output_field=total_field)
+
+
 def clean_address(s):
     """Sanitize mailing address fields by removing punctuation."""
     s = ''.join(i for i in s if i.isalnum() or i.isspace() or i in '/\'-&')
     return ' '.join(s.split())
 
 
+address_fields = ['address1', 'address2', 'city', 'state', 'zip_code']
+
+
+def normalize_address(address1, address2, city, state, zip_code):
+    """Return address as a tuple ignoring case and whitespace."""
+    return tuple(' '.join(str(s).split()).upper()
+                 for s in [address1, address2, city, state, zip_code])
+
+
+def address_cache_key(address):
+    return hashlib.sha256('\n'.join(address).encode('utf-8')).hexdigest()
+
+
+def incr_address_counter(name):
+    key = 'usps:%s' % name
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+def address_stats():
+    """Return counters of USPS calls made and avoided."""
+    s = {name: cache.get('usps:%s' % name, 0)
+         for name in ['calls', 'hits', 'unchanged']}
+    s['cached'] = AddressValidation.objects.count()
+    return s
+
+
+def cached_address_response(address):
+    """Return unexpired cached USPS response of an address or None."""
+    cached = AddressValidation.objects.filter(
+        key=address_cache_key(normalize_address(*address)),
+        validated__gt=timezone.now() - timedelta(
+            seconds=settings.USPS_CACHE_TTL),
+    ).first()
+    if cached:
+        incr_address_counter('hits')
+        return json.loads(cached.response)
+    return None
+
+
+def cache_address_response(address, response):
+    """Cache USPS response under an address and its standardized form."""
+    keys = {address_cache_key(normalize_address(*address))}
+    if 'Error' not in response:
+        keys.add(address_cache_key(normalize_address(
+            response.get('Address1', address[0]) or '', response['Address2'],
+            response['City'], response['State'], response['FullZip'],
+        )))
+    for key in keys:
+        AddressValidation.objects.update_or_create(key=key, defaults={
+            'response': json.dumps(response),
+            'validated': timezone.now(),
+        })
+
+
+def usps_verify(addresses):
+    """Validate up to five addresses in a single USPS request.
+
+    Take (address1, address2, city, state, zip_code) tuples and return
+    the USPS response of each, with an 'Error' key if it was rejected.
+
+    """
+    requests = []
+    for (address1, address2, city, state, zip_code) in addresses:
+        (zip5, _, zip4) = zip_code.partition('-')
+        requests.append({'FirmName': '', 'Address1': address1,
+                         'Address2': address2, 'City': city, 'State': state,
+                         'Zip5': zip5, 'Zip4': zip4})
+    address_validator = Address(user_id=settings.SECRETS['USPS_USER_ID'],
+                                url=settings.USPS_URL)
+    incr_address_counter('calls')
+    try:
+        responses = address_validator.execute(address_validator.USER_ID,
+                                              requests)
+    except USPSXMLError as e:
+        if len(addresses) == 1:
+            return [{'Error': str(e)}]
+        # A single rejected address fails the whole request.
+        return [usps_verify([address])[0] for address in addresses]
+    return [address_validator.format_response(response, False)
+            for response in responses]
+
+
+def validate_address(address1, address2, city, state, zip_code):
+    """Validate mailing address with USPS, returning its response.
+
+    Responses, including rejections, are cached in the database for
+    ``settings.USPS_CACHE_TTL`` seconds under the normalized address,
+    and validated addresses also under their standardized form. Raise
+    ValidationError if USPS rejects the address.
+
+    """
+    address = (address1, address2, city, state, zip_code)
+    response = cached_address_response(address)
+    if response is None:
+        response = usps_verify([address])[0]
+        cache_address_response(address, response)
+    if 'Error' in response:
+        raise ValidationError(response['Error'])
+    return response
+
+
+def bulk_update(model, objs, fields, batch_size=100):
+    """Save fields of objects with one UPDATE per batch.
+
+    Like ``QuerySet.bulk_update()`` of Django 2.2, which this version
+    lacks. Signals are not sent.
+
+    """
+    with transaction.atomic():
+        for i in range(0, len(objs), batch_size):
+            batch = objs[i:i + batch_size]
+            updates = {
+                field: Case(*[When(pk=obj.pk, then=Value(getattr(obj, field)))
+                              for obj in batch],
+                            output_field=model._meta.get_field(field))
+                for field in fields
+            }
+            model.objects.filter(pk__in=[obj.pk for obj in batch]).update(
+                **updates)
+
+
 def get_default_biller_id():
     """Return default biller if exists or the first primary id."""
     try:
@@ -41,14 +226,111 @@ def get_default_biller_id():
         return 1
 
 
-def get_document_no(document, biller=None):
-    """Generate a document no by incrementing maximum no."""
+def document_year(document_date=None):
+    """Return two-digit year prefix of document no for a date."""
+    if not document_date:
+        document_date = date.today()
+    return document_date.year % 100
+
+
+def document_sequence_cache_key(document, biller_id, yy):
+    return 'docno:%s:%s:%02d' % (document._meta.model_name, biller_id, yy)
+
+
+def document_sequence(document, biller_id, yy):
+    return DocumentSequence.objects.filter(
+        document=document._meta.model_name, biller_id=biller_id, year=yy,
+    )
+
+
+def create_document_sequence(document, biller_id, yy, last):
+    """Create sequence, returning False if it was created concurrently."""
+    try:
+        with transaction.atomic():
+            DocumentSequence.objects.create(
+                document=document._meta.model_name, biller_id=biller_id,
+                year=yy, last=last,
+            )
+    except IntegrityError:
+        return False
+    return True
+
+
+def get_document_no(document, biller=None, document_date=None):
+    """Return the next document no without allocating it.
+
+    The hint is cached until a document no of the same year is
+    allocated, reserved or released, so forms and autocomplete views
+    never scan the documents.
+
+    """
     if not biller:
         biller = get_default_biller_id()
-    qs = document.objects.filter(biller=biller)
-    max_document_no = qs.aggregate(Max('no'))['no__max']
-    if max_document_no and max_document_no != 'None':
-        return DocumentNo(max_document_no) + 1
+    biller_id = int(getattr(biller, 'pk', biller))
+    yy = document_year(document_date)
+    key = document_sequence_cache_key(document, biller_id, yy)
+    no = cache.get(key)
+    if no is None:
+        last = (document_sequence(document, biller_id, yy)
+                .values_list('last', flat=True).first())
+        if last is None:
+            last = max_document_num(document, biller_id, yy)
+        no = int(DocumentNo((yy, last + 1)))
+        cache.set(key, no, 3600)
+    return DocumentNo(no)
+
+
+def max_document_num(document, biller_id, yy):
+    """Return the maximum document no suffix of a year or 100 if none."""
+    max_no = document.objects.filter(
+        biller=biller_id, no__gte=(yy, 101), no__lte=(yy, 999),
+    ).aggregate(Max('no'))['no__max']
+    if max_no and max_no != 'None':
+        return DocumentNo(max_no)[1]
+    return 100
+
+
+def allocate_document_no(document, biller, document_date=None):
+    """Atomically allocate the next document no of the document's year.
+
+    Concurrent callers never receive the same no. The allocation is
+    rolled back together with the enclosing transaction.
+
+    """
+    biller_id = int(getattr(biller, 'pk', biller))
+    yy = document_year(document_date)
+    sequence = document_sequence(document, biller_id, yy)
+    with transaction.atomic():
+        if not sequence.update(last=F('last') + 1):
+            last = max_document_num(document, biller_id, yy) + 1
+            if not create_document_sequence(document, biller_id, yy, last):
+                sequence.update(last=F('last') + 1)
+        last = sequence.values_list('last', flat=True).get()
+    cache.delete(document_sequence_cache_key(document, biller_id, yy))
+    return DocumentNo((yy, last))
+
+
+def reserve_document_no(document, biller, no):
+    """Mark a document no as used so it is never allocated again."""
+    biller_id = int(getattr(biller, 'pk', biller))
+    (yy, num) = DocumentNo(no)
+    sequence = document_sequence(document, biller_id, yy)
+    with transaction.atomic():
+        if not sequence.update(last=Greatest('last', num)):
+            last = max(max_document_num(document, biller_id, yy), num)
+            if not create_document_sequence(document, biller_id, yy, last):
+                sequence.update(last=Greatest('last', num))
+    cache.delete(document_sequence_cache_key(document, biller_id, yy))
+
+
+def release_document_no(document, biller, no):
+    """Return a deleted document no to its sequence if it was the last."""
+    biller_id = int(getattr(biller, 'pk', biller))
+    (yy, num) = DocumentNo(no)
+    document_sequence(document, biller_id, yy).filter(last=num).update(
+        last=max_document_num(document, biller_id, yy),
+    )
+    cache.delete(document_sequence_cache_key(document, biller_id, yy))
 
 
 def str2num(s, fmt=tuple):
@@ -74,27 +356,62 @@ def str2num(s, fmt=tuple):
         return fmt(yy * 1000 + num)
 
 
+def document_gaps(cls):
+    """Return (biller code, missing document no) of every gap in one query.
+
+    Each document no is compared to the previous no of the same biller
+    and year with a window function. Years before 2011 are ignored.
+
+    """
+    sql = '''
+        SELECT biller.code, seq.prev, seq.no FROM (
+            SELECT biller_id, no, LAG(no) OVER (
+                PARTITION BY biller_id, no / 1000 ORDER BY no
+            ) AS prev
+            FROM {table}
+        ) AS seq
+        JOIN {biller_table} AS biller ON biller.id = seq.biller_id
+        WHERE seq.no - seq.prev > 1 AND seq.no >= %s
+        ORDER BY biller.code, seq.no
+    '''.format(table=cls._meta.db_table,
+               biller_table=Biller._meta.db_table)
+    with connections[router.db_for_read(cls)].cursor() as cursor:
+        cursor.execute(sql, [int(DocumentNo((11, 101)))])
+        rows = cursor.fetchall()
+    return [(code, DocumentNo(no))
+            for (code, prev, next_no) in rows
+            for no in range(prev + 1, next_no)]
+
+
 def validate_seq_documents(cls, biller, new_no=None):
-    """Validate that document no are all sequential."""
-    q = cls.objects.filter(biller=biller).values_list('no').order_by()
-    if new_no:
-        new_no = DocumentNo(new_no)
-        q = q.filter(no__lt=new_no)
-    nos = [DocumentNo(i[0]) for i in q]
-    if new_no:
-        nos.append(new_no)
-    old_no = None
-    for no in nos:
-        if no[0] < 11:
-            # Ignore missing data before 2011.
-            continue
-        if old_no and old_no[0] == no[0] and old_no + 1 != no:
-            raise ValidationError(
-                "{doc} not sequential - missing {doc} {no}.".format(
-                    doc=cls.__name__, no=old_no + 1
+    """Validate that document no are all sequential.
+
+    Given a new no, only check that the previous no of its year exists,
+    which is a single index lookup.
+
+    """
+    if not new_no:
+        for (code, no) in document_gaps(cls):
+            if code == biller.code:
+                raise ValidationError(
+                    "{doc} not sequential - missing {doc} {no}.".format(
+                        doc=cls.__name__, no=no
+                    )
                 )
+        return
+    new_no = DocumentNo(new_no)
+    if new_no[0] < 11:
+        # Ignore missing data before 2011.
+        return
+    old_no = cls.objects.filter(
+        biller=biller, no__gte=(new_no[0], 101), no__lt=new_no,
+    ).order_by('-no').values_list('no', flat=True).first()
+    if old_no and DocumentNo(old_no) + 1 != new_no:
+        raise ValidationError(
+            "{doc} not sequential - missing {doc} {no}.".format(
+                doc=cls.__name__, no=DocumentNo(old_no) + 1
             )
-        old_no = no
+        )
 
 
 class DocumentNo(tuple):
@@ -191,6 +508,95 @@ class DocumentNoField(models.Field):
         )
 
 
+document_no_pattern = re.compile(
+    r'^(?:([A-Z])([NP]))?(?:(\d{1,2})-(\d{0,3})|(\d{1,5}))$',
+    re.IGNORECASE)
+# Letters following the biller code in document codes.
+document_letters = {'project': 'P', 'invoice': 'N'}
+
+
+def document_no_range(s):
+    """Return range of integer document no matching a partial no or None.
+
+    Accepted forms are yy-num prefixes such as '17-1' or '17-', and
+    yynum prefixes such as '17102', optionally preceded by a document
+    code prefix such as 'CN'.
+
+    """
+    match = document_no_pattern.match(str(s).strip())
+    if not match:
+        return None
+    (_code, _letter, yy, num, digits) = match.groups()
+    if digits is None:
+        digits = '%02d' % int(yy) + num
+    scale = 10 ** (5 - len(digits))
+    return (int(digits) * scale, (int(digits) + 1) * scale - 1)
+
+
+def document_no_prefix(s):
+    """Return upper case (biller code, document letter) of a partial no.
+
+    Both are None if the partial no has no document code prefix.
+
+    """
+    match = document_no_pattern.match(str(s).strip())
+    if not match or not match.group(1):
+        return (None, None)
+    return (match.group(1).upper(), match.group(2).upper())
+
+
+@DocumentNoField.register_lookup
+class DocumentNoStartsWith(models.Lookup):
+    """Match document no starting with a partial no as an integer range.
+
+    Unlike a LIKE pattern on the integer column, the range can be served
+    by an index. Terms that are not partial document no match nothing.
+    A document code prefix such as 'CN' limits matches to documents of
+    the biller with code C, and matches nothing on projects.
+
+    """
+    lookup_name = 'startswith'
+    prepare_rhs = False
+
+    def as_sql(self, compiler, connection):
+        bounds = document_no_range(self.rhs)
+        if bounds is None:
+            raise EmptyResultSet
+        (code, letter) = document_no_prefix(self.rhs)
+        model = self.lhs.target.model
+        if letter and letter != document_letters.get(
+                model._meta.model_name):
+            raise EmptyResultSet
+        (lhs, params) = self.process_lhs(compiler, connection)
+        if bounds[0] == bounds[1]:
+            (sql, params) = ('%s = %%s' % lhs, params + [bounds[0]])
+        else:
+            (sql, params) = ('%s BETWEEN %%s AND %%s' % lhs,
+                             params + list(bounds))
+        if code:
+            sql = '(%s AND %s.%s IN (SELECT id FROM %s WHERE code = %%s))' % (
+                sql,
+                compiler.quote_name_unless_alias(self.lhs.alias),
+                connection.ops.quote_name(
+                    model._meta.get_field('biller').column),
+                connection.ops.quote_name(Biller._meta.db_table),
+            )
+            params.append(code)
+        return (sql, params)
+
+
+@DocumentNoField.register_lookup
+class DocumentNoIStartsWith(DocumentNoStartsWith):
+    lookup_name = 'istartswith'
+
+
+class AddressValidation(models.Model):
+    """Cached USPS response by hash of a normalized mailing address."""
+    key = models.CharField(primary_key=True, max_length=64)
+    response = models.TextField()
+    validated = models.DateTimeField(default=timezone.now)
+
+
 class Entity(models.Model):
     name = models.CharField(unique=True, max_length=127)
     firm_name = models.CharField(max_length=127, blank=True)
@@ -218,6 +624,39 @@ class Biller(Entity):
         ordering = ['code']
 
 
+class ClientQuerySet(models.QuerySet):
+
+    def with_totals(self):
+        """Annotate billed, paid and owed totals in a single query.
+
+        Totals start from the client's latest closing totals, so only
+        line items and payments of open invoices are summed.
+
+        """
+        line_items = InvoiceLineItem.objects.filter(
+            invoice__client=OuterRef('pk'),
+        )
+        payments = Payment.objects.filter(invoice__client=OuterRef('pk'))
+        billed = subquery_total(line_items, 'invoice__client')
+        paid = subquery_total(payments, 'invoice__client')
+        close = latest_close()
+        if close:
+            line_items = line_items.filter(invoice__date__gte=close.date)
+            payments = payments.filter(invoice__date__gte=close.date)
+            closed = ClientClose.objects.filter(year_close=close,
+                                                client=OuterRef('pk'))
+            billed = (closed_total(closed, 'billed') +
+                      subquery_total(line_items, 'invoice__client'))
+            paid = (closed_total(closed, 'paid') +
+                    subquery_total(payments, 'invoice__client'))
+        return self.annotate(
+            total_billed=billed,
+            total_paid=paid,
+        ).annotate(
+            total_owed=F('total_billed') - F('total_paid'),
+        )
+
+
 class Client(Entity):
     biller = models.ForeignKey(Biller, default=get_default_biller_id,
                                on_delete=models.CASCADE)
@@ -226,6 +665,8 @@ class Client(Entity):
     active = models.BooleanField(default=True)
     address_validation = models.TextField(blank=True)
 
+    objects = ClientQuerySet.as_manager()
+
     @property
     def address(self):
         if self.firm_name:
@@ -239,42 +680,81 @@ class Client(Entity):
         ).upper()
 
     def billed(self):
+        if hasattr(self, 'total_billed'):
+            return round_total(self.total_billed)
+        ledger = get_ledger(self)
+        if ledger:
+            return round_total(ledger.billed)
+        (billed, paid, close_date) = self.closed_totals()
         invoice_set = InvoiceLineItem.objects.filter(invoice__client=self)
-        return agg_total(invoice_set)
+        if close_date:
+            invoice_set = invoice_set.filter(invoice__date__gte=close_date)
+        return billed + agg_total(invoice_set)
 
     def paid(self):
+        if hasattr(self, 'total_paid'):
+            return round_total(self.total_paid)
+        ledger = get_ledger(self)
+        if ledger:
+            return round_total(ledger.paid)
+        (billed, paid, close_date) = self.closed_totals()
         payment_set = Payment.objects.filter(invoice__client=self)
-        invoice_set = InvoiceLineItem.objects.filter(invoice__client=self)
-        old_invoice_set = invoice_set.filter(
-            invoice__date__lt=date(2012, 9, 1)
-        )
-        return agg_total(payment_set) + agg_total(old_invoice_set)
+        if close_date:
+            payment_set = payment_set.filter(invoice__date__gte=close_date)
+        return paid + agg_total(payment_set)
 
     def owed(self):
+        if hasattr(self, 'total_owed'):
+            return round_total(self.total_owed)
+        ledger = get_ledger(self)
+        if ledger:
+            return round_total(ledger.owed)
         return self.billed() - self.paid()
     owed.short_description = 'Balance'
 
+    def closed_totals(self):
+        """Return billed and paid totals at the latest close and its date."""
+        close = latest_close()
+        if not close:
+            return (0, 0, None)
+        row = ClientClose.objects.filter(year_close=close, client=self).first()
+        if not row:
+            return (0, 0, close.date)
+        return (row.billed, row.paid, close.date)
+
     def get_absolute_url(self):
         return reverse('statement', args=[self.name])
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        client = super(Client, cls).from_db(db, field_names, values)
+        if all(f in field_names for f in address_fields):
+            # Remember loaded address to skip revalidating it.
+            client._loaded_address = client.normalized_address()
+        return client
+
+    def normalized_address(self):
+        return normalize_address(self.address1, self.address2, self.city,
+                                 self.state, self.zip_code)
+
     def clean(self):
         super(Client, self).clean()
         if self.owed() and not self.active:
             raise ValidationError("Cannot inactivate client with balance.")
         self.contact_name = clean_address(self.contact_name)
         self.firm_name = clean_address(self.firm_name)
-        if '-' in self.zip_code:
-            (zip5, zip4) = self.zip_code.split('-')
-        else:
-            zip5 = self.zip_code
-            zip4 = ''
-        address_validator = Address(user_id=settings.SECRETS['USPS_USER_ID'])
-        try:
-            address_response = address_validator.validate(
-                address1=self.address1, address2=self.address2,
-                city=self.city, state=self.state, zip_5=zip5, zip_4=zip4)
-        except USPSXMLError as e:
-            raise ValidationError(e)
+        loaded_address = getattr(self, '_loaded_address', None)
+        if (self.address_validation and
+                loaded_address == self.normalized_address()):
+            # Address is unchanged since it was last validated.
+            incr_address_counter('unchanged')
+            return
+        self.update_address(validate_address(
+            self.address1, self.address2, self.city, self.state,
+            self.zip_code))
+
+    def update_address(self, address_response):
+        """Replace address with its USPS standardized form."""
         if 'Address1' in address_response:
             self.address1 = address_response['Address1']
         self.address2 = address_response['Address2']
@@ -294,7 +774,7 @@ class Document(models.Model):
     biller = models.ForeignKey(Biller, default=get_default_biller_id,
                                on_delete=models.CASCADE)
     client = models.ForeignKey(Client, on_delete=models.CASCADE)
-    no = DocumentNoField()
+    no = DocumentNoField(db_index=True)
     name = models.CharField(max_length=127, blank=True)
     content = models.TextField(blank=True)
 
@@ -324,47 +804,162 @@ class Document(models.Model):
         unique_together = ('biller', 'no')
 
 
+class ProjectQuerySet(models.QuerySet):
+
+    def with_totals(self):
+        """Annotate the amount of each project in a single query."""
+        line_items = InvoiceLineItem.objects.filter(
+            invoice__project=OuterRef('pk'),
+        )
+        return self.annotate(
+            total_amount=subquery_total(line_items, 'invoice__project'),
+        )
+
+
+class DocumentSequence(models.Model):
+    """Last allocated document no suffix by biller, document and year."""
+    biller = models.ForeignKey(Biller, on_delete=models.CASCADE)
+    document = models.CharField(max_length=15, choices=[
+        ('project', "Project"),
+        ('invoice', "Invoice"),
+    ])
+    year = models.PositiveSmallIntegerField()
+    last = models.PositiveSmallIntegerField()
+
+    def __str__(self):
+        return "%s %s %s" % (self.biller.code, self.document,
+                             DocumentNo((self.year, self.last)))
+
+    class Meta:
+        unique_together = ('biller', 'document', 'year')
+
+
 class Project(Document):
     start_date = models.DateField(default=date.today)
     end_date = models.DateField(null=True, blank=True)
     contact_name = models.CharField(max_length=127, blank=True)
 
+    objects = ProjectQuerySet.as_manager()
+
     @property
     def code(self):
         return "{biller}P{no}".format(biller=self.biller.code, no=self.no)
 
     def amount(self):
+        if hasattr(self, 'total_amount'):
+            return round_total(self.total_amount)
         invoice_set = InvoiceLineItem.objects.filter(invoice__project=self)
         return agg_total(invoice_set)
 
     def clean(self):
         super(Project, self).clean()
-        if not self.no:
-            self.no = get_document_no(Project, self.biller)
         if self.end_date and self.start_date > self.end_date:
             raise ValidationError("Project start date must precede end date.")
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            if not self.no:
+                # Allocate only once validated, so that forms failing
+                # validation never use up a no.
+                self.no = allocate_document_no(Project, self.biller_id,
+                                               self.start_date)
+            super(Project, self).save(*args, **kwargs)
+
+
+class InvoiceQuerySet(models.QuerySet):
+
+    def with_totals(self):
+        """Annotate amount, paid and balance totals in a single query.
+
+        Closed invoices take their totals from their closing totals.
+
+        """
+        line_items = InvoiceLineItem.objects.filter(invoice=OuterRef('pk'))
+        payments = Payment.objects.filter(invoice=OuterRef('pk'))
+        amount = subquery_total(line_items, 'invoice')
+        paid = subquery_total(payments, 'invoice')
+        close = latest_close()
+        if close:
+            closed = InvoiceClose.objects.filter(invoice=OuterRef('pk'))
+            amount = Case(
+                When(date__lt=close.date,
+                     then=closed_total(closed, 'amount')),
+                default=amount, output_field=total_field,
+            )
+            paid = Case(
+                When(date__lt=close.date, then=closed_total(closed, 'paid')),
+                default=paid, output_field=total_field,
+            )
+        return self.annotate(
+            total_amount=amount,
+            total_paid=paid,
+        ).annotate(
+            total_balance=F('total_amount') - F('total_paid'),
+        )
+
+    def open(self):
+        """Exclude invoices closed by the latest year close."""
+        close = latest_close()
+        if close:
+            return self.filter(date__gte=close.date)
+        return self
+
+    def for_rendering(self):
+        """Fetch everything invoice templates use in constant queries.
+
+        Ordered line items are prefetched into ``line_items``.
+
+        """
+        line_items = (InvoiceLineItem.objects.select_related('action')
+                      .order_by('position', 'date'))
+        return self.select_related(
+            'biller', 'client', 'project__biller', 'ledger',
+        ).prefetch_related(models.Prefetch(
+            'invoicelineitem_set', queryset=line_items, to_attr='line_items',
+        ))
+
 
 class Invoice(Document):
     date = models.DateField(default=date.today)
     project = models.ForeignKey(Project, on_delete=models.CASCADE)
 
+    objects = InvoiceQuerySet.as_manager()
+
     @property
     def code(self):
         return "{biller}N{no}".format(biller=self.biller.code, no=self.no)
 
     @property
     def amount(self):
+        if hasattr(self, 'total_amount'):
+            return round_total(self.total_amount)
+        ledger = get_ledger(self)
+        if ledger:
+            return round_total(ledger.amount)
+        close = get_close(self)
+        if close:
+            return close.amount
         return agg_total(self.invoicelineitem_set)
 
     @property
     def paid(self):
-        if self.date < date(2012, 9, 1):
-            return agg_total(self.invoicelineitem_set)
+        if hasattr(self, 'total_paid'):
+            return round_total(self.total_paid)
+        ledger = get_ledger(self)
+        if ledger:
+            return round_total(ledger.paid)
+        close = get_close(self)
+        if close:
+            return close.paid
         return agg_total(self.payment_set)
 
     @property
     def balance(self):
+        if hasattr(self, 'total_balance'):
+            return round_total(self.total_balance)
+        ledger = get_ledger(self)
+        if ledger:
+            return round_total(ledger.balance)
         return self.amount - self.paid
 
     def is_paid(self):
@@ -372,6 +967,11 @@ class Invoice(Document):
     is_paid.boolean = True
     is_paid.short_description = 'Paid?'
 
+    def is_closed(self):
+        return get_close(self) is not None
+    is_closed.boolean = True
+    is_closed.short_description = 'Closed?'
+
     def get_absolute_url(self):
         return reverse('invoice', args=[self.biller.code, self.no])
 
@@ -391,9 +991,23 @@ class Invoice(Document):
         if self.client_id and self.client != self.project.client:
             raise ValidationError(
                 "Project must have the same client.")
-        if not self.no:
-            self.no = get_document_no(Invoice, self.biller)
-        validate_seq_documents(Invoice, self.biller, self.no)
+        if self.is_closed():
+            raise ValidationError("Invoice %s is closed." % self)
+        close = latest_close()
+        if close and self.date < close.date:
+            raise ValidationError(
+                "Invoices before %s are closed." % close.date)
+        if self.no:
+            validate_seq_documents(Invoice, self.biller, self.no)
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            if not self.no:
+                # Allocate only once validated, so that forms failing
+                # validation never use up a no.
+                self.no = allocate_document_no(Invoice, self.biller_id,
+                                               self.date)
+            super(Invoice, self).save(*args, **kwargs)
 
 
 class InvoiceLineAction(models.Model):
@@ -435,6 +1049,10 @@ class InvoiceLineItem(models.Model):
     is_billed.admin_order_field = 'invoice'
     is_billed.short_description = 'Billed?'
 
+    def clean(self):
+        if self.invoice_id and self.invoice.is_closed():
+            raise ValidationError("Invoice %s is closed." % self.invoice)
+
     def __str__(self):
         return "%s: %s" % (self.invoice, self.content[:40])
 
@@ -452,6 +1070,10 @@ class Payment(models.Model):
     def client(self):
         return self.invoice.client
 
+    def clean(self):
+        if self.invoice_id and self.invoice.is_closed():
+            raise ValidationError("Invoice %s is closed." % self.invoice)
+
     def __str__(self):
         return "%s: %s" % (self.invoice, self.amount)
 
@@ -459,6 +1081,130 @@ class Payment(models.Model):
         ordering = ['-date', '-invoice__no']
 
 
+class ClientBalance(models.Model):
+    """Running totals of a client maintained by ``armgmt.ledger``."""
+    client = models.OneToOneField(
+        Client, primary_key=True, on_delete=models.DO_NOTHING,
+        related_name='ledger',
+    )
+    billed = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    paid = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    owed = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    def __str__(self):
+        return "%s: %s" % (self.client, self.owed)
+
+
+class InvoiceBalance(models.Model):
+    """Totals of an invoice maintained by ``armgmt.ledger``."""
+    invoice = models.OneToOneField(
+        Invoice, primary_key=True, on_delete=models.DO_NOTHING,
+        related_name='ledger',
+    )
+    client = models.ForeignKey(
+        Client, on_delete=models.DO_NOTHING, related_name='+',
+    )
+    amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    paid = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    balance = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    def __str__(self):
+        return "%s: %s" % (self.invoice, self.balance)
+
+
+class YearClose(models.Model):
+    """Close of invoices dated before date, made by ``armgmt.closing``."""
+    date = models.DateField(unique=True)
+    notes = models.TextField(blank=True)
+
+    def __str__(self):
+        return "Close before %s" % self.date
+
+    class Meta:
+        ordering = ['-date']
+
+
+class ClientClose(models.Model):
+    """Totals of a client's invoices dated before a year close."""
+    year_close = models.ForeignKey(YearClose, on_delete=models.CASCADE)
+    client = models.ForeignKey(
+        Client, on_delete=models.PROTECT, related_name='+',
+    )
+    billed = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    paid = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    def __str__(self):
+        return "%s: %s" % (self.client, self.billed - self.paid)
+
+    class Meta:
+        unique_together = ('year_close', 'client')
+
+
+class InvoiceClose(models.Model):
+    """Totals of an invoice frozen by a year close."""
+    invoice = models.OneToOneField(
+        Invoice, primary_key=True, on_delete=models.PROTECT,
+        related_name='close',
+    )
+    year_close = models.ForeignKey(YearClose, on_delete=models.CASCADE)
+    amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    paid = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    def __str__(self):
+        return "%s: %s" % (self.invoice, self.amount - self.paid)
+
+
+class LineItemPhrase(models.Model):
+    """Line item content counted for autocomplete by ``armgmt.phrases``.
+
+    Rows without client count all line items, and rows without project
+    count the line items of a client.
+
+    """
+    key = models.CharField(max_length=255)
+    content = models.TextField()
+    client = models.ForeignKey(Client, null=True, on_delete=models.CASCADE,
+                               related_name='+')
+    project = models.ForeignKey(Project, null=True, db_index=False,
+                                on_delete=models.CASCADE, related_name='+')
+    count = models.PositiveIntegerField(default=0)
+    last_used = models.DateField()
+
+    def __str__(self):
+        return self.content
+
+    class Meta:
+        # Cover suggestion queries so that only the top rows are read.
+        indexes = [models.Index(fields=['project', 'client', 'key',
+                                        'count', 'last_used'])]
+
+
+class GnuCashHash(models.Model):
+    """Hash of a GnuCash record as last loaded by ``armgmt.gnucash``.
+
+    Records are identified by kind and natural key and map to the row
+    they were loaded into, so that a sync only writes rows whose record
+    changed and leaves edits of other rows alone.
+
+    """
+    kind = models.CharField(max_length=15, choices=[
+        ('client', "Client"),
+        ('project', "Project"),
+        ('invoice', "Invoice"),
+        ('lineitem', "Line item"),
+        ('payment', "Payment"),
+    ])
+    key = models.CharField(max_length=127)
+    digest = models.CharField(max_length=40)
+    object_id = models.PositiveIntegerField()
+
+    def __str__(self):
+        return "%s %s" % (self.kind, self.key)
+
+    class Meta:
+        unique_together = ('kind', 'key')
+
+
 class Task(models.Model):
     assignee = models.ForeignKey(
         settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
@@ -0,0 +1,131 @@
+"""Content-addressed disk cache of rendered PDF documents.
+
+PDFs are stored by a hash of their LaTeX source and the versions of the
+LaTeX templates and logo, so any change to a document yields a new key
+and stale entries simply age out. Least recently used files are evicted
+once the cache grows beyond ``settings.PDF_CACHE_SIZE`` bytes.
+
+Hit, miss and eviction counters are kept in the default Django cache so
+that they are shared by all server processes.
+
+"""
+from functools import lru_cache
+import hashlib
+import os
+from tempfile import mkstemp
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+template_dir = os.path.join(os.path.dirname(__file__), 'templates/armgmt')
+counter_names = ['hits', 'misses', 'evictions']
+
+
+@lru_cache()
+def assets_version():
+    """Hash LaTeX templates and logo which rendered PDFs depend on."""
+    h = hashlib.sha256()
+    for name in sorted(os.listdir(template_dir)):
+        if name.endswith('.tex') or name.endswith('.pdf'):
+            with open(os.path.join(template_dir, name), 'rb') as f:
+                h.update(name.encode('utf-8'))
+                h.update(f.read())
+    return h.hexdigest()
+
+
+def cache_key(latex):
+    """Hash LaTeX source together with template and logo versions."""
+    h = hashlib.sha256(assets_version().encode('utf-8'))
+    h.update(latex.encode('utf-8'))
+    return h.hexdigest()
+
+
+def cache_path(key):
+    return os.path.join(settings.PDF_CACHE_DIR, '%s.pdf' % key)
+
+
+def incr(name):
+    key = 'pdfcache:%s' % name
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+def stats():
+    """Return hit, miss and eviction counters and current cache size."""
+    s = {name: cache.get('pdfcache:%s' % name, 0) for name in counter_names}
+    entries = list(scan())
+    s['files'] = len(entries)
+    s['size'] = sum(size for (_mtime, size, _path) in entries)
+    s['max_size'] = settings.PDF_CACHE_SIZE
+    return s
+
+
+def get(key):
+    """Return cached PDF or None, marking it as recently used."""
+    path = cache_path(key)
+    try:
+        with open(path, 'rb') as f:
+            pdf = f.read()
+        os.utime(path)
+    except OSError:
+        incr('misses')
+        return None
+    incr('hits')
+    return pdf
+
+
+def put(key, pdf):
+    """Atomically store PDF in cache, then evict if over maximum size."""
+    os.makedirs(settings.PDF_CACHE_DIR, exist_ok=True)
+    (fd, tmp_path) = mkstemp(dir=settings.PDF_CACHE_DIR, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(pdf)
+        os.replace(tmp_path, cache_path(key))
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    evict()
+
+
+def scan():
+    """Yield (last used time, size, path) of each cached PDF."""
+    try:
+        entries = os.scandir(settings.PDF_CACHE_DIR)
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        if entry.name.endswith('.pdf'):
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                # Evicted by another process.
+                continue
+            yield (st.st_mtime, st.st_size, entry.path)
+
+
+def evict():
+    """Remove least recently used PDFs until cache fits maximum size."""
+    entries = sorted(scan())
+    size = sum(size for (_mtime, size, _path) in entries)
+    for (_mtime, file_size, path) in entries:
+        if size <= settings.PDF_CACHE_SIZE:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        size -= file_size
+        incr('evictions')
+
+
+def get_or_render(key, render):
+    """Return cached PDF or call render() and cache its result."""
+    pdf = get(key)
+    if pdf is None:
+        pdf = render()
+        put(key, pdf)
+    return pdf
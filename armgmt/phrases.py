@@ -0,0 +1,188 @@
+"""Suggest line item contents for autocomplete.
+
+Each distinct line item content, normalized to lower case with single
+spaces, has a ``LineItemPhrase`` row counting its line items and their
+latest date overall, per client and per project. Suggestions are rows
+whose key starts with the typed text, read with an index range scan and
+ranked by count and recency.
+
+Rows are updated by the signal receivers below. Bulk operations which
+bypass model signals must call ``rebuild`` afterwards.
+
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import DateField, F, Value
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from armgmt.models import Invoice, InvoiceLineItem, LineItemPhrase
+
+
+max_key_length = 255
+max_char = chr(0x10ffff)
+
+
+def normalize(content):
+    return ' '.join(content.split()).lower()[:max_key_length]
+
+
+def scopes(client_id, project_id):
+    return [(None, None), (client_id, None), (client_id, project_id)]
+
+
+def count(content, client_id, project_id, day, delta):
+    """Add delta line items with content of a client and project."""
+    key = normalize(content)
+    if not key:
+        return
+    with transaction.atomic():
+        for (c, p) in scopes(client_id, project_id):
+            rows = LineItemPhrase.objects.filter(key=key, client_id=c,
+                                                 project_id=p)
+            if delta < 0:
+                rows.filter(count__lte=-delta).delete()
+                rows.update(count=F('count') + delta)
+            elif not rows.update(
+                    count=F('count') + delta, content=content,
+                    last_used=Greatest('last_used',
+                                       Value(day, output_field=DateField()))):
+                LineItemPhrase.objects.create(
+                    key=key, content=content, client_id=c, project_id=p,
+                    count=delta, last_used=day,
+                )
+
+
+def count_many(line_items, client_id, project_id):
+    """Add (content, date) line items of a client and project.
+
+    Line items of the same phrase are counted with one update, keeping
+    the content of the latest.
+
+    """
+    groups = {}
+    for (content, day) in sorted(line_items, key=lambda item: item[1]):
+        key = normalize(content)
+        if key:
+            n = groups[key][1] if key in groups else 0
+            groups[key] = (content, n + 1, day)
+    with transaction.atomic():
+        for (content, n, day) in groups.values():
+            count(content, client_id, project_id, day, n)
+
+
+def rebuild():
+    """Recount all line items."""
+    phrases = defaultdict(lambda: [None, 0, None])
+    line_items = InvoiceLineItem.objects.order_by('date').values_list(
+        'content', 'date', 'invoice__client', 'invoice__project',
+    )
+    for (content, day, client_id, project_id) in line_items.iterator():
+        key = normalize(content)
+        if not key:
+            continue
+        for scope in scopes(client_id, project_id):
+            phrase = phrases[scope + (key,)]
+            phrase[0] = content
+            phrase[1] += 1
+            phrase[2] = day
+    with transaction.atomic():
+        LineItemPhrase.objects.all().delete()
+        LineItemPhrase.objects.bulk_create(
+            (LineItemPhrase(client_id=client_id, project_id=project_id,
+                            key=key, content=content, count=n,
+                            last_used=day)
+             for ((client_id, project_id, key), (content, n, day))
+             in phrases.items()),
+            batch_size=500,
+        )
+
+
+def suggest(text, client_id=None, project_id=None, limit=10):
+    """Return up to limit line item contents starting with text.
+
+    Contents used in the project come first, then those used for the
+    client, then all others, each by count and then recency. Without
+    text, only contents of the project or client are suggested.
+
+    """
+    key = normalize(text)
+    queries = []
+    if project_id:
+        queries.append({'project_id': project_id})
+        if client_id:
+            queries[-1]['client_id'] = client_id
+    if client_id:
+        queries.append({'client_id': client_id, 'project_id': None})
+    if key:
+        queries.append({'client_id': None, 'project_id': None})
+    keys = set()
+    ids = []
+    for query in queries:
+        rows = (LineItemPhrase.objects.filter(**query)
+                .filter(key__gte=key, key__lt=key + max_char)
+                .order_by('-count', '-last_used')
+                .values_list('pk', 'key')[:limit])
+        for (pk, k) in rows:
+            if k not in keys and len(ids) < limit:
+                keys.add(k)
+                ids.append(pk)
+        if len(ids) >= limit:
+            break
+    contents = dict(LineItemPhrase.objects.filter(pk__in=ids)
+                    .values_list('pk', 'content'))
+    return [contents[pk] for pk in ids]
+
+
+def get_state(line_item_id):
+    return (InvoiceLineItem.objects.filter(pk=line_item_id).values_list(
+        'content', 'invoice__client', 'invoice__project', 'date',
+    ).first())
+
+
+@receiver(pre_save, sender=InvoiceLineItem)
+def remember_line_item(sender, instance, **kwargs):
+    if instance.pk:
+        instance._phrase_state = get_state(instance.pk)
+
+
+@receiver(post_save, sender=InvoiceLineItem)
+def count_line_item(sender, instance, **kwargs):
+    old = getattr(instance, '_phrase_state', None)
+    new = get_state(instance.pk)
+    if old == new:
+        return
+    if old:
+        count(*old, delta=-1)
+    count(*new, delta=1)
+
+
+@receiver(post_delete, sender=InvoiceLineItem)
+def uncount_line_item(sender, instance, **kwargs):
+    invoice = (Invoice.objects.filter(pk=instance.invoice_id)
+               .values_list('client', 'project').first())
+    if invoice:
+        count(instance.content, invoice[0], invoice[1], instance.date, -1)
+
+
+@receiver(pre_save, sender=Invoice)
+def remember_invoice(sender, instance, **kwargs):
+    if instance.pk:
+        instance._phrase_scope = (
+            Invoice.objects.filter(pk=instance.pk)
+            .values_list('client', 'project').first()
+        )
+
+
+@receiver(post_save, sender=Invoice)
+def move_invoice(sender, instance, **kwargs):
+    """Recount line items of an invoice moved to another project."""
+    old = getattr(instance, '_phrase_scope', None)
+    if not old or old == (instance.client_id, instance.project_id):
+        return
+    for (content, day) in instance.invoicelineitem_set.values_list(
+            'content', 'date'):
+        count(content, old[0], old[1], day, -1)
+        count(content, instance.client_id, instance.project_id, day, 1)
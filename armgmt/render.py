@@ -0,0 +1,157 @@
+"""Render LaTeX documents with bounded concurrency.
+
+At most ``settings.LATEX_WORKERS`` documents are compiled at once across
+all server processes, with up to ``settings.LATEX_QUEUE`` more waiting
+for a worker. Workers and queue places are slots held with ``flock`` on
+files in ``settings.LATEX_LOCK_DIR``, so they are released even if a
+process dies. When the queue is full, or a queued job waits longer than
+``settings.LATEX_QUEUE_TIMEOUT`` seconds, ``RenderBusy`` is raised
+instead of tying up the caller.
+
+Each pdflatex run is a separate process, so threads suffice to drive
+several of them concurrently for batch rendering.
+
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+import os
+import subprocess
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import monotonic, sleep
+
+from django.conf import settings
+
+from armgmt import pdfcache
+from armgmt.tex import compile_latex
+
+try:
+    import fcntl
+except ImportError:
+    # Concurrency is not limited on platforms without flock.
+    fcntl = None
+
+
+class RenderBusy(Exception):
+    """Raised when too many documents are already being rendered."""
+
+
+@contextmanager
+def slot(kind, count, wait=0):
+    """Hold one of count slots of a kind, waiting up to wait seconds."""
+    if not fcntl:
+        yield
+        return
+    os.makedirs(settings.LATEX_LOCK_DIR, exist_ok=True)
+    deadline = monotonic() + wait
+    while True:
+        for n in range(count):
+            path = os.path.join(settings.LATEX_LOCK_DIR,
+                                '%s-%d.lock' % (kind, n))
+            f = open(path, 'a')
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                f.close()
+                continue
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+                f.close()
+            return
+        if monotonic() >= deadline:
+            raise RenderBusy("All %d %s slots are busy." % (count, kind))
+        sleep(0.05)
+
+
+def render(latex, timeout=None, limit=True):
+    """Compile LaTeX source to PDF within the concurrency limits.
+
+    Raise RenderBusy if the queue is full and TimeoutExpired if
+    compiling takes longer than timeout seconds (default
+    ``settings.LATEX_TIMEOUT``). If limit is False, render immediately.
+
+    """
+    if timeout is None:
+        timeout = settings.LATEX_TIMEOUT
+    if not limit:
+        (pdf, _timings) = compile_latex(latex, timeout)
+        return pdf
+    workers = settings.LATEX_WORKERS
+    with slot('queue', workers + settings.LATEX_QUEUE):
+        with slot('worker', workers, settings.LATEX_QUEUE_TIMEOUT):
+            (pdf, _timings) = compile_latex(latex, timeout)
+    return pdf
+
+
+def render_many(jobs, workers=None, timeout=None, limit=True):
+    """Render many documents concurrently.
+
+    Take an iterable of (key, LaTeX source) and yield (key, PDF or
+    exception) as each document finishes. Jobs beyond the queue wait
+    for their turn here instead of raising RenderBusy.
+
+    """
+    if workers is None:
+        workers = settings.LATEX_WORKERS
+
+    def run(latex):
+        while True:
+            try:
+                return render(latex, timeout, limit)
+            except RenderBusy:
+                sleep(0.5)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run, latex): key for (key, latex) in jobs}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = e
+            yield (futures[future], result)
+
+
+def render_cached(jobs, workers=None, timeout=None, limit=True):
+    """Render many documents concurrently, reusing cached PDFs.
+
+    Like ``render_many``, except cached PDFs are yielded first and newly
+    rendered PDFs are added to the cache.
+
+    """
+    keys = {}
+    sources = []
+    for (key, latex) in jobs:
+        cache_key = pdfcache.cache_key(latex)
+        pdf = pdfcache.get(cache_key)
+        if pdf is None:
+            keys[key] = cache_key
+            sources.append((key, latex))
+        else:
+            yield (key, pdf)
+    for (key, result) in render_many(sources, workers, timeout, limit):
+        if not isinstance(result, Exception):
+            pdfcache.put(keys[key], result)
+        yield (key, result)
+
+
+def merge_pdfs(pdfs):
+    """Concatenate PDFs into a single PDF with Ghostscript."""
+    directory = mkdtemp()
+    try:
+        filenames = []
+        for (n, pdf) in enumerate(pdfs):
+            filename = os.path.join(directory, '%d.pdf' % n)
+            with open(filename, 'wb') as f:
+                f.write(pdf)
+            filenames.append(filename)
+        output = os.path.join(directory, 'merged.pdf')
+        subprocess.check_call([
+            'gs', '-dSAFER', '-dBATCH', '-dNOPAUSE', '-dQUIET',
+            '-sDEVICE=pdfwrite', '-sOutputFile={}'.format(output),
+        ] + filenames)
+        with open(output, 'rb') as f:
+            return f.read()
+    finally:
+        rmtree(directory)
@@ -0,0 +1,222 @@
+"""Tabulate billed and collected amounts by month.
+
+Line items are billed in the month of their invoice and payments are
+collected in the month of their date. Amounts are summed per month and
+biller, client or action by the database and pivoted with pandas. Since
+payments are not tied to line items, the collections of an invoice are
+split among its actions in proportion to the amounts billed for them.
+
+Pivots are cached by period, grouping and filters under a version that
+the signal receivers below replace after any write to the data they are
+computed from. Bulk operations which bypass model signals must call
+``invalidate`` afterwards.
+
+"""
+import io
+from uuid import uuid4
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import CharField, F, Func, Sum
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+import pandas as pd
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import landscape, letter
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Table, TableStyle
+
+from armgmt.models import (Biller, Client, Invoice, InvoiceLineAction,
+                           InvoiceLineItem, Payment)
+
+
+# Report groupings with the lookups of their labels from line items.
+groups = [
+    ('month', "Month", None),
+    ('biller', "Biller", 'invoice__biller__code'),
+    ('client', "Client", 'invoice__client__name'),
+    ('action', "Action", 'action__name'),
+]
+group_lookups = {name: lookup for (name, _, lookup) in groups}
+no_action = "(none)"
+total = "Total"
+measures = ['billed', 'collected']
+
+version_key = 'reports:version'
+cache_timeout = 24 * 60 * 60
+
+
+def version():
+    v = cache.get(version_key)
+    if v is None:
+        v = uuid4().hex
+        cache.set(version_key, v, None)
+    return v
+
+
+def invalidate():
+    """Discard all cached pivots."""
+    cache.set(version_key, uuid4().hex, None)
+
+
+class Month(Func):
+    """Format a date as YYYY-MM in SQLite.
+
+    Unlike ``TruncMonth``, which calls back into Python for each row on
+    SQLite, this is computed by SQLite itself.
+
+    """
+    function = 'strftime'
+    template = "%(function)s('%%%%Y-%%%%m', %(expressions)s)"
+    output_field = CharField()
+
+
+def month_rows(qset, date_lookup, fields, amount):
+    """Sum amounts of qset by month of date_lookup and fields."""
+    return list(
+        qset.order_by().annotate(month=Month(date_lookup))
+        .values('month', *fields).annotate(amount=amount)
+        .values_list('month', 'amount', *fields)
+    )
+
+
+def frame(rows, columns):
+    df = pd.DataFrame(rows, columns=['month', 'amount'] + columns)
+    df['amount'] = df['amount'].astype(float)
+    return df
+
+
+def aggregate(start, end, group, biller_id=None, client_id=None):
+    """Return a frame of month, group and measure amounts."""
+    filters = {}
+    if biller_id:
+        filters['invoice__biller'] = biller_id
+    if client_id:
+        filters['invoice__client'] = client_id
+    line_items = InvoiceLineItem.objects.filter(
+        invoice__date__gte=start, invoice__date__lt=end, **filters)
+    payments = Payment.objects.filter(date__gte=start, date__lt=end,
+                                      **filters)
+    line_amount = Sum(F('qty') * F('unit_price'))
+    lookup = group_lookups[group]
+    fields = [lookup] if lookup else []
+
+    billed = frame(month_rows(line_items, 'invoice__date', fields,
+                              line_amount), ['group'] if lookup else [])
+    billed['measure'] = 'billed'
+    if group == 'action':
+        # Split collections by the action shares of each invoice.
+        collected = frame(month_rows(payments, 'date', ['invoice'],
+                                     Sum('amount')), ['invoice'])
+        shares = pd.DataFrame(
+            list(InvoiceLineItem.objects
+                 .filter(invoice__in=payments.values('invoice')).order_by()
+                 .values('invoice', lookup).annotate(amount=line_amount)
+                 .values_list('invoice', lookup, 'amount')),
+            columns=['invoice', 'group', 'share'],
+        )
+        shares['share'] = shares['share'].astype(float)
+        shares['share'] /= shares.groupby('invoice')['share'].transform('sum')
+        collected = collected.merge(shares, on='invoice', how='left')
+        collected['share'] = collected['share'].fillna(1.0)
+        collected['amount'] *= collected['share']
+        collected = collected.drop(columns=['invoice', 'share'])
+    else:
+        collected = frame(month_rows(payments, 'date', fields,
+                                     Sum('amount')),
+                          ['group'] if lookup else [])
+    collected['measure'] = 'collected'
+    df = pd.concat([billed, collected], ignore_index=True)
+    if lookup:
+        df['group'] = df['group'].fillna(no_action)
+    else:
+        df['group'] = total
+    return df
+
+
+def pivot(start, end, group='month', biller_id=None, client_id=None):
+    """Return a DataFrame of amounts by month and group and measure.
+
+    Rows are months with amounts from start up to but excluding end,
+    followed by a total row. Columns are (group, measure) pairs followed
+    by totals, and a single total group when group is 'month'. Pivots
+    are cached.
+
+    """
+    key = 'reports:%s:%s:%s:%s:%s:%s' % (version(), start, end, group,
+                                         biller_id, client_id)
+    table = cache.get(key)
+    if table is None:
+        df = aggregate(start, end, group, biller_id, client_id)
+        columns = pd.MultiIndex.from_product(
+            [sorted(set(df['group']) - {total}) + [total], measures],
+        )
+        if df.empty:
+            table = pd.DataFrame(columns=columns, dtype=float)
+        else:
+            table = pd.pivot_table(
+                df, index='month', columns=['group', 'measure'],
+                values='amount', aggfunc='sum', fill_value=0.0,
+            )
+            totals = pd.pivot_table(
+                df, index='month', columns='measure',
+                values='amount', aggfunc='sum', fill_value=0.0,
+            )
+            for measure in totals:
+                table[(total, measure)] = totals[measure]
+            table = table.reindex(columns=columns, fill_value=0.0)
+        table.loc[total] = table.sum()
+        table = table.round(2)
+        table.columns.names = [None, None]
+        table.index.name = 'Month'
+        cache.set(key, table, cache_timeout)
+    return table
+
+
+def to_csv(table):
+    f = io.StringIO()
+    table.to_csv(f, float_format='%.2f')
+    return f.getvalue()
+
+
+def to_pdf(table, title, subtitle):
+    f = io.BytesIO()
+    doc = SimpleDocTemplate(f, pagesize=landscape(letter))
+    doc.title = title
+    styles = getSampleStyleSheet()
+    labels = list(table.columns.get_level_values(0))
+    rows = [
+        ['Month'] + [g if i % 2 == 0 else '' for (i, g) in enumerate(labels)],
+        [''] + [m.capitalize() for m in table.columns.get_level_values(1)],
+    ]
+    for (month, values) in table.iterrows():
+        rows.append([month] + ['{:,.2f}'.format(v) for v in values])
+    pdf_table = Table(rows, repeatRows=2)
+    pdf_table.setStyle(TableStyle([
+        ('FONTSIZE', (0, 0), (-1, -1), 7),
+        ('ALIGN', (1, 0), (-1, -1), 'RIGHT'),
+        ('LINEBELOW', (0, 1), (-1, 1), 0.5, colors.black),
+        ('LINEABOVE', (0, -1), (-1, -1), 0.5, colors.black),
+    ]))
+    doc.build([Paragraph(title, styles['Title']),
+               Paragraph(subtitle, styles['Normal']),
+               pdf_table])
+    return f.getvalue()
+
+
+@receiver(post_save, sender=Biller)
+@receiver(post_save, sender=Client)
+@receiver(post_save, sender=Invoice)
+@receiver(post_save, sender=InvoiceLineAction)
+@receiver(post_save, sender=InvoiceLineItem)
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Biller)
+@receiver(post_delete, sender=Client)
+@receiver(post_delete, sender=Invoice)
+@receiver(post_delete, sender=InvoiceLineAction)
+@receiver(post_delete, sender=InvoiceLineItem)
+@receiver(post_delete, sender=Payment)
+def invalidate_pivots(sender, **kwargs):
+    # Invalidate after commit so that no pivot of uncommitted data is
+    # cached under the new version.
+    transaction.on_commit(invalidate)
@@ -0,0 +1,60 @@
+"""Route reads of heavy views to the readonly database alias.
+
+Views opt in with the ``use_readonly`` decorator. While such a view
+runs in a thread, its reads go to the ``readonly`` alias, a separate
+read-only SQLite connection, so long reports do not stall admin writes.
+Reads inside a transaction on the default database stay on the default
+database, so they see the transaction's own writes. Writes always go to
+the default database, and the readonly connection is opened with
+``mode=ro`` so SQLite itself refuses any write.
+
+"""
+from contextlib import contextmanager
+from functools import wraps
+import threading
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+readonly_alias = 'readonly'
+state = threading.local()
+
+
+@contextmanager
+def readonly():
+    """Route reads in the current thread to the readonly alias."""
+    state.depth = getattr(state, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        state.depth -= 1
+
+
+def use_readonly(view):
+    """Decorate view to read from the readonly alias."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        with readonly():
+            return view(*args, **kwargs)
+    return wrapper
+
+
+class ReadonlyRouter(object):
+
+    def db_for_read(self, model, **hints):
+        if (getattr(state, 'depth', 0) and
+                readonly_alias in settings.DATABASES and
+                not connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return readonly_alias
+        return None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases are connections to the same database.
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -0,0 +1,216 @@
+"""Full-text search index of client, document and task text.
+
+Each client, project, invoice, line item, payment and task has a row in
+the SQLite FTS5 table ``armgmt_search`` holding its searchable text and
+the ids of the client, project and invoice it belongs to. Rows are
+updated by the signal receivers below, so bulk operations which bypass
+model signals must call ``update`` or ``rebuild`` afterwards.
+
+The rowid of each row encodes its kind and object id, so that a row is
+replaced without scanning the index.
+
+"""
+from django.db import connection, transaction
+from django.db.models import Case, CharField, FloatField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from armgmt.models import (Client, Invoice, InvoiceLineItem, Payment,
+                           Project, Task)
+
+
+table = 'armgmt_search'
+kinds = ['client', 'project', 'invoice', 'lineitem', 'payment', 'task']
+kind_models = {
+    'client': Client,
+    'project': Project,
+    'invoice': Invoice,
+    'lineitem': InvoiceLineItem,
+    'payment': Payment,
+    'task': Task,
+}
+model_kinds = {model.__name__: kind for (kind, model) in kind_models.items()}
+
+# Number of best matching objects ordered by rank.
+max_ranked = 100
+
+def rowid(kind, pk):
+    return pk * len(kinds) + kinds.index(kind)
+
+
+def index_row(kind, obj):
+    """Return (body, client id, project id, invoice id) of an object."""
+    if kind == 'client':
+        fields = [f.name for f in obj._meta.get_fields()
+                  if isinstance(f, CharField)] + ['notes']
+        body = [getattr(obj, f) for f in fields]
+        return (body, obj.pk, None, None)
+    elif kind == 'project':
+        return ([obj.name, obj.content], obj.client_id, obj.pk, None)
+    elif kind == 'invoice':
+        return ([obj.name, obj.content],
+                obj.client_id, obj.project_id, obj.pk)
+    elif kind == 'lineitem':
+        return ([obj.content], None, None, obj.invoice_id)
+    elif kind == 'payment':
+        return ([obj.notes], None, None, obj.invoice_id)
+    elif kind == 'task':
+        return ([obj.name, obj.content, obj.status,
+                 obj.assignee.username, obj.author.username],
+                obj.client_id, obj.project_id, obj.invoice_id)
+
+
+def insert(cursor, kind, objs):
+    rows = []
+    for obj in objs:
+        (body, client_id, project_id, invoice_id) = index_row(kind, obj)
+        body = '\n'.join(str(s) for s in body if s)
+        rows.append((rowid(kind, obj.pk), body,
+                     client_id, project_id, invoice_id))
+    cursor.executemany(
+        'INSERT INTO {table} (rowid, body, client_id, project_id, '
+        'invoice_id) VALUES (%s, %s, %s, %s, %s)'.format(table=table),
+        rows,
+    )
+
+
+def update(kind, objs):
+    """Replace index rows of objects of a kind."""
+    objs = list(objs)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(
+            'DELETE FROM {table} WHERE rowid = %s'.format(table=table),
+            [(rowid(kind, obj.pk),) for obj in objs],
+        )
+        insert(cursor, kind, objs)
+
+
+def remove(kind, pk):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'DELETE FROM {table} WHERE rowid = %s'.format(table=table),
+            [rowid(kind, pk)],
+        )
+
+
+def rebuild():
+    """Rebuild the index from scratch."""
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {table}'.format(table=table))
+        for kind in kinds:
+            objs = kind_models[kind].objects.all()
+            if kind == 'task':
+                objs = objs.select_related('assignee', 'author')
+            insert(cursor, kind, objs.iterator())
+
+
+class InSubquery(RawSQL):
+    """Raw subquery for ``__in`` lookups, which add their own parentheses.
+
+    A parenthesized subquery in parentheses is a single value to SQLite.
+
+    """
+
+    def as_sql(self, compiler, connection):
+        return (self.sql, self.params)
+
+
+def match_query(words):
+    """Return an FTS5 query matching any of words as prefixes."""
+    return ' OR '.join('"%s"*' % word.replace('"', '""') for word in words)
+
+
+def matching(row_kinds, column, words, rank=False):
+    """Return SQL and params selecting a column of matching index rows.
+
+    Rows are of one of row_kinds and match any of words as prefixes.
+    The column is selected as id, along with the row's rank if rank is
+    True, where a lower rank is a better match.
+
+    """
+    if column == 'object_id':
+        column = 'rowid / %d' % len(kinds)
+    sql = (
+        'SELECT {column} AS id{rank} FROM {table} '
+        'WHERE {table} MATCH %s AND rowid %% {n} IN ({kinds}) '
+        'AND {column} IS NOT NULL'
+    ).format(column=column, rank=', rank' if rank else '', table=table,
+             n=len(kinds), kinds=', '.join(str(kinds.index(kind))
+                                           for kind in row_kinds))
+    return (sql, [match_query(words)])
+
+
+def best_ranks(index, words):
+    """Return ranks of the best matching objects by id in one query.
+
+    Objects are matched by the rows of index entries with lookup pk,
+    summing the ranks of their rows. Only the max_ranked best are
+    returned.
+
+    """
+    selects = [matching(row_kinds, column, words, rank=True)
+               for (row_kinds, column, lookup) in index if lookup == 'pk']
+    if not selects:
+        return {}
+    sql = ('SELECT id, SUM(rank) FROM ({selects}) GROUP BY id '
+           'ORDER BY SUM(rank) LIMIT %s').format(
+        selects=' UNION ALL '.join(sql for (sql, params) in selects))
+    params = [param for (sql, params) in selects for param in params]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params + [max_ranked])
+        return dict(cursor.fetchall())
+
+
+def search(queryset, index, search_term, lookups=(), rank=True):
+    """Filter queryset to objects matching every word of search_term.
+
+    index is a list of (kinds, column, lookup) saying that an index row
+    of one of the kinds matches objects whose lookup equals the row's
+    column, for instance (['lineitem'], 'invoice_id', 'pk') for
+    invoices. Words also match objects through ORM lookups, such as
+    'no__startswith'. If rank is True, order the best matching objects
+    first by the sum of their ranks.
+
+    Each word filters the queryset by subqueries of the index, so the
+    database intersects the matches of all words without returning
+    index rows.
+
+    """
+    words = search_term.split()
+    for word in words:
+        query = Q(pk__in=[])
+        for (row_kinds, column, lookup) in index:
+            query |= Q(**{'%s__in' % lookup: InSubquery(
+                *matching(row_kinds, column, [word]))})
+        for lookup in lookups:
+            query |= Q(**{lookup: word})
+        queryset = queryset.filter(query)
+    ranks = best_ranks(index, words) if rank and words else {}
+    if ranks:
+        queryset = queryset.annotate(search_rank=Case(
+            *[When(pk=pk, then=Value(ranks[pk])) for pk in ranks],
+            default=Value(0.0), output_field=FloatField(),
+        )).order_by('search_rank', *queryset.query.order_by)
+    return queryset
+
+
+@receiver(post_save, sender=Client)
+@receiver(post_save, sender=Project)
+@receiver(post_save, sender=Invoice)
+@receiver(post_save, sender=InvoiceLineItem)
+@receiver(post_save, sender=Payment)
+@receiver(post_save, sender=Task)
+def update_object(sender, instance, **kwargs):
+    update(model_kinds[sender.__name__], [instance])
+
+
+@receiver(post_delete, sender=Client)
+@receiver(post_delete, sender=Project)
+@receiver(post_delete, sender=Invoice)
+@receiver(post_delete, sender=InvoiceLineItem)
+@receiver(post_delete, sender=Payment)
+@receiver(post_delete, sender=Task)
+def remove_object(sender, instance, **kwargs):
+    remove(model_kinds[sender.__name__], instance.pk)
+
@@ -0,0 +1,58 @@
+"""Keep document no sequences in step with saved and deleted documents.
+
+Document no typed in by hand are reserved on save, so that they are
+never allocated again, and the last no of a year is released when its
+document is deleted, so that numbering stays sequential.
+
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from armgmt.models import (DocumentNo, DocumentSequence, Invoice, Project,
+                           document_sequence_cache_key, release_document_no,
+                           reserve_document_no)
+
+
+documents = {'project': Project, 'invoice': Invoice}
+
+
+def rebuild():
+    """Restart each sequence at the maximum saved document no.
+
+    Bulk operations which bypass model signals must call this afterwards.
+
+    """
+    sequences = {}
+    for document in documents.values():
+        for (biller_id, no) in document.objects.values_list('biller', 'no'):
+            (yy, num) = DocumentNo(no)
+            key = (document, biller_id, yy)
+            sequences[key] = max(sequences.get(key, 0), num)
+    with transaction.atomic():
+        for sequence in DocumentSequence.objects.all():
+            cache.delete(document_sequence_cache_key(
+                documents[sequence.document], sequence.biller_id,
+                sequence.year))
+        DocumentSequence.objects.all().delete()
+        DocumentSequence.objects.bulk_create(
+            DocumentSequence(biller_id=biller_id,
+                             document=document._meta.model_name,
+                             year=yy, last=last)
+            for ((document, biller_id, yy), last) in sequences.items()
+        )
+    for (document, biller_id, yy) in sequences:
+        cache.delete(document_sequence_cache_key(document, biller_id, yy))
+
+
+@receiver(post_save, sender=Invoice)
+@receiver(post_save, sender=Project)
+def reserve_saved_no(sender, instance, **kwargs):
+    reserve_document_no(sender, instance.biller_id, instance.no)
+
+
+@receiver(post_delete, sender=Invoice)
+@receiver(post_delete, sender=Project)
+def release_deleted_no(sender, instance, **kwargs):
+    release_document_no(sender, instance.biller_id, instance.no)
@@ -0,0 +1,30 @@
+"""Configure SQLite connections for concurrent access.
+
+``settings.SQLITE_PRAGMAS`` are applied to every new SQLite connection.
+In WAL mode readers no longer block a writer or each other, and
+``busy_timeout`` makes a writer wait for the write lock instead of
+failing with "database is locked". The journal mode is stored in the
+database file, so it is only set through writable connections.
+
+"""
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+def pragma_statements(pragmas, readonly=False):
+    for (name, value) in pragmas.items():
+        if readonly and name == 'journal_mode':
+            continue
+        yield 'PRAGMA %s = %s' % (name, value)
+
+
+@receiver(connection_created)
+def configure_connection(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    readonly = 'mode=ro' in connection.settings_dict['NAME']
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', {})
+    with connection.cursor() as cursor:
+        for statement in pragma_statements(pragmas, readonly):
+            cursor.execute(statement)
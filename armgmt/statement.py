@@ -0,0 +1,92 @@
+from collections import defaultdict
+from datetime import date, timedelta
+
+from django.db.models import Case, Sum, When
+
+from armgmt.models import Payment, round_total, total_field
+
+
+dateformat = '%m/%d/%y'
+
+# Aging buckets as (name, minimum age in days), oldest first,
+# with the last bucket containing all remaining invoices.
+aging_buckets = [
+    ('over90', 91),
+    ('over60', 61),
+    ('over30', 31),
+    ('under30', None),
+]
+
+
+def aging_aggregates(today):
+    """Build aggregates summing balances by invoice age bucket."""
+    aggregates = {}
+    newer_than = None
+    for (name, min_age) in aging_buckets:
+        condition = {}
+        if newer_than:
+            condition['date__gt'] = newer_than
+        if min_age is not None:
+            older_than = today - timedelta(days=min_age)
+            condition['date__lte'] = older_than
+        aggregates[name] = Sum(Case(
+            When(then='total_balance', **condition),
+            default=0, output_field=total_field,
+        ))
+        newer_than = older_than
+    aggregates['total'] = Sum('total_balance')
+    return aggregates
+
+
+def build_statement(client, today=None):
+    """Build statement context of a client's open invoices.
+
+    Open invoices, their payments and aging buckets are each fetched in
+    a single query, independent of the number of invoices. Invoices
+    closed by a year close are settled and not scanned.
+
+    """
+    if not today:
+        today = date.today()
+    invoices = (client.invoice_set.open().with_totals()
+                .exclude(total_balance=0).order_by('no'))
+
+    payments = defaultdict(list)
+    payment_set = (Payment.objects.filter(invoice__in=invoices)
+                   .order_by('invoice', '-date')
+                   .values_list('invoice', 'date', 'amount'))
+    for (invoice_id, payment_date, amount) in payment_set:
+        payments[invoice_id].append((payment_date.strftime(dateformat),
+                                     amount))
+
+    entries = []
+    running_balance = 0
+    for invoice in invoices:
+        e = {}
+        for attr in ['no', 'amount', 'name', 'balance']:
+            e[attr] = getattr(invoice, attr)
+        e['date'] = invoice.date.strftime(dateformat)
+        e['age'] = (today - invoice.date).days
+        running_balance += invoice.balance
+        e['running_balance'] = running_balance
+        e['payments'] = payments[invoice.pk]
+        e['rows'] = max(len(e['payments']), 1)
+        entries.append(e)
+
+    balances = {
+        k: round_total(v) for (k, v) in
+        invoices.aggregate(**aging_aggregates(today)).items()
+    }
+    # The client's owed total comes from its ledger row, which is kept
+    # independently of the invoices summed above.
+    owed = client.owed()
+    assert owed == balances['total'] == running_balance, \
+        "Total balance %s must equal last running balance %s" % (
+            owed,
+            running_balance,
+    )
+
+    return {'date': today,
+            'client': client,
+            'entries': entries,
+            'balances': balances}
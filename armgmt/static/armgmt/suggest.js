@@ -0,0 +1,90 @@
+// List suggestions below textareas with a data-suggest-url attribute.
+(function() {
+    'use strict';
+
+    var selector = 'textarea[data-suggest-url]';
+    var timer = null;
+    var request = null;
+
+    function matches(element) {
+        return element.matches && element.matches(selector);
+    }
+
+    // Prefer a field of the same inline form, as django-autocomplete-light
+    // does, and fall back to a field of the main form.
+    function fieldValue(textarea, name) {
+        var prefix = textarea.name.slice(
+            0, textarea.name.lastIndexOf('-') + 1);
+        var field = (
+            document.querySelector('[name="' + prefix + name + '"]') ||
+            document.querySelector('[name="' + name + '"]'));
+        return field ? field.value : '';
+    }
+
+    function suggestions(textarea) {
+        var list = textarea.nextElementSibling;
+        if (!list || !list.classList.contains('suggestions')) {
+            list = document.createElement('ul');
+            list.className = 'suggestions';
+            textarea.parentNode.insertBefore(list, textarea.nextSibling);
+        }
+        return list;
+    }
+
+    function show(textarea, results) {
+        var list = suggestions(textarea);
+        list.innerHTML = '';
+        results.forEach(function(result) {
+            if (result.create_id || result.text === textarea.value) {
+                return;
+            }
+            var item = document.createElement('li');
+            item.textContent = result.text;
+            item.addEventListener('mousedown', function(event) {
+                // Keep focus in the textarea.
+                event.preventDefault();
+                textarea.value = result.text;
+                list.innerHTML = '';
+            });
+            list.appendChild(item);
+        });
+    }
+
+    function suggest(textarea) {
+        var forward = {};
+        textarea.getAttribute('data-forward').split(',').forEach(
+            function(name) {
+                if (name) {
+                    forward[name] = fieldValue(textarea, name);
+                }
+            });
+        if (request) {
+            request.abort();
+        }
+        request = new XMLHttpRequest();
+        request.open('GET', textarea.getAttribute('data-suggest-url') +
+                     '?q=' + encodeURIComponent(textarea.value) +
+                     '&forward=' +
+                     encodeURIComponent(JSON.stringify(forward)));
+        request.responseType = 'json';
+        request.onload = function() {
+            if (this.status === 200 && this.response) {
+                show(textarea, this.response.results);
+            }
+        };
+        request.send();
+    }
+
+    document.addEventListener('input', function(event) {
+        if (matches(event.target)) {
+            clearTimeout(timer);
+            timer = setTimeout(suggest, 200, event.target);
+        }
+    });
+
+    document.addEventListener('focusout', function(event) {
+        if (matches(event.target)) {
+            suggestions(event.target).innerHTML = '';
+        }
+    });
+})();
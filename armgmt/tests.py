@@ -0,0 +1,684 @@
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+import os
+import sqlite3
+from subprocess import TimeoutExpired
+import tempfile
+import threading
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import OperationalError, connections, router
+from django.test import (RequestFactory, SimpleTestCase, TestCase,
+                         override_settings)
+from django.utils import timezone
+from usps.addressinformation import Address
+
+from armgmt import ledger, routers, search, tex
+from armgmt.admin import InvoiceAdmin
+from armgmt.forms import InvoiceLineItemForm
+from armgmt.management.commands.render_documents import path_name
+from armgmt.management.commands.usps_stub import Handler, ThreadingHTTPServer
+from armgmt.models import (AddressValidation, Biller, Client, ClientBalance,
+                           DocumentNo, Invoice, InvoiceBalance,
+                           InvoiceLineAction, InvoiceLineItem, Payment,
+                           Project, address_stats, allocate_document_no,
+                           document_gaps, get_document_no, validate_address)
+from armgmt.render import RenderBusy
+from armgmt.statement import build_statement
+from armgmt.tools.payments import import_payments
+from armgmt.tools.timesheet import import_timesheets
+from armgmt.views import render_latex
+
+
+@override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+}})
+class ArmgmtTestCase(TestCase):
+    """Test case with a biller, client and project and a local cache.
+
+    The default cache of the settings is the deployment's cache directory,
+    which tests must never clear or fill.
+
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.biller = Biller.objects.create(
+            name='Applemon', firm_name='Applemon', code='C',
+            address2='1 Main St', city='New York', state='NY',
+            zip_code='10001',
+        )
+        self.client_ = self.new_client('Client')
+        self.project = Project.objects.create(
+            biller=self.biller, client=self.client_, name='Project',
+            start_date=date(2017, 1, 2),
+        )
+
+    def new_client(self, name):
+        return Client.objects.create(
+            biller=self.biller, name=name, contact_name='Contact',
+            address2='2 Elm St', city='New York', state='NY',
+            zip_code='10002',
+        )
+
+    def new_invoice(self, no=None, day=date(2017, 6, 1)):
+        return Invoice.objects.create(
+            biller=self.biller, client=self.client_, project=self.project,
+            name='Invoice', no=no, date=day,
+        )
+
+    def add_line_item(self, invoice, qty, unit_price, position=0):
+        return InvoiceLineItem.objects.create(
+            invoice=invoice, position=position, date=invoice.date,
+            content='Work', qty=Decimal(qty), unit_price=Decimal(unit_price),
+        )
+
+
+class LedgerTests(ArmgmtTestCase):
+
+    def assertLedger(self, invoice, amount, paid):
+        row = InvoiceBalance.objects.get(invoice=invoice)
+        self.assertEqual((row.amount, row.paid, row.balance),
+                         (Decimal(amount), Decimal(paid),
+                          Decimal(amount) - Decimal(paid)))
+
+    def assertClientLedger(self, client, billed, paid):
+        row = ClientBalance.objects.get(client=client)
+        self.assertEqual((row.billed, row.paid, row.owed),
+                         (Decimal(billed), Decimal(paid),
+                          Decimal(billed) - Decimal(paid)))
+
+    def test_line_items_and_payments_update_balances(self):
+        invoice = self.new_invoice()
+        item = self.add_line_item(invoice, '1.5', '100.00')
+        self.add_line_item(invoice, '2', '10.00', position=1)
+        payment = Payment.objects.create(invoice=invoice, date=invoice.date,
+                                         amount=Decimal('50.00'))
+        self.assertLedger(invoice, '170.00', '50.00')
+        self.assertClientLedger(self.client_, '170.00', '50.00')
+        item.qty = Decimal('1')
+        item.save()
+        payment.delete()
+        self.assertLedger(invoice, '120.00', '0.00')
+        self.assertClientLedger(self.client_, '120.00', '0.00')
+
+    def test_invoice_totals_are_rounded_to_cents(self):
+        invoice = self.new_invoice()
+        self.add_line_item(invoice, '0.333', '10.00')
+        self.add_line_item(invoice, '0.333', '10.00', position=1)
+        other = self.new_invoice()
+        self.add_line_item(other, '0.333', '10.00')
+        self.assertLedger(invoice, '6.66', '0')
+        self.assertClientLedger(self.client_, '9.99', '0')
+        self.assertEqual(self.client_.owed(), Decimal('9.99'))
+
+    def test_deleted_invoice_leaves_client_totals(self):
+        invoice = self.new_invoice()
+        self.add_line_item(invoice, '1', '100.00')
+        Payment.objects.create(invoice=invoice, date=invoice.date,
+                               amount=Decimal('40.00'))
+        invoice.delete()
+        self.assertFalse(InvoiceBalance.objects.exists())
+        self.assertClientLedger(self.client_, '0', '0')
+
+    def test_invoice_moved_to_another_client(self):
+        other = self.new_client('Other')
+        invoice = self.new_invoice()
+        self.add_line_item(invoice, '1', '100.00')
+        invoice.client = other
+        invoice.project = Project.objects.create(
+            biller=self.biller, client=other, name='Other project',
+            start_date=date(2017, 1, 2),
+        )
+        invoice.save()
+        self.assertClientLedger(self.client_, '0', '0')
+        self.assertClientLedger(other, '100.00', '0')
+
+    def test_bulk_changes_are_refreshed(self):
+        invoice = self.new_invoice()
+        self.add_line_item(invoice, '1', '100.00')
+        InvoiceLineItem.objects.filter(invoice=invoice).update(
+            unit_price=Decimal('80.00'),
+        )
+        ledger.refresh_invoices([invoice.pk])
+        self.assertLedger(invoice, '80.00', '0')
+        self.assertClientLedger(self.client_, '80.00', '0')
+
+    def test_rebuild_matches_deltas(self):
+        invoice = self.new_invoice()
+        self.add_line_item(invoice, '1.25', '33.33')
+        Payment.objects.create(invoice=invoice, date=invoice.date,
+                               amount=Decimal('10.00'))
+        rows = list(InvoiceBalance.objects.values_list(
+            'invoice', 'amount', 'paid', 'balance'))
+        clients = list(ClientBalance.objects.values_list(
+            'client', 'billed', 'paid', 'owed'))
+        ledger.rebuild()
+        self.assertEqual(list(InvoiceBalance.objects.values_list(
+            'invoice', 'amount', 'paid', 'balance')), rows)
+        self.assertEqual(list(ClientBalance.objects.values_list(
+            'client', 'billed', 'paid', 'owed')), clients)
+
+
+class StatementTests(ArmgmtTestCase):
+
+    def test_balances(self):
+        old = self.new_invoice(day=date(2017, 1, 2))
+        self.add_line_item(old, '1', '100.00')
+        Payment.objects.create(invoice=old, date=old.date,
+                               amount=Decimal('30.00'))
+        paid = self.new_invoice(day=date(2017, 5, 1))
+        self.add_line_item(paid, '1', '50.00')
+        Payment.objects.create(invoice=paid, date=paid.date,
+                               amount=Decimal('50.00'))
+        new = self.new_invoice(day=date(2017, 6, 1))
+        self.add_line_item(new, '2', '10.00')
+        context = build_statement(self.client_, date(2017, 6, 10))
+        self.assertEqual([str(e['no']) for e in context['entries']],
+                         [str(old.no), str(new.no)])
+        self.assertEqual(context['entries'][-1]['running_balance'],
+                         Decimal('90.00'))
+        self.assertEqual(context['balances'], {
+            'over90': Decimal('70.00'), 'over60': 0, 'over30': 0,
+            'under30': Decimal('20.00'), 'total': Decimal('90.00'),
+        })
+
+    def test_stale_ledger_fails(self):
+        invoice = self.new_invoice()
+        self.add_line_item(invoice, '1', '100.00')
+        ClientBalance.objects.filter(client=self.client_).update(owed=0)
+        with self.assertRaises(AssertionError):
+            build_statement(self.client_, date(2017, 6, 10))
+
+
+class RerunPatternTests(SimpleTestCase):
+
+    def test_rerun_warnings(self):
+        for line in [
+            b'LaTeX Warning: Label(s) may have changed. Rerun to get '
+            b'cross-references right.',
+            b'LaTeX Warning: There were undefined references.',
+            b"LaTeX Warning: Reference `total' on page 1 undefined",
+            b'Package longtable Warning: Table widths have changed. '
+            b'Rerun LaTeX.',
+            b'Package longtable Warning: Column widths have changed',
+            b'(rerunfilecheck) Rerun to get outlines right',
+        ]:
+            self.assertTrue(tex.rerun_pattern.search(line), line)
+
+    def test_other_lines(self):
+        for line in [
+            b'Package: rerunfilecheck 2016/05/16 v1.8 Rerun checks for '
+            b'auxiliary files (HO)',
+            b'Output written on output.pdf (1 page, 24072 bytes).',
+        ]:
+            self.assertFalse(tex.rerun_pattern.search(line), line)
+
+
+@mock.patch('armgmt.pdfcache.get', return_value=None)
+class RenderLatexTests(SimpleTestCase):
+
+    def render_latex(self):
+        request = RequestFactory().get('/')
+        return render_latex(request, 'latex', 'invoice.pdf')
+
+    def test_busy(self, _get):
+        with mock.patch('armgmt.views.render', side_effect=RenderBusy):
+            response = self.render_latex()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Content-Type'], 'text/plain')
+        self.assertEqual(response['Retry-After'], '10')
+
+    def test_timeout(self, _get):
+        with mock.patch('armgmt.views.render',
+                        side_effect=TimeoutExpired('pdflatex', 1)):
+            response = self.render_latex()
+        self.assertEqual(response.status_code, 503)
+        self.assertIn(b"took too long", response.content)
+        self.assertEqual(response['Retry-After'], '60')
+
+
+class PathNameTests(SimpleTestCase):
+
+    def test_path_name(self):
+        self.assertEqual(path_name('Smith & Co.'), 'Smith__Co.')
+        self.assertEqual(path_name('../../etc/x'), '....etcx')
+        self.assertEqual(path_name('..', 'client-1'), 'client-1')
+        self.assertEqual(path_name('/', 'client-1'), 'client-1')
+
+
+class SequenceTests(ArmgmtTestCase):
+
+    def test_save_allocates_consecutive_nos(self):
+        first = self.new_invoice()
+        second = self.new_invoice()
+        self.assertEqual(first.no, DocumentNo((17, 101)))
+        self.assertEqual(second.no, DocumentNo((17, 102)))
+
+    def test_nos_are_allocated_by_year(self):
+        self.new_invoice()
+        invoice = self.new_invoice(day=date(2018, 1, 2))
+        self.assertEqual(invoice.no, DocumentNo((18, 101)))
+
+    def test_hint_does_not_allocate(self):
+        hint = get_document_no(Invoice, self.biller, date(2017, 6, 1))
+        self.assertEqual(hint, DocumentNo((17, 101)))
+        self.assertEqual(
+            get_document_no(Invoice, self.biller, date(2017, 6, 1)), hint)
+        self.assertEqual(self.new_invoice().no, hint)
+
+    def test_allocated_no_is_never_reused(self):
+        no = allocate_document_no(Invoice, self.biller, date(2017, 6, 1))
+        self.assertEqual(no, DocumentNo((17, 101)))
+        self.assertEqual(self.new_invoice().no, DocumentNo((17, 102)))
+
+    def test_saved_no_is_reserved(self):
+        self.new_invoice(no=DocumentNo((17, 110)))
+        self.assertEqual(self.new_invoice().no, DocumentNo((17, 111)))
+
+    def test_deleting_last_no_releases_it(self):
+        self.new_invoice()
+        self.new_invoice().delete()
+        self.assertEqual(self.new_invoice().no, DocumentNo((17, 102)))
+
+
+class GapTests(ArmgmtTestCase):
+
+    def test_gaps(self):
+        for num in (101, 102, 105):
+            self.new_invoice(no=DocumentNo((17, num)))
+        self.new_invoice(no=DocumentNo((18, 102)), day=date(2018, 1, 2))
+        self.assertEqual(document_gaps(Invoice), [
+            ('C', DocumentNo((17, 103))),
+            ('C', DocumentNo((17, 104))),
+        ])
+
+
+class DocumentNoLookupTests(ArmgmtTestCase):
+
+    def setUp(self):
+        super(DocumentNoLookupTests, self).setUp()
+        self.other = Biller.objects.create(
+            name='Other', firm_name='Other', code='D',
+            address2='1 Main St', city='New York', state='NY',
+            zip_code='10001',
+        )
+        self.invoice = self.new_invoice()
+        self.client_.biller = self.other
+        self.client_.save()
+        self.project.biller = self.other
+        self.project.save()
+        self.other_invoice = Invoice.objects.create(
+            biller=self.other, client=self.client_, project=self.project,
+            name='Invoice', date=date(2017, 6, 1),
+        )
+
+    def search(self, model, term):
+        return set(model.objects.filter(no__startswith=term))
+
+    def test_no_prefixes(self):
+        both = {self.invoice, self.other_invoice}
+        self.assertEqual(self.search(Invoice, '17-1'), both)
+        self.assertEqual(self.search(Invoice, '17101'), both)
+        self.assertEqual(self.search(Invoice, '17-2'), set())
+        self.assertEqual(self.search(Invoice, 'abc'), set())
+
+    def test_biller_code_prefix(self):
+        self.assertEqual(self.search(Invoice, 'CN17-101'), {self.invoice})
+        self.assertEqual(self.search(Invoice, 'dn17'),
+                         {self.other_invoice})
+        self.assertEqual(self.search(Invoice, 'XN17'), set())
+        self.assertEqual(self.search(Invoice, 'CP17'), set())
+        self.assertEqual(self.search(Project, 'DP17'), {self.project})
+        self.assertEqual(self.search(Project, 'CP17'), set())
+        payment = Payment.objects.create(invoice=self.other_invoice,
+                                         amount=Decimal('1.00'))
+        payments = Payment.objects.filter(invoice__no__startswith='DN17')
+        self.assertEqual(list(payments), [payment])
+        payments = Payment.objects.filter(invoice__no__startswith='CN17')
+        self.assertEqual(list(payments), [])
+
+
+class USPSStubTestCase(ArmgmtTestCase):
+    """Test case validating addresses with the usps_stub server.
+
+    Requests are counted through ``execute``, which is ``Address.execute``
+    wrapped in a mock.
+
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.usps_settings = override_settings(
+            USPS_URL='http://127.0.0.1:%d/' % cls.server.server_port,
+            USPS_CACHE_TTL=3600,
+        )
+        cls.usps_settings.enable()
+        super(USPSStubTestCase, cls).setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super(USPSStubTestCase, cls).tearDownClass()
+        cls.usps_settings.disable()
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        super(USPSStubTestCase, self).setUp()
+        patcher = mock.patch.object(Address, 'execute', autospec=True,
+                                    side_effect=Address.execute)
+        self.execute = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def request_sizes(self):
+        """Return the number of addresses of each USPS request."""
+        return [len(call[0][2]) for call in self.execute.call_args_list]
+
+
+class AddressTests(USPSStubTestCase):
+
+    address = ('', '2 Elm St', 'New York', 'NY', '10002')
+
+    def test_cache_hit_makes_no_call(self):
+        response = validate_address(*self.address)
+        self.assertEqual(response['Address2'], '2 ELM ST')
+        self.assertEqual(validate_address(*self.address), response)
+        # Cached under the standardized form too.
+        self.assertEqual(validate_address(
+            '', '2 elm  st', 'New York', 'NY', '10002'), response)
+        validate_address('', response['Address2'], response['City'],
+                         response['State'], response['FullZip'])
+        self.assertEqual(self.execute.call_count, 1)
+        self.assertEqual(address_stats(), {
+            'calls': 1, 'hits': 3, 'unchanged': 0, 'cached': 2,
+        })
+
+    def test_rejection_is_cached(self):
+        for _ in range(2):
+            with self.assertRaises(ValidationError):
+                validate_address('', '', 'New York', '', '')
+        self.assertEqual(self.execute.call_count, 1)
+        self.assertEqual(address_stats()['hits'], 1)
+
+    def test_expired_response_calls_again(self):
+        validate_address(*self.address)
+        AddressValidation.objects.update(
+            validated=timezone.now() - timedelta(seconds=3601))
+        validate_address(*self.address)
+        self.assertEqual(self.execute.call_count, 2)
+        self.assertEqual(address_stats(), {
+            'calls': 2, 'hits': 0, 'unchanged': 0, 'cached': 2,
+        })
+
+    def test_unchanged_client_address_skips_call(self):
+        Client.objects.filter(pk=self.client_.pk).update(
+            address_validation="Validated by USPS.")
+        client = Client.objects.get(pk=self.client_.pk)
+        client.clean()
+        self.assertEqual(self.execute.call_count, 0)
+        self.assertEqual(address_stats()['unchanged'], 1)
+        client.address2 = '3 Elm St'
+        client.clean()
+        self.assertEqual(self.execute.call_count, 1)
+        self.assertEqual((client.address2, client.zip_code),
+                         ('3 ELM ST', '10002-0000'))
+        self.assertEqual(address_stats()['calls'], 1)
+
+
+class RevalidateTests(USPSStubTestCase):
+
+    def revalidate(self, *args):
+        out = StringIO()
+        call_command('revalidate_addresses', '--rate', '0', '--workers', '1',
+                     *args, stdout=out, stderr=out)
+        return out.getvalue()
+
+    def test_batches(self):
+        for i in range(6):
+            self.new_client('Client %d' % i)
+        output = self.revalidate()
+        self.assertEqual(self.request_sizes(), [5, 2])
+        self.assertIn("Validated 7 addresses with 2 requests", output)
+        self.revalidate('--batch-size', '3')
+        self.assertEqual(self.request_sizes(), [5, 2, 3, 3, 1])
+
+    def test_rejected_address_falls_back_to_single_requests(self):
+        for i in range(3):
+            self.new_client('Client %d' % i)
+        Client.objects.filter(name='Client 1').update(address2='')
+        output = self.revalidate()
+        self.assertEqual(self.request_sizes(), [4, 1, 1, 1, 1])
+        self.assertIn("Client 1: Address Not Found.", output)
+        self.assertIn("3 updated, 1 rejected, 0 failed.", output)
+        self.assertEqual(Client.objects.get(name='Client 1').address2, '')
+
+    def test_bulk_update(self):
+        self.new_client('Other')
+        Client.objects.filter(name='Other').update(active=False)
+        output = self.revalidate()
+        self.assertIn("1 updated", output)
+        client = Client.objects.get(pk=self.client_.pk)
+        self.assertEqual(
+            (client.address2, client.city, client.zip_code,
+             client.address_validation),
+            ('2 ELM ST', 'NEW YORK', '10002-0000', "Validated by USPS."))
+        self.assertEqual(Client.objects.get(name='Other').city, 'New York')
+        # Standardized addresses are unchanged and the cache answers.
+        output = self.revalidate('--all', '--cached')
+        self.assertIn("2 addresses with 0 requests", output)
+        self.assertIn("1 updated", output)
+        self.assertEqual(self.execute.call_count, 1)
+
+
+class SearchTests(ArmgmtTestCase):
+
+    def search(self, term, rank=True):
+        return list(search.search(
+            Invoice.objects.all(), InvoiceAdmin.search_index, term,
+            InvoiceAdmin.search_lookups, rank=rank,
+        ))
+
+    def test_words_match_across_rows(self):
+        invoice = self.new_invoice()
+        item = self.add_line_item(invoice, '1', '100.00')
+        item.content = 'Deposition transcript'
+        item.save()
+        Payment.objects.create(invoice=invoice, date=invoice.date,
+                               amount=Decimal('10.00'), notes='Wire')
+        other = self.new_invoice()
+        self.add_line_item(other, '1', '100.00')
+        self.assertEqual(self.search('depo'), [invoice])
+        self.assertEqual(self.search('depo wire'), [invoice])
+        self.assertEqual(self.search('depo check'), [])
+        self.assertEqual(self.search('work', rank=False), [other])
+
+    def test_lookups_and_client_rows(self):
+        invoice = self.new_invoice()
+        self.assertEqual(self.search(str(invoice.no)), [invoice])
+        self.assertEqual(self.search('client 17-101'), [invoice])
+        self.assertEqual(self.search('"other'), [])
+
+
+class LineItemFormTests(ArmgmtTestCase):
+
+    def test_content_is_free_text_with_suggestions(self):
+        widget = InvoiceLineItemForm.base_fields['content'].widget
+        html = widget.render('content', 'First line\nSecond line')
+        self.assertTrue(html.startswith('<textarea'))
+        self.assertIn('data-suggest-url="/autocompletes/lineitem/"', html)
+        self.assertIn('data-forward="client,project"', html)
+        self.assertIn('First line\nSecond line', html)
+
+
+class RouterTests(ArmgmtTestCase):
+
+    def test_writes_go_to_default_under_use_readonly(self):
+        @routers.use_readonly
+        def view():
+            self.assertEqual(router.db_for_write(Client), 'default')
+            return self.new_client('Readonly')
+
+        client = view()
+        self.assertEqual(client._state.db, 'default')
+        self.assertTrue(Client.objects.using('default')
+                        .filter(name='Readonly').exists())
+
+    def test_reads_in_transaction_stay_on_default(self):
+        with routers.readonly():
+            # Test cases run inside a transaction.
+            self.assertEqual(router.db_for_read(Client), 'default')
+
+    def test_readonly_connection_rejects_writes(self):
+        # Test runs mirror the readonly alias to the test database, so
+        # open a database file the way the readonly alias is configured.
+        settings_dict = dict(connections[routers.readonly_alias].settings_dict,
+                             OPTIONS={'uri': True})
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'db.sqlite3')
+            with sqlite3.connect(path) as db:
+                db.execute('CREATE TABLE t (x)')
+            db.close()
+            connection = connections[routers.readonly_alias].__class__(
+                dict(settings_dict, NAME='file:%s?mode=ro' % path),
+                alias=routers.readonly_alias,
+            )
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT COUNT(*) FROM t')
+                    self.assertEqual(cursor.fetchone(), (0,))
+                    with self.assertRaises(OperationalError):
+                        cursor.execute('INSERT INTO t VALUES (1)')
+            finally:
+                connection.close()
+
+
+class PaymentImportTests(ArmgmtTestCase):
+
+    def setUp(self):
+        super(PaymentImportTests, self).setUp()
+        self.invoice = self.new_invoice()
+        self.add_line_item(self.invoice, '1', '100.00')
+
+    def test_import(self):
+        lines = [
+            'Invoice,Date,Amount',
+            '17-101,06/10/2017,40.00,2017-06-20,"$10.00"',
+            'CN17101,06/30/17,5.00',
+        ]
+        (count, errors) = import_payments(lines)
+        self.assertEqual((count, errors), (3, []))
+        self.assertEqual(self.invoice.payment_set.count(), 3)
+        self.assertEqual(InvoiceBalance.objects.get(
+            invoice=self.invoice).balance, Decimal('45.00'))
+
+    def test_errors(self):
+        lines = [
+            '17-101,06/10/2017,40.00',
+            '17-101,06/10/2017,40.00',
+            '17-101,06/11/2017,70.00',
+            '17-199,06/10/2017,1.00',
+            'XN17-101,06/10/2017,1.00',
+            '17-101,13/45/2017,1.00',
+            '17-101,06/10/2017,1.005',
+        ]
+        (count, errors) = import_payments(lines)
+        self.assertEqual(count, 1)
+        self.assertEqual([(line, message) for (line, _, _, _, message)
+                          in errors], [
+            (2, "Duplicate payment."),
+            (3, "Amount exceeds balance of 60.00."),
+            (4, "Unknown invoice."),
+            (5, "Unknown biller code X."),
+            (6, "Unable to parse date 13/45/2017."),
+            (7, "Amount 1.005 must be positive whole cents under 1000000."),
+        ])
+
+    def test_missing_amount(self):
+        (count, errors) = import_payments([
+            '17-101,06/10/2017,40.00,06/20/2017',
+            '17-101,06/11/2017,,06/12/2017,1.00',
+        ])
+        self.assertEqual(count, 2)
+        self.assertEqual(errors, [
+            (1, '17-101', '06/20/2017', '', "Missing amount."),
+            (2, '17-101', '06/11/2017', '', "Missing amount."),
+        ])
+
+    def test_balance_without_ledger_row(self):
+        InvoiceBalance.objects.filter(invoice=self.invoice).delete()
+        (count, errors) = import_payments([
+            '17-101,06/10/2017,60.00',
+            '17-101,06/11/2017,50.00',
+        ])
+        self.assertEqual(count, 1)
+        self.assertEqual(errors[0][4], "Amount exceeds balance of 40.00.")
+
+    def test_dry_run_saves_nothing(self):
+        (count, errors) = import_payments(['17-101,06/10/2017,40.00'],
+                                          dry_run=True)
+        self.assertEqual((count, errors), (1, []))
+        self.assertFalse(Payment.objects.exists())
+
+
+class TimesheetImportTests(ArmgmtTestCase):
+
+    def setUp(self):
+        super(TimesheetImportTests, self).setUp()
+        InvoiceLineAction.objects.create(name='Hours')
+        self.invoice = self.new_invoice()
+        self.add_line_item(self.invoice, '1', '100.00')
+
+    def test_import(self):
+        sheet = [
+            'Date,Description,Hours,Rate,Action,Notes',
+            '2017-06-02,Review,1.5,"$1,000.00",Hours,x',
+            '',
+            '06/03/17,Draft,.25,200,,',
+        ]
+        (invoice, count, errors) = import_timesheets(
+            [('a.csv', sheet)], invoice=self.invoice)
+        self.assertEqual((invoice, count, errors), (self.invoice, 2, []))
+        items = list(self.invoice.invoicelineitem_set.values_list(
+            'position', 'date', 'content', 'qty', 'unit_price',
+            'action__name'))
+        self.assertEqual(items[1:], [
+            (1, date(2017, 6, 2), 'Review', Decimal('1.5'),
+             Decimal('1000.00'), 'Hours'),
+            (2, date(2017, 6, 3), 'Draft', Decimal('.25'),
+             Decimal('200.00'), None),
+        ])
+        self.assertEqual(InvoiceBalance.objects.get(
+            invoice=self.invoice).amount, Decimal('1650.00'))
+
+    def test_new_invoice(self):
+        sheet = ['date,content,qty,unit_price', '2017-07-01,Work,1,100']
+        (invoice, count, errors) = import_timesheets(
+            [('a.csv', sheet)], project=self.project, day=date(2017, 7, 1))
+        self.assertEqual((count, errors), (1, []))
+        self.assertEqual(invoice.no, DocumentNo((17, 102)))
+
+    def test_errors_add_nothing(self):
+        sheets = [
+            ('a.csv', ['date,content,qty,unit_price,action',
+                       '2017-06-02,Review,1000,100,Hours',
+                       'June,,1,100.001,Unknown']),
+            ('b.csv', ['date,content,qty']),
+        ]
+        (invoice, count, errors) = import_timesheets(sheets,
+                                                     invoice=self.invoice)
+        self.assertEqual(count, 0)
+        self.assertEqual([error[:3] for error in errors], [
+            ('b.csv', None, ''),
+            ('a.csv', 2, 'qty'),
+            ('a.csv', 3, 'date'),
+            ('a.csv', 3, 'content'),
+            ('a.csv', 3, 'unit_price'),
+            ('a.csv', 3, 'action'),
+        ])
+        self.assertEqual(self.invoice.invoicelineitem_set.count(), 1)
@@ -1,36 +1,179 @@
+"""Compile LaTeX documents to PDF with pdflatex.
+
+pdflatex is rerun only until the .aux file stops changing, which is
+usually after two passes and after one pass for documents without
+cross-references.
+
+Templates may mark the end of their static preamble with
+``\\csname endofdump\\endcsname``. The preamble up to the marker is then
+dumped once into a precompiled format with the mylatexformat package,
+so later documents skip reloading its packages. Without the marker, or
+if the format cannot be built, documents are compiled from scratch.
+
+"""
+import hashlib
+import logging
 import os
-from subprocess import Popen, PIPE
+import re
+from subprocess import PIPE, Popen, TimeoutExpired
 from shutil import rmtree
 from tempfile import mkdtemp
+from time import monotonic, perf_counter
 
+from django.conf import settings
 
-def pdflatex(latex):
-    latex = latex.encode('utf-8')
-    try:
-        directory = mkdtemp()
-        jobname = 'output'
-        filename = os.path.join(directory, jobname) + '.pdf'
-        for _ in range(3):
-            with open(os.devnull, 'wb') as devnull:
-                if os.name == 'nt':
-                    process = Popen(['pdflatex',
-                                     '--output-directory=%s' % directory,
-                                     '--job-name=%s' % jobname],
-                                    stdin=PIPE, stdout=devnull, stderr=PIPE)
-                else:
-                    process = Popen(['pdflatex',
-                                     '-output-directory', directory,
-                                     '-jobname', jobname],
-                                    stdin=PIPE, stdout=devnull, stderr=PIPE)
-            _stdout, stderr = process.communicate(latex)
+
+logger = logging.getLogger(__name__)
+
+jobname = 'output'
+max_passes = 3
+endofdump = r'\csname endofdump\endcsname'
+# Log warnings of references to the .aux of the previous pass, such as
+# "Rerun to get cross-references right", "There were undefined
+# references", "Label(s) may have changed" and longtable's "Table widths
+# have changed. Rerun LaTeX." and "Column widths have changed", but not
+# the "Rerun checks" banner of the rerunfilecheck package.
+rerun_pattern = re.compile(
+    rb'Rerun to get|[Rr]erun LaTeX|undefined references|'
+    rb'(Reference|Citation) `[^\']*\' on page|'
+    rb'Label\(s\) may have changed|Column widths have changed')
+
+# Hashes of preambles whose format could not be built in this process.
+failed_formats = set()
+
+
+def jobname_args(name):
+    if os.name == 'nt':
+        return ['--job-name=%s' % name]
+    else:
+        return ['-jobname', name]
+
+
+def run_pdflatex(args, directory, deadline=None):
+    """Run pdflatex in directory, returning its stderr.
+
+    Raise TimeoutExpired if pdflatex is still running at the monotonic
+    time deadline.
+
+    """
+    if os.name == 'nt':
+        command = ['pdflatex', '--interaction=nonstopmode'] + args
+    else:
+        command = ['pdflatex', '-interaction', 'nonstopmode'] + args
+    env = dict(os.environ)
+    env['TEXFORMATS'] = settings.LATEX_FORMAT_DIR + os.pathsep
+    with open(os.devnull, 'wb') as devnull:
+        process = Popen(command, cwd=directory, env=env,
+                        stdin=PIPE, stdout=devnull, stderr=PIPE)
+        timeout = None
+        if deadline is not None:
+            timeout = max(deadline - monotonic(), 0)
         try:
-            with open(filename, 'rb') as f:
-                pdf = f.read()
-        except IOError:
-            if stderr:
-                raise OSError(stderr)
-            else:
-                raise
+            _stdout, stderr = process.communicate(b'', timeout=timeout)
+        except TimeoutExpired:
+            process.kill()
+            process.communicate()
+            raise
+    return stderr
+
+
+def read(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except IOError:
+        return None
+
+
+def get_format(latex):
+    """Return name of precompiled format for the static preamble if any.
+
+    The format is built on first use and shared by every document with
+    the same preamble, i.e. rendered from the same template version.
+
+    """
+    if endofdump not in latex or os.name == 'nt':
+        # MiKTeX on Windows does not support mylatexformat formats.
+        return None
+    preamble = latex[:latex.index(endofdump) + len(endofdump)]
+    digest = hashlib.sha256(preamble.encode('utf-8')).hexdigest()[:16]
+    name = 'armgmt-%s' % digest
+    if os.path.exists(os.path.join(settings.LATEX_FORMAT_DIR,
+                                   name + '.fmt')):
+        return name
+    if digest in failed_formats:
+        return None
+    os.makedirs(settings.LATEX_FORMAT_DIR, exist_ok=True)
+    directory = mkdtemp()
+    try:
+        with open(os.path.join(directory, 'preamble.tex'), 'wb') as f:
+            f.write((preamble + '\n\\begin{document}\\end{document}\n')
+                    .encode('utf-8'))
+        start = perf_counter()
+        stderr = run_pdflatex(['-ini'] + jobname_args(name) +
+                              ['&pdflatex', 'mylatexformat.ltx',
+                               'preamble.tex'], directory)
+        fmt = os.path.join(directory, name + '.fmt')
+        if not os.path.exists(fmt):
+            logger.warning("Could not build LaTeX format %s: %s",
+                           name, stderr.decode('utf-8', 'replace'))
+            failed_formats.add(digest)
+            return None
+        # Move into place atomically in case of concurrent builds.
+        os.replace(fmt, os.path.join(settings.LATEX_FORMAT_DIR,
+                                     name + '.fmt'))
+        logger.info("Built LaTeX format %s in %.3fs",
+                    name, perf_counter() - start)
+    finally:
+        rmtree(directory)
+    return name
+
+
+def compile_latex(latex, timeout=None):
+    """Compile LaTeX source to PDF.
+
+    Return the PDF and a list of the duration of each pdflatex pass.
+    Raise TimeoutExpired if compiling takes longer than timeout seconds.
+
+    """
+    deadline = None
+    if timeout is not None:
+        deadline = monotonic() + timeout
+    fmt = get_format(latex)
+    directory = mkdtemp()
+    try:
+        with open(os.path.join(directory, jobname + '.tex'), 'wb') as f:
+            f.write(latex.encode('utf-8'))
+        args = jobname_args(jobname) + [jobname + '.tex']
+        if fmt:
+            args = ['-fmt', fmt] + args
+        aux_path = os.path.join(directory, jobname + '.aux')
+        log_path = os.path.join(directory, jobname + '.log')
+        timings = []
+        aux = None
+        for n in range(max_passes):
+            start = perf_counter()
+            stderr = run_pdflatex(args, directory, deadline)
+            timings.append(perf_counter() - start)
+            new_aux = read(aux_path)
+            if new_aux == aux:
+                # Converged: this pass read the same .aux it wrote.
+                break
+            if n == 0 and not rerun_pattern.search(read(log_path) or b''):
+                # Nothing refers to the first pass .aux.
+                break
+            aux = new_aux
+        logger.info("pdflatex ran %d passes in %s seconds%s", len(timings),
+                    ', '.join('%.3f' % t for t in timings),
+                    ' with format %s' % fmt if fmt else '')
+        pdf = read(os.path.join(directory, jobname + '.pdf'))
+        if pdf is None:
+            raise OSError(stderr or read(log_path))
     finally:
         rmtree(directory)
+    return (pdf, timings)
+
+
+def pdflatex(latex):
+    (pdf, _timings) = compile_latex(latex)
     return pdf
@@ -0,0 +1,183 @@
+"""Import payments from CSV files.
+
+Each row holds an invoice no followed by pairs of payment date and
+amount, as in the payments file read by ``armgmt.gnucash``. Invoice nos
+may be prefixed with a biller code and N, as in ``CN17-101``, and are
+otherwise of the default biller. Dates are of form mm/dd/yyyy, mm/dd/yy
+or yyyy-mm-dd.
+
+Rows are read lazily and checked in chunks. The invoices of a chunk are
+looked up with one query, and each payment is checked for an unknown or
+closed invoice, a duplicate of a stored or earlier payment, and an
+amount over the invoice balance before the valid payments of the chunk
+are inserted with ``bulk_create``. Ledger balances, the search index and
+cached reports are updated once all chunks are in.
+
+"""
+from collections import defaultdict
+import csv
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+import re
+
+from django.db import transaction
+from django.db.models import Max
+from django.db.models.functions import Coalesce
+
+from armgmt import ledger, reports, search
+from armgmt.gnucash import str2date
+from armgmt.models import (Biller, DocumentNo, Invoice, Payment,
+                           get_default_biller_id, round_total)
+
+
+chunk_size = 500
+invoice_pattern = re.compile(r'^(?:([A-Z])N)?(\d{2}-?\d{3})$',
+                             re.IGNORECASE)
+cents = Decimal('.01')
+max_amount = Decimal('1000000')
+
+
+def parse_rows(lines):
+    """Yield (line no, invoice no, date, amount) text of each payment."""
+    reader = csv.reader(lines)
+    for row in reader:
+        if not row or not row[0].strip():
+            continue
+        number = row[0].strip().lower()
+        if number.startswith('invoice') or number.startswith('no'):
+            # Skip header.
+            continue
+        for n in range(1, len(row), 2):
+            if not row[n].strip():
+                break
+            # A trailing date without an amount is checked as a payment
+            # with a missing amount.
+            amount = row[n + 1] if n + 1 < len(row) else ''
+            yield (reader.line_num, row[0].strip(), row[n].strip(),
+                   amount.strip())
+
+
+def parse_invoice(text):
+    """Return (biller code or None, DocumentNo) of an invoice no."""
+    match = invoice_pattern.match(text)
+    if not match:
+        raise ValueError("Unable to parse invoice no. %s." % text)
+    (code, no) = match.groups()
+    return (code and code.upper(), DocumentNo(no))
+
+
+def parse_date(text):
+    try:
+        if '-' in text:
+            return datetime.strptime(text, '%Y-%m-%d').date()
+        return str2date(text)
+    except (IndexError, ValueError):
+        raise ValueError("Unable to parse date %s." % text)
+
+
+def parse_amount(text):
+    if not text:
+        raise ValueError("Missing amount.")
+    try:
+        amount = Decimal(text.replace(',', '').replace('$', ''))
+    except InvalidOperation:
+        raise ValueError("Unable to parse amount %s." % text)
+    if amount <= 0 or amount >= max_amount or amount != amount.quantize(
+            cents):
+        raise ValueError("Amount %s must be positive whole cents under %s." %
+                         (text, max_amount))
+    return amount
+
+
+def check_chunk(rows, billers, seen, pending, errors):
+    """Return valid payments of a chunk of rows, adding errors of others.
+
+    seen holds (invoice id, date, amount) and pending the total amount
+    of the payments already checked by invoice id.
+
+    """
+    parsed = []
+    for row in rows:
+        (line, invoice_text, date_text, amount_text) = row
+        try:
+            (code, no) = parse_invoice(invoice_text)
+            day = parse_date(date_text)
+            amount = parse_amount(amount_text)
+            if code and code not in billers:
+                raise ValueError("Unknown biller code %s." % code)
+        except ValueError as e:
+            errors.append(row + (str(e),))
+            continue
+        parsed.append((row, (billers[code], no), day, amount))
+    # Invoices by (biller id, no) with one query. Invoices without a
+    # ledger row fall back to their computed balance.
+    nos = {int(no) for (_, (_, no), _, _) in parsed}
+    invoices = {
+        (biller_id, DocumentNo(no)): (pk, round_total(balance), close)
+        for (pk, biller_id, no, balance, close) in
+        Invoice.objects.filter(no__in=nos).with_totals()
+        .annotate(due=Coalesce('ledger__balance', 'total_balance'))
+        .values_list('pk', 'biller_id', 'no', 'due', 'close')
+    }
+    invoice_ids = {invoices[key][0] for (_, key, _, _) in parsed
+                   if key in invoices}
+    stored = set(Payment.objects.filter(invoice__in=invoice_ids)
+                 .values_list('invoice_id', 'date', 'amount'))
+    payments = []
+    for (row, key, day, amount) in parsed:
+        invoice = invoices.get(key)
+        if not invoice:
+            errors.append(row + ("Unknown invoice.",))
+            continue
+        (pk, balance, close) = invoice
+        payment = (pk, day, amount)
+        balance -= pending[pk]
+        if close:
+            errors.append(row + ("Invoice is closed.",))
+        elif payment in stored or payment in seen:
+            errors.append(row + ("Duplicate payment.",))
+        elif amount > balance:
+            errors.append(row + ("Amount exceeds balance of %s." % balance,))
+        else:
+            seen.add(payment)
+            pending[pk] += amount
+            payments.append(Payment(invoice_id=pk, date=day, amount=amount))
+    return payments
+
+
+def import_payments(lines, dry_run=False):
+    """Import payments from CSV lines in one transaction.
+
+    Returns the number of payments imported and the (line no, invoice
+    no, date, amount, message) of each payment skipped. With dry_run,
+    all payments are checked but none are saved.
+
+    """
+    billers = dict(Biller.objects.values_list('code', 'pk'))
+    billers[None] = get_default_biller_id()
+    seen = set()
+    pending = defaultdict(Decimal)
+    errors = []
+    count = 0
+    rows = parse_rows(lines)
+    with transaction.atomic():
+        last_pk = Payment.objects.aggregate(last=Max('pk'))['last'] or 0
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            payments = check_chunk(chunk, billers, seen, pending, errors)
+            if not dry_run:
+                Payment.objects.bulk_create(payments)
+            count += len(payments)
+        errors.sort(key=lambda error: error[0])
+        if dry_run:
+            return (count, errors)
+        invoice_ids = list(pending)
+        for i in range(0, len(invoice_ids), chunk_size):
+            ledger.refresh_invoices(invoice_ids[i:i + chunk_size])
+        search.update('payment',
+                      Payment.objects.filter(pk__gt=last_pk).iterator())
+        transaction.on_commit(reports.invalidate)
+    return (count, errors)
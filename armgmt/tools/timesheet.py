@@ -0,0 +1,170 @@
+"""Add invoice line items from timesheet CSV files.
+
+A timesheet starts with a header row naming its columns date, content,
+qty, unit_price and optionally action, in any order. Description, hours
+and rate are accepted for content, qty and unit_price, and other columns
+are ignored. Dates are of form yyyy-mm-dd, mm/dd/yy or mm/dd/yyyy.
+
+The rows of all timesheets are read into one pandas frame and each
+column is checked at once, with action names resolved through the cached
+action ids of ``armgmt.actions``. Only when every row is valid are the
+line items inserted with ``bulk_create`` at the positions following the
+invoice's last line item, so that a long invoice is added in a handful
+of queries. Ledger balances, the search index, line item phrases and
+cached reports are updated once afterwards.
+
+"""
+import csv
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Max
+import pandas as pd
+
+from armgmt import actions, ledger, phrases, reports, search
+from armgmt.models import Invoice, InvoiceLineItem
+
+
+columns = ['date', 'content', 'qty', 'unit_price', 'action']
+required_columns = columns[:-1]
+aliases = {'description': 'content', 'hours': 'qty', 'rate': 'unit_price'}
+date_formats = ['%Y-%m-%d', '%m/%d/%y', '%m/%d/%Y']
+qty_pattern = r'^-?(\d{1,3}(\.\d{0,3})?|\.\d{1,3})$'
+price_pattern = r'^-?(\d{1,6}(\.\d{0,2})?|\.\d{1,2})$'
+
+
+def read_rows(name, lines):
+    """Return a frame of the rows of a timesheet by column.
+
+    Each row is tagged with the file name and its line no.
+
+    """
+    reader = csv.reader(lines)
+    header = None
+    rows = []
+    for row in reader:
+        if not any(field.strip() for field in row):
+            continue
+        if header is None:
+            header = [field.strip().lower().replace(' ', '_')
+                      for field in row]
+            header = [aliases.get(column, column) for column in header]
+            missing = [c for c in required_columns if c not in header]
+            if missing:
+                raise ValueError("Missing columns: %s." % ', '.join(missing))
+            continue
+        fields = dict(zip(header, row))
+        rows.append([name, reader.line_num] +
+                    [fields.get(column, '').strip() for column in columns])
+    if not rows:
+        raise ValueError("No line items.")
+    return pd.DataFrame(rows, columns=['file', 'line'] + columns)
+
+
+def parse_dates(values):
+    dates = pd.to_datetime(values, format=date_formats[0], errors='coerce')
+    for date_format in date_formats[1:]:
+        dates = dates.fillna(pd.to_datetime(values, format=date_format,
+                                            errors='coerce'))
+    return dates
+
+
+def check(frame, action_ids):
+    """Return the parsed columns of a frame and the errors of its rows.
+
+    Errors are (file name, line no, column, value, message).
+
+    """
+    parsed = pd.DataFrame({
+        'date': parse_dates(frame['date']),
+        'qty': frame['qty'].str.replace(',', '', regex=False),
+        'unit_price': frame['unit_price'].str.replace(r'[$,]', '',
+                                                      regex=True),
+        'action': frame['action'].map(action_ids),
+    })
+    checks = [
+        ('date', parsed['date'].isnull(), "Unable to parse date."),
+        ('content', frame['content'] == '', "Content is required."),
+        ('qty', ~parsed['qty'].str.match(qty_pattern),
+         "Quantity must be under 1000 with at most 3 decimals."),
+        ('unit_price', ~parsed['unit_price'].str.match(price_pattern),
+         "Unit price must be whole cents under 1000000."),
+        ('action', (frame['action'] != '') & parsed['action'].isnull(),
+         "Unknown action."),
+    ]
+    errors = []
+    for (column, invalid, message) in checks:
+        rows = frame.loc[invalid, ['file', 'line', column]]
+        errors.extend((name, line, column, value, message)
+                      for (name, line, value) in rows.itertuples(index=False))
+    errors.sort(key=lambda error: error[:2])
+    return (parsed, errors)
+
+
+def line_items(invoice, frame, parsed, start):
+    """Yield unsaved line items of a checked frame from position start."""
+    rows = zip(parsed['date'].dt.date, frame['content'], parsed['qty'],
+               parsed['unit_price'], parsed['action'])
+    for (position, (day, content, qty, unit_price, action_id)) in enumerate(
+            rows, start):
+        yield InvoiceLineItem(
+            invoice=invoice, position=position, date=day, content=content,
+            qty=Decimal(qty), unit_price=Decimal(unit_price),
+            action_id=None if pd.isnull(action_id) else int(action_id),
+        )
+
+
+def new_invoice(project, day):
+    """Return a validated unsaved invoice of a project."""
+    invoice = Invoice(biller=project.biller, client=project.client,
+                      project=project, name=project.name, date=day)
+    invoice.clean()
+    return invoice
+
+
+def import_timesheets(sheets, invoice=None, project=None, day=None):
+    """Add line items from timesheets to an invoice in one transaction.
+
+    sheets are (file name, CSV lines) pairs. Line items are added to
+    invoice if given, or else to a new invoice of project dated day.
+    Returns the invoice, the number of line items added and the (file
+    name, line no, column, value, message) of each error. Nothing is
+    saved unless every row is valid.
+
+    """
+    errors = []
+    frames = []
+    for (name, lines) in sheets:
+        try:
+            frames.append(read_rows(name, lines))
+        except (csv.Error, ValueError) as e:
+            errors.append((name, None, '', '', str(e)))
+    if not frames:
+        return (invoice, 0, errors)
+    frame = pd.concat(frames, ignore_index=True)
+    (parsed, row_errors) = check(frame, actions.action_ids())
+    errors.extend(row_errors)
+    if errors:
+        return (invoice, 0, errors)
+    with transaction.atomic():
+        try:
+            if invoice is None:
+                invoice = new_invoice(project, day)
+                invoice.save()
+            elif invoice.is_closed():
+                raise ValidationError("Invoice %s is closed." % invoice)
+        except ValidationError as e:
+            return (invoice, 0, [('', None, '', '', ' '.join(e.messages))])
+        last = invoice.invoicelineitem_set.aggregate(
+            last=Max('position'))['last']
+        start = 0 if last is None else last + 1
+        items = list(line_items(invoice, frame, parsed, start))
+        InvoiceLineItem.objects.bulk_create(items, batch_size=500)
+        ledger.refresh_invoices([invoice.pk])
+        search.update('lineitem', invoice.invoicelineitem_set.filter(
+            position__gte=start).iterator())
+        phrases.count_many([(item.content, item.date) for item in items],
+                           invoice.client_id, invoice.project_id)
+        transaction.on_commit(reports.invalidate)
+    return (invoice, len(items), errors)
@@ -21,8 +21,27 @@ urlpatterns = [
         name='autocomplete-invoiceno'),
     url(r'autocompletes/projectno/$', views.AutocompleteProjectNo.as_view(),
         name='autocomplete-projectno'),
+    url(r'autocompletes/lineitem/$', views.AutocompleteLineItem.as_view(),
+        name='autocomplete-lineitem'),
     # List report tools.
     url(r'^admin/tools/$', views.ToolsView.as_view(), name='tools'),
+    # Report PDF cache counters.
+    url(r'^admin/tools/pdfcache/$', views.pdf_cache_stats,
+        name='pdfcache-stats'),
+    # Report USPS address validation counters.
+    url(r'^admin/tools/usps/$', views.address_cache_stats,
+        name='usps-stats'),
+    # Tabulate billed and collected amounts by month.
+    url(r'^admin/tools/revenue/$', views.RevenueReportView.as_view(),
+        name='revenue'),
+    # List gaps in document numbering.
+    url(r'^admin/tools/gaps/$', views.GapReportView.as_view(), name='gaps'),
+    # Import payments from file upload.
+    url(r'^admin/tools/payments/$', views.PaymentImportView.as_view(),
+        name='import-payments'),
+    # Add invoice line items from timesheet file upload.
+    url(r'^admin/tools/timesheets/$', views.TimesheetView.as_view(),
+        name='import-timesheets'),
     # Create noise report from file upload.
     url(r'^admin/tools/noise/$', views.NoiseView.as_view(), name='noise'),
 ]
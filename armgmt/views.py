@@ -1,25 +1,35 @@
+import codecs
 from datetime import date
-from decimal import Decimal
-import os
+from subprocess import TimeoutExpired
 from urllib.parse import quote
+import zipfile
 
 from dal.autocomplete import Select2ListView, Select2QuerySetView
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import Http404, HttpResponse, HttpResponseRedirect
-from django.template.loader import render_to_string
+from django.db.models import Q
+from django.http import (Http404, HttpResponse, HttpResponseRedirect,
+                         JsonResponse, StreamingHttpResponse)
 from django.urls import reverse, reverse_lazy
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.decorators import method_decorator
+from django.utils.http import quote_etag
 from django.views.generic import TemplateView
 from django.views.generic.edit import FormView
 
-from armgmt.forms import ToolForm
+from armgmt import pdfcache, reports
+from armgmt.phrases import suggest
+from armgmt.documents import (invoice_filename, invoice_latex,
+                              statement_filename, statement_latex)
+from armgmt.forms import (PaymentImportForm, ReportForm, TimesheetForm,
+                          ToolForm)
 from armgmt.models import (Client, DocumentNo, Invoice, Project,
-                           get_document_no)
-from armgmt.tex import pdflatex
+                           address_stats, document_gaps, get_document_no)
+from armgmt.render import RenderBusy, render
+from armgmt.routers import use_readonly
 from armgmt.tools.noise import generate_noise_report
-
-
-logo_path = os.path.join(os.getcwd(), 'armgmt/templates/armgmt/logo')
+from armgmt.tools.payments import import_payments
+from armgmt.tools.timesheet import import_timesheets
 
 
 def pdf_response(pdf, filename):
@@ -32,11 +42,85 @@ def pdf_response(pdf, filename):
     return response
 
 
-def render_latex(request, template, dictionary, filename):
-    del request  # unused
-    latex = render_to_string(template, dictionary)
-    pdf = pdflatex(latex)
-    return pdf_response(pdf, filename)
+class ZipStream(object):
+    """Unseekable file object buffering what ZipFile writes to it."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_zip(results):
+    """Yield ZIP file chunks of (filename, PDF or exception) results.
+
+    Each PDF is sent as soon as it is available. Exceptions are listed
+    in errors.txt at the end of the ZIP file.
+
+    """
+    stream = ZipStream()
+    errors = []
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_STORED) as zip_file:
+        for (filename, result) in results:
+            if isinstance(result, Exception):
+                errors.append("%s: %s" % (filename, result))
+                continue
+            zip_file.writestr(filename, result)
+            yield stream.pop()
+        if errors:
+            zip_file.writestr('errors.txt', '\n'.join(errors))
+    yield stream.pop()
+
+
+def zip_response(results, filename):
+    response = StreamingHttpResponse(stream_zip(results),
+                                     content_type='application/zip')
+    response['Content-Disposition'] = "attachment; filename*=utf-8''{}".format(
+        quote(filename)
+    )
+    return response
+
+
+def unavailable_response(message, retry_after=10):
+    response = HttpResponse(message, content_type='text/plain', status=503)
+    response['Retry-After'] = retry_after
+    return response
+
+
+def render_latex(request, latex, filename):
+    """Render LaTeX source to PDF, reusing cached PDFs.
+
+    The cache key doubles as ETag, so that clients which already have
+    the PDF receive 304 Not Modified without the PDF being read at all.
+
+    """
+    key = pdfcache.cache_key(latex)
+    etag = quote_etag(key)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        try:
+            pdf = pdfcache.get_or_render(key, lambda: render(latex))
+        except RenderBusy:
+            return unavailable_response(
+                "Too many documents are being rendered. Try again shortly.")
+        except TimeoutExpired:
+            return unavailable_response(
+                "Rendering the document took too long. Try again later.",
+                retry_after=60)
+        response = pdf_response(pdf, filename)
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
 
 
 def index(request):
@@ -46,81 +130,41 @@ def index(request):
 
 
 @login_required
+@use_readonly
 def render_invoice(request, biller_code, invoice_no):
     try:
         invoice = Invoice.objects.select_related().get(
             biller__code=biller_code, no=DocumentNo(invoice_no),
         )
-        line_items = (invoice.invoicelineitem_set.select_related('action')
-                      .order_by('position', 'date')
-                      .all())
     except (ValueError, Invoice.DoesNotExist):
         raise Http404("Invoice %s not found." % invoice_no)
-    dictionary = {'invoice': invoice,
-                  'line_items': line_items,
-                  'logo_path': logo_path}
-    filename = '%s.pdf' % str(invoice.code)
-    return render_latex(request, 'armgmt/invoice.tex', dictionary, filename)
+    return render_latex(request, invoice_latex(invoice),
+                        invoice_filename(invoice))
 
 
 @login_required
+@use_readonly
 def render_statement(request, client_name):
-    dateformat = '%m/%d/%y'
     try:
         client = Client.objects.get(name=client_name)
     except Client.DoesNotExist:
         raise Http404("Client %s not found." % client_name)
-    today = date.today()
-    running_balance = Decimal(0)
-
-    entries = []
-    invoice_set = client.invoice_set.prefetch_related('payment_set').all()
-    for invoice in invoice_set.order_by('no'):
-        if invoice.balance:
-            e = {}
-            for attr in ['no', 'amount', 'name', 'balance']:
-                e[attr] = getattr(invoice, attr)
-            e['date'] = invoice.date.strftime(dateformat)
-            e['age'] = (today - invoice.date).days
-            running_balance += invoice.balance
-            e['running_balance'] = running_balance
-            payments = invoice.payment_set.all()
-            if payments:
-                e['rows'] = len(payments)
-                e['payments'] = []
-                for payment in payments:
-                    e['payments'].append((payment.date.strftime(dateformat),
-                                          payment.amount))
-            else:
-                e['rows'] = 1
-                e['payments'] = []
-            entries.append(e)
-
-    balances = {}
-    balances['total'] = client.owed()
-    assert balances['total'] == running_balance, \
-        "Total balance %s must equal last running balance %s" % (
-            client.owed(),
-            running_balance,
-    )
-    balances['over90'] = (sum(e['balance'] for e in entries
-                          if e['age'] > 90))
-    balances['over60'] = (sum(e['balance'] for e in entries
-                          if e['age'] > 60) - balances['over90'])
-    balances['over30'] = (sum(e['balance'] for e in entries
-                          if e['age'] > 30) - balances['over90'] -
-                          balances['over60'])
-    balances['under30'] = (balances['total'] -
-                           balances['over90'] - balances['over60'] -
-                           balances['over30'])
-
-    context = {'date': today,
-               'client': client,
-               'entries': entries,
-               'balances': balances,
-               'logo_path': logo_path}
-    filename = 'statement-%s.pdf' % client.name.lower()
-    return render_latex(request, 'armgmt/statement.tex', context, filename)
+    return render_latex(request, statement_latex(client),
+                        statement_filename(client))
+
+
+@login_required
+def pdf_cache_stats(request):
+    """Report PDF cache counters for monitoring."""
+    del request  # unused
+    return JsonResponse(pdfcache.stats())
+
+
+@login_required
+def address_cache_stats(request):
+    """Report USPS calls made and avoided for monitoring."""
+    del request  # unused
+    return JsonResponse(address_stats())
 
 
 class ToolsView(LoginRequiredMixin, TemplateView):
@@ -131,9 +175,88 @@ class ToolsView(LoginRequiredMixin, TemplateView):
     def get_context_data(self, **kwargs):
         context = super(ToolsView, self).get_context_data(**kwargs)
         context['title'] = "Tools"
-        context['tool_views'] = [NoiseView]
+        context['tool_views'] = [RevenueReportView, GapReportView,
+                                 PaymentImportView, TimesheetView, NoiseView]
+        return context
+
+
+@method_decorator(use_readonly, name='dispatch')
+class GapReportView(LoginRequiredMixin, TemplateView):
+    """List missing invoice and project no of all billers."""
+
+    template_name = 'armgmt/gaps.html'
+    title = "Document Number Gaps"
+    description = "List missing invoice and project numbers of all billers."
+    url = reverse_lazy('gaps')
+
+    def get_context_data(self, **kwargs):
+        context = super(GapReportView, self).get_context_data(**kwargs)
+        context['title'] = self.title
+        context['reports'] = [(cls._meta.verbose_name_plural.capitalize(),
+                               document_gaps(cls))
+                              for cls in [Invoice, Project]]
+        return context
+
+
+@method_decorator(use_readonly, name='dispatch')
+class RevenueReportView(LoginRequiredMixin, FormView):
+    """Tabulate billed and collected amounts by month."""
+
+    form_class = ReportForm
+    template_name = 'armgmt/report.html'
+    title = "Billing and Collections"
+    description = ("Tabulate billed and collected amounts by month, biller, "
+                   "client or action.")
+    url = reverse_lazy('revenue')
+
+    def get_initial(self):
+        today = date.today()
+        return {'start': date(today.year - 1, 1, 1), 'end': today,
+                'format': 'html'}
+
+    def get_form_kwargs(self):
+        kwargs = super(RevenueReportView, self).get_form_kwargs()
+        if self.request.GET:
+            kwargs['data'] = self.request.GET
+        return kwargs
+
+    def get_context_data(self, **kwargs):
+        context = super(RevenueReportView, self).get_context_data(**kwargs)
+        context['title'] = self.title
+        context['description'] = self.description
         return context
 
+    def get(self, request, *args, **kwargs):
+        form = self.get_form()
+        if not request.GET or not form.is_valid():
+            return self.render_to_response(self.get_context_data(form=form))
+        data = form.cleaned_data
+        table = reports.pivot(
+            data['start'], data['end'], data['group'],
+            data['biller'] and data['biller'].pk,
+            data['client'] and data['client'].pk,
+        )
+        filename = 'report-%s-%s-%s' % (data['group'], data['start'],
+                                         data['end'])
+        if data['format'] == 'csv':
+            response = HttpResponse(reports.to_csv(table),
+                                    content_type='text/csv')
+            response['Content-Disposition'] = (
+                'attachment; filename="%s.csv"' % filename)
+            return response
+        elif data['format'] == 'pdf':
+            subtitle = "%s to %s by %s" % (
+                data['start'].strftime('%B %Y'),
+                data['end'].strftime('%B %Y'), data['group'],
+            )
+            return pdf_response(reports.to_pdf(table, self.title, subtitle),
+                                '%s.pdf' % filename)
+        return self.render_to_response(self.get_context_data(
+            form=form,
+            table=table.to_html(float_format='{:,.2f}'.format,
+                                classes='report'),
+        ))
+
 
 class BaseToolView(LoginRequiredMixin, FormView):
     """Render generic report from data in file upload."""
@@ -153,18 +276,14 @@ class BaseToolView(LoginRequiredMixin, FormView):
     def handler(self, files):
         raise NotImplementedError
 
-    def post(self, request, *args, **kwargs):
-        form = self.get_form()
-        if form.is_valid():
-            files = request.FILES.getlist('files')
-            try:
-                (pdf, filename) = self.handler(files)
-            except AssertionError as e:
-                form.add_error(None, e)
-                return self.form_invalid(form)
-            return pdf_response(pdf, filename)
-        else:
+    def form_valid(self, form):
+        files = self.request.FILES.getlist('files')
+        try:
+            (pdf, filename) = self.handler(files)
+        except AssertionError as e:
+            form.add_error(None, e)
             return self.form_invalid(form)
+        return pdf_response(pdf, filename)
 
 
 class NoiseView(BaseToolView):
@@ -178,17 +297,70 @@ class NoiseView(BaseToolView):
         return generate_noise_report(files)
 
 
+class PaymentImportView(BaseToolView):
+    """Import payments from CSV file upload and list rows skipped."""
+
+    form_class = PaymentImportForm
+    template_name = 'armgmt/payments.html'
+    title = "Import Payments"
+    description = ("Upload CSV files of invoice numbers followed by pairs of "
+                   "payment date and amount to import payments.")
+    url = reverse_lazy('import-payments')
+
+    def form_valid(self, form):
+        dry_run = form.cleaned_data['dry_run']
+        results = []
+        for uploaded_file in self.request.FILES.getlist('files'):
+            (count, errors) = import_payments(
+                codecs.iterdecode(uploaded_file, 'utf-8-sig'), dry_run)
+            results.append((uploaded_file.name, count, errors))
+        return self.render_to_response(self.get_context_data(
+            form=form, dry_run=dry_run, results=results,
+        ))
+
+
+class TimesheetView(BaseToolView):
+    """Add invoice line items from timesheet CSV file upload."""
+
+    form_class = TimesheetForm
+    template_name = 'armgmt/timesheet.html'
+    title = "Import Timesheets"
+    description = ("Upload CSV files of line item date, content, qty, "
+                   "unit_price and action columns to add them to an invoice "
+                   "or a new invoice of a project.")
+    url = reverse_lazy('import-timesheets')
+
+    def form_valid(self, form):
+        data = form.cleaned_data
+        sheets = [(uploaded_file.name,
+                   codecs.iterdecode(uploaded_file, 'utf-8-sig'))
+                  for uploaded_file in self.request.FILES.getlist('files')]
+        (invoice, count, errors) = import_timesheets(
+            sheets, data['invoice'], data['project'], data['date'])
+        return self.render_to_response(self.get_context_data(
+            form=form, invoice=invoice, count=count, errors=errors,
+        ))
+
+
+@method_decorator(use_readonly, name='dispatch')
 class AutocompleteBase(LoginRequiredMixin, Select2QuerySetView):
     """Provide generic autocomplete queryset for form widget."""
 
     qs = None
+    search_fields = []
 
     def get_queryset(self):
         items = {
             k: v for k, v in self.forwarded.items() if v and
             k in (f.name for f in self.qs.model._meta.get_fields())
         }
-        return self.qs.filter(**items)
+        qs = self.qs.filter(**items)
+        if self.q and self.search_fields:
+            query = Q()
+            for field in self.search_fields:
+                query |= Q(**{field: self.q})
+            qs = qs.filter(query)
+        return qs
 
 
 class AutocompleteClient(AutocompleteBase):
@@ -197,12 +369,15 @@ class AutocompleteClient(AutocompleteBase):
 
 class AutocompleteInvoice(AutocompleteBase):
     qs = Invoice.objects.all()
+    search_fields = ['no__startswith', 'name__icontains']
 
 
 class AutocompleteProject(AutocompleteBase):
     qs = Project.objects.all()
+    search_fields = ['no__startswith', 'name__icontains']
 
 
+@method_decorator(use_readonly, name='dispatch')
 class AutocompleteTextBase(LoginRequiredMixin, Select2ListView):
     """Provide generic autocomplete list for form widget."""
 
@@ -231,3 +406,15 @@ class AutocompleteProjectNo(AutocompleteTextBase):
 
     def get_item(self):
         return get_document_no(Project, self.forwarded['biller'])
+
+
+class AutocompleteLineItem(AutocompleteTextBase):
+    """Suggest line item contents, preferring the project's and client's."""
+
+    def get_list(self):
+        return suggest(self.q, self.forwarded.get('client'),
+                       self.forwarded.get('project'))
+
+    def autocomplete_results(self, results):
+        # Suggestions already match the normalized text.
+        return results
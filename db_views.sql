@@ -1,3 +1,9 @@
+-- Closed invoices report the paid totals recorded at their close. Those
+-- before 2012-09-01 were closed as paid in full with any payments recorded
+-- for them on top, as these views counted them before closes existed and
+-- as client totals still count them, so their balance is the negative of
+-- their recorded payments. Later closes record the payments at the close.
+
 DROP VIEW IF EXISTS "invoices";
 CREATE VIEW "invoices" AS
 SELECT client.name client_name,
@@ -7,9 +13,9 @@ SELECT client.name client_name,
        cast(strftime('%Y', invoice.date) as integer) year,
        cast(strftime('%m', invoice.date) as integer) month,
        cast(strftime('%d', invoice.date) as integer) day,
-       round(coalesce(amount, 0), 2) amount,
-       round(coalesce(old_amount, 0) + coalesce(paid, 0), 2) paid,
-       round(coalesce(amount, 0) - coalesce(old_amount, 0) - coalesce(paid, 0), 2) balance,
+       round(coalesce(billed.amount, 0), 2) amount,
+       round(coalesce(closed.paid, paid.paid, 0), 2) paid,
+       round(coalesce(billed.amount, 0) - coalesce(closed.paid, paid.paid, 0), 2) balance,
        invoice.name,
        project.name project_name
 FROM armgmt_invoice invoice
@@ -20,13 +26,7 @@ LEFT JOIN
           sum(qty * unit_price) amount
    FROM armgmt_invoicelineitem
    GROUP BY invoice_id) billed ON billed.invoice_id = invoice.id
-LEFT JOIN
-  (SELECT invoice_id,
-          sum(qty * unit_price) old_amount
-   FROM armgmt_invoicelineitem l
-   INNER JOIN armgmt_invoice i ON i.id = l.invoice_id
-   WHERE i.date < '2012-09-01'
-   GROUP BY invoice_id) old_billed ON old_billed.invoice_id = invoice.id
+LEFT JOIN armgmt_invoiceclose closed ON closed.invoice_id = invoice.id
 LEFT JOIN
   (SELECT invoice_id,
           sum(amount) paid
@@ -53,10 +53,14 @@ SELECT client.name client_name,
        cast(strftime('%Y', invoice.date) as integer) year,
        cast(strftime('%m', invoice.date) as integer) month,
        cast(strftime('%d', invoice.date) as integer) day,
-       round(sum(qty * unit_price), 2) old_amount
-FROM armgmt_invoicelineitem l
-INNER JOIN armgmt_invoice invoice ON invoice.id = l.invoice_id
+       round(closed.paid - coalesce(paid.paid, 0), 2) unrecorded_amount
+FROM armgmt_invoiceclose closed
+INNER JOIN armgmt_invoice invoice ON invoice.id = closed.invoice_id
 LEFT JOIN armgmt_client client ON client.id = invoice.client_id
-WHERE invoice.date < '2012-09-01'
-GROUP BY invoice_id
+LEFT JOIN
+  (SELECT invoice_id,
+          sum(amount) paid
+   FROM armgmt_payment
+   GROUP BY invoice_id) paid ON paid.invoice_id = invoice.id
+WHERE round(closed.paid - coalesce(paid.paid, 0), 2) != 0
 ORDER BY payment.date ASC;